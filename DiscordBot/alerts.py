@@ -0,0 +1,174 @@
+# alerts.py
+import time
+import asyncio
+import discord
+from config import config
+from metrics import metrics
+from breaker import Unavailable
+from verdict import Skipped
+
+DESCRIPTORS = ["Safe", "Potential Violation", "Probable Violation", "Clear Violation"]
+COLORS = [
+    discord.Color.from_rgb(0, 255, 0),     # green
+    discord.Color.from_rgb(255, 255, 0),   # yellow
+    discord.Color.from_rgb(255, 165, 0),   # orange
+    discord.Color.from_rgb(255, 0, 0)      # red
+]
+NO_VERDICT_COLOR = discord.Color.from_rgb(128, 128, 128) # grey
+PENDING = "⏳ Pending..."
+UNAVAILABLE = "⚠️ Unavailable"
+
+
+def harm_counter(results: dict) -> int:
+    """
+    Counts the providers that consider the message a violation: one vote per prompt classifier,
+    and one if the moderation endpoint flagged any category. Providers without a result, or that were
+    unavailable, don't vote. A provider the cascade skipped votes with the verdict of the stage that
+    decided the message, so a decided message lands in the bucket the full ensemble would agree on
+    (Safe or Clear Violation).
+    """
+    answered = {name: r for name, r in results.items() if not isinstance(r, Unavailable)}
+    count = 0
+    for name in ("openai_prompt", "gemini_prompt"):
+        if name in answered and answered[name].violation:
+            count += 1
+    moderation = answered.get("openai_moderation")
+    if isinstance(moderation, Skipped):
+        count += moderation.violation
+    elif moderation is not None and any(flagged for flagged, _ in moderation.values()):
+        count += 1
+    return count
+
+
+def unavailable_field(response: Unavailable) -> str:
+    return f"{UNAVAILABLE} ({response.reason})"
+
+
+def skipped_field(response: Skipped) -> str:
+    return f"⏭️ Not asked (decided by {response.decided_by})"
+
+
+def prompt_field(response, missing: str = PENDING) -> str:
+    if response is None:
+        return missing
+    if isinstance(response, Unavailable):
+        return unavailable_field(response)
+    if isinstance(response, Skipped):
+        return skipped_field(response)
+    return f"Classifier: {int(response.violation)}, Confidence: {response.confidence}"
+
+
+def moderation_field(response, missing: str = PENDING) -> str:
+    if response is None:
+        return missing
+    if isinstance(response, Unavailable):
+        return unavailable_field(response)
+    if isinstance(response, Skipped):
+        return skipped_field(response)
+    mod_api_report = ""
+    for key in response:
+        mod_api_report += f"{key}: {response[key][0]}\n"
+    return mod_api_report
+
+
+def build_embed(message, results: dict, missing: str = PENDING) -> discord.Embed:
+    """
+    Builds the "Automatic LGBT Violation Report" embed from whichever provider results are in
+    :param results: Map from provider name to response; absent providers are shown as `missing`
+    """
+    embed = discord.Embed(
+        title="Automatic LGBT Violation Report",
+        description=f"Message content: {message.content}",
+    )
+
+    if (message.author.avatar):
+        embed.set_thumbnail(url=message.author.avatar.url)
+    embed.add_field(name="OpenAI Policy Violation Detection:", value=prompt_field(results.get("openai_prompt"), missing), inline=False)
+    embed.add_field(name="Gemini Policy Violation Detection:", value=prompt_field(results.get("gemini_prompt"), missing), inline=False)
+    embed.add_field(name="OpenAI Moderation API Detection:", value=moderation_field(results.get("openai_moderation"), missing), inline=False)
+
+    harm = harm_counter(results)
+    waiting = 3 - len(results) if missing == PENDING else 0
+    unavailable = sum(isinstance(r, Unavailable) for r in results.values()) + (3 - len(results) if missing != PENDING else 0)
+    skipped = sum(isinstance(r, Skipped) for r in results.values())
+    if not waiting and unavailable == 3:
+        # Nobody answered, so there is no verdict to show; the mods have to look at the message themselves
+        embed.set_author(name="Classification unavailable")
+        embed.color = NO_VERDICT_COLOR
+    else:
+        notes = []
+        if waiting:
+            notes.append(f"{waiting} pending")
+        if unavailable:
+            notes.append(f"{unavailable} unavailable")
+        if skipped:
+            notes.append(f"{skipped} not asked")
+        embed.set_author(name=DESCRIPTORS[harm] + (f" ({', '.join(notes)})" if notes else ""))
+        embed.color = COLORS[harm]
+
+    footer_msg = f"Message Author: {message.author.name}\n"
+    footer_msg += "If you would like to see the message in context, click on the link below:\n"
+    footer_msg += f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}\n"
+    embed.add_field(name="Message Details", value=footer_msg)
+    return embed
+
+
+class ProgressiveAlert:
+    """
+    Posts the mod-channel alert as soon as the first provider answers, then edits it in place as
+    the others come in. Edits are debounced: results that arrive within `min_edit_interval` of the
+    last edit are folded into a single edit, keeping us inside Discord's edit rate limits.
+    """
+
+    def __init__(self, message, mod_channel, send, min_edit_interval: float = None):
+        self.message = message
+        self.mod_channel = mod_channel
+        self.send = send
+        self.min_edit_interval = config["alerts"]["min_edit_interval"] if min_edit_interval is None else min_edit_interval
+        self.results = {}
+        self.started = time.perf_counter()
+        self.alert_message = None
+        self.last_edit = 0.0
+        self.failed = False
+        self.changed = asyncio.Event()
+        self.worker = None
+
+    def update(self, name: str, response):
+        """
+        Records one provider's result; called as each provider returns
+        """
+        self.results[name] = response
+        self.changed.set()
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    def fail(self):
+        """
+        Marks the remaining providers as unavailable, e.g. after the classification failed
+        """
+        self.failed = True
+        self.changed.set()
+
+    async def _run(self):
+        while True:
+            await self.changed.wait()
+            if self.alert_message is not None:
+                await asyncio.sleep(max(0.0, self.last_edit + self.min_edit_interval - time.perf_counter()))
+            self.changed.clear()
+            embed = build_embed(self.message, dict(self.results), UNAVAILABLE if self.failed else PENDING)
+            if self.alert_message is None:
+                self.alert_message = await self.send(self.mod_channel, embed=embed)
+                metrics.observe("time_to_first_alert_seconds", time.perf_counter() - self.started)
+            else:
+                with metrics.timer("discord_edit"):
+                    await self.alert_message.edit(embed=embed)
+            self.last_edit = time.perf_counter()
+            if (len(self.results) == 3 or self.failed) and not self.changed.is_set():
+                return
+
+    async def finish(self):
+        """
+        Waits until the alert shows every result that has come in
+        """
+        if self.worker is not None:
+            await self.worker
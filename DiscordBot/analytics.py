@@ -0,0 +1,262 @@
+# analytics.py
+"""
+Offline analysis of evaluation runs.
+
+Every run stores its raw per-row results (id, label, classification, confidence) as columnar NumPy
+arrays in config["evaluation"]["scores_dir"]. Everything here works on those arrays without asking
+the models again: confusion matrices, precision / recall / F1 at every threshold, ROC and PR curves,
+calibration, and a side-by-side comparison of the providers and of the harm_counter vote ensemble.
+
+Usage:
+    python analytics.py compare <file> <model> [<model> ...]
+    python analytics.py sweep <file> <model> [--steps N]
+"""
+import os
+import argparse
+import numpy as np
+from config import config
+
+
+def scores_path(file: str, model: str) -> str:
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(config["evaluation"]["scores_dir"], f"{name}.{model}.npz")
+
+
+class ScoreTable:
+    """
+    Per-row results of one evaluation run, one array per column
+    """
+
+    def __init__(self, ids, labels, classifications, confidences):
+        self.ids = np.asarray(ids, dtype=str)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.classifications = np.asarray(classifications, dtype=np.int8)
+        self.confidences = np.asarray(confidences, dtype=np.float32)
+
+    @classmethod
+    def from_records(cls, records: list) -> "ScoreTable":
+        return cls(
+            [r["id"] for r in records],
+            [r["label"] for r in records],
+            [r["classification"] for r in records],
+            [r["confidence"] for r in records],
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreTable":
+        data = np.load(path)
+        return cls(data["ids"], data["labels"], data["classifications"], data["confidences"])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, ids=self.ids, labels=self.labels, classifications=self.classifications,
+                            confidences=self.confidences)
+
+    @property
+    def scores(self) -> np.ndarray:
+        """
+        Probability of a violation implied by each answer: the confidence when the model said 1, and
+        one minus it when the model said 0
+        """
+        return np.where(self.classifications == 1, self.confidences, 1 - self.confidences)
+
+    def select(self, ids: np.ndarray) -> "ScoreTable":
+        """
+        The rows with the given IDs, in that order
+        """
+        order = np.argsort(self.ids)
+        index = order[np.searchsorted(self.ids, ids, sorter=order)]
+        return ScoreTable(self.ids[index], self.labels[index], self.classifications[index], self.confidences[index])
+
+
+def confusion(labels: np.ndarray, predictions: np.ndarray) -> dict:
+    labels, predictions = labels.astype(bool), predictions.astype(bool)
+    return {
+        "true_positive": int(np.sum(labels & predictions)),
+        "true_negative": int(np.sum(~labels & ~predictions)),
+        "false_positive": int(np.sum(~labels & predictions)),
+        "false_negative": int(np.sum(labels & ~predictions)),
+    }
+
+
+def rates(tp, fp, fn, tn) -> dict:
+    """
+    Precision, recall, F1, false positive rate and accuracy from confusion counts (scalars or arrays)
+    """
+    tp, fp, fn, tn = (np.asarray(x, dtype=float) for x in (tp, fp, fn, tn))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        fpr = np.where(fp + tn > 0, fp / (fp + tn), 0.0)
+        accuracy = np.where(tp + fp + fn + tn > 0, (tp + tn) / (tp + fp + fn + tn), 0.0)
+    return {"precision": precision, "recall": recall, "f1": f1, "fpr": fpr, "accuracy": accuracy}
+
+
+def threshold_sweep(labels: np.ndarray, scores: np.ndarray, thresholds: np.ndarray = None) -> dict:
+    """
+    Confusion counts and rates when flagging every row with score >= threshold, for every threshold
+    at once: one sort plus a cumulative sum, instead of a pass over the data per threshold
+    :param thresholds: Thresholds to evaluate; defaults to every distinct score
+    """
+    labels = labels.astype(bool)
+    if thresholds is None:
+        thresholds = np.unique(scores)[::-1]
+    thresholds = np.asarray(thresholds, dtype=float)
+    order = np.argsort(-scores, kind="stable")
+    sorted_scores, sorted_labels = scores[order], labels[order]
+    true_cum = np.concatenate([[0], np.cumsum(sorted_labels)])
+    # Number of rows with score >= t, found by binary search in the descending scores
+    flagged = np.searchsorted(-sorted_scores, -thresholds, side="right")
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    tp = true_cum[flagged]
+    fp = flagged - tp
+    fn = positives - tp
+    tn = negatives - fp
+    return {"thresholds": thresholds, "tp": tp, "fp": fp, "fn": fn, "tn": tn, **rates(tp, fp, fn, tn)}
+
+
+def roc_curve(labels: np.ndarray, scores: np.ndarray) -> tuple:
+    """
+    :return: (false positive rates, true positive rates, thresholds), starting from the origin
+    """
+    sweep = threshold_sweep(labels, scores)
+    return (np.concatenate([[0.0], sweep["fpr"]]), np.concatenate([[0.0], sweep["recall"]]),
+            np.concatenate([[np.inf], sweep["thresholds"]]))
+
+
+def pr_curve(labels: np.ndarray, scores: np.ndarray) -> tuple:
+    """
+    :return: (precisions, recalls, thresholds)
+    """
+    sweep = threshold_sweep(labels, scores)
+    return sweep["precision"], sweep["recall"], sweep["thresholds"]
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    fpr, tpr, _ = roc_curve(labels, scores)
+    return float(np.trapezoid(tpr, fpr))
+
+
+def average_precision(labels: np.ndarray, scores: np.ndarray) -> float:
+    """
+    Area under the PR curve, as the recall-weighted mean of precision
+    """
+    precision, recall, _ = pr_curve(labels, scores)
+    return float(np.sum(np.diff(np.concatenate([[0.0], recall])) * precision))
+
+
+def calibration(labels: np.ndarray, scores: np.ndarray, bins: int = 10) -> dict:
+    """
+    Compares predicted violation probability with the observed violation rate in equal-width bins
+    :return: Per-bin mean score, observed rate and count, plus the expected calibration error
+    """
+    index = np.minimum((scores * bins).astype(int), bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_score = np.bincount(index, weights=scores, minlength=bins) / counts
+        observed = np.bincount(index, weights=labels.astype(float), minlength=bins) / counts
+    gaps = np.nan_to_num(np.abs(mean_score - observed))
+    return {
+        "mean_score": mean_score,
+        "observed_rate": observed,
+        "counts": counts,
+        "ece": float(np.sum(gaps * counts) / max(1, counts.sum())),
+    }
+
+
+def summarize_table(table: ScoreTable) -> dict:
+    """
+    Headline metrics of one run: rates at the model's own 0/1 answer, threshold-free curve areas,
+    calibration error, and the threshold that maximises F1
+    """
+    scores = table.scores
+    counts = confusion(table.labels, table.classifications)
+    at_answer = {k: float(v) for k, v in rates(counts["true_positive"], counts["false_positive"],
+                                                counts["false_negative"], counts["true_negative"]).items()}
+    sweep = threshold_sweep(table.labels, scores)
+    best = int(np.argmax(sweep["f1"])) if len(sweep["f1"]) else 0
+    return {
+        "total": len(table.labels),
+        "confusion_matrix": counts,
+        **at_answer,
+        "roc_auc": roc_auc(table.labels, scores),
+        "average_precision": average_precision(table.labels, scores),
+        "ece": calibration(table.labels, scores)["ece"],
+        "best_f1": float(sweep["f1"][best]) if len(sweep["f1"]) else 0.0,
+        "best_f1_threshold": float(sweep["thresholds"][best]) if len(sweep["thresholds"]) else 0.0,
+    }
+
+
+def compare(tables: dict) -> dict:
+    """
+    Side-by-side metrics for several models on the rows they all classified, plus the vote ensemble
+    the bot's harm_counter uses: a message counts as flagged at level k when at least k models flag it
+    :param tables: Map from model name to its ScoreTable on the same dataset
+    :return: Map from row name (model, or "votes>=k") to summary metrics
+    """
+    common = None
+    for table in tables.values():
+        common = table.ids if common is None else np.intersect1d(common, table.ids)
+    aligned = {name: table.select(common) for name, table in tables.items()}
+    rows = {name: summarize_table(table) for name, table in aligned.items()}
+
+    if len(aligned) > 1:
+        labels = next(iter(aligned.values())).labels
+        votes = np.sum([t.classifications for t in aligned.values()], axis=0)
+        for k in range(1, len(aligned) + 1):
+            counts = confusion(labels, votes >= k)
+            rows[f"votes>={k}"] = {
+                "total": len(labels),
+                "confusion_matrix": counts,
+                **{key: float(v) for key, v in rates(counts["true_positive"], counts["false_positive"],
+                                                     counts["false_negative"], counts["true_negative"]).items()},
+            }
+        # Mean violation probability across models, as a threshold-free ensemble score
+        mean_scores = np.mean([t.scores for t in aligned.values()], axis=0)
+        flagged = mean_scores >= 0.5
+        rows["mean_score"] = summarize_table(ScoreTable(common, labels, flagged, np.where(flagged, mean_scores, 1 - mean_scores)))
+    return rows
+
+
+def format_comparison(rows: dict) -> str:
+    columns = ("precision", "recall", "f1", "accuracy", "roc_auc", "average_precision", "ece")
+    lines = [f"{'model':<16} {'rows':>7} " + " ".join(f"{c[:9]:>9}" for c in columns)]
+    for name, row in rows.items():
+        values = " ".join(f"{row[c]:>9.3f}" if c in row else f"{'-':>9}" for c in columns)
+        lines.append(f"{name:<16} {row['total']:>7} {values}")
+    return "\n".join(lines)
+
+
+def format_sweep(sweep: dict) -> str:
+    lines = [f"{'threshold':>9} {'precision':>9} {'recall':>9} {'f1':>9} {'fpr':>9}"]
+    for i in range(len(sweep["thresholds"])):
+        lines.append(f"{sweep['thresholds'][i]:>9.2f} {sweep['precision'][i]:>9.3f} {sweep['recall'][i]:>9.3f} "
+                     f"{sweep['f1'][i]:>9.3f} {sweep['fpr'][i]:>9.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse stored evaluation results")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compare_parser = sub.add_parser("compare")
+    compare_parser.add_argument("file")
+    compare_parser.add_argument("models", nargs="+")
+    sweep_parser = sub.add_parser("sweep")
+    sweep_parser.add_argument("file")
+    sweep_parser.add_argument("model")
+    sweep_parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        tables = {model: ScoreTable.load(scores_path(args.file, model)) for model in args.models}
+        print(format_comparison(compare(tables)))
+    else:
+        table = ScoreTable.load(scores_path(args.file, args.model))
+        thresholds = np.linspace(1, 0, args.steps + 1)
+        print(format_sweep(threshold_sweep(table.labels, table.scores, thresholds)))
+
+
+if __name__ == "__main__":
+    main()
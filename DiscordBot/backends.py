@@ -0,0 +1,196 @@
+# backends.py
+"""
+Classifier backends and the registry that builds them from config.
+
+Each slot of the detection pipeline ("openai_prompt", "openai_moderation", "gemini_prompt") is
+filled by a backend chosen in config["backends"]. The remote backends wrap the existing provider
+functions; the lexicon and replay backends run entirely offline, so the bot and the evaluation
+tools can be exercised without API keys or network access.
+
+A backend's classify() returns what the slot expects: prompt slots return a Verdict (see verdict.py),
+and the moderation slot returns the category -> (flagged, score) dict. fingerprint() describes
+everything besides the config entry that determines its answers (model, instructions, word list),
+so stored evaluation predictions are reused only while it is unchanged. The prompt backends accept a
+"policy_path" option to classify against a policy other than the live one.
+"""
+import os
+import re
+import json
+import random
+import asyncio
+from typing import Protocol
+from config import config
+from prompts import ASSETS_DIR, PromptRegistry, registry
+from verdict_cache import content_key, normalize
+from verdict import Verdict, encode_response, decode_response
+
+PROMPT = "prompt"
+MODERATION = "moderation"
+
+# Map from backend type name to its class
+BACKENDS = {}
+
+
+class ClassifierBackend(Protocol):
+    name: str
+    kind: str # PROMPT or MODERATION
+
+    async def classify(self, message: str):
+        ...
+
+    def fingerprint(self) -> str:
+        ...
+
+
+def register(name: str):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def policy_registry(policy_path: str):
+    """
+    The shared prompt registry, or one for another policy file (e.g. a draft being evaluated)
+    """
+    if not policy_path:
+        return registry
+    return PromptRegistry(policy_path, config["prompts"]["reload_check_interval"])
+
+
+@register("openai_prompt")
+class OpenAIPromptBackend:
+    kind = PROMPT
+
+    def __init__(self, policy_path: str = ""):
+        self.prompts = policy_registry(policy_path)
+
+    async def classify(self, message: str) -> Verdict:
+        # Imported on first use so offline deployments never need the OpenAI key
+        from openai_genai import evaluate_msg_promptbased_openai
+        return await evaluate_msg_promptbased_openai(message, self.prompts.get("openai"))
+
+    def fingerprint(self) -> str:
+        return "gpt-4.1-mini\n" + self.prompts.get("openai")
+
+
+@register("openai_moderation")
+class OpenAIModerationBackend:
+    kind = MODERATION
+
+    async def classify(self, message: str) -> dict:
+        from openai_genai import evaluate_msg_moderation_api_openai
+        return await evaluate_msg_moderation_api_openai(message)
+
+    def fingerprint(self) -> str:
+        return "text-moderation-latest"
+
+
+@register("gemini_prompt")
+class GeminiPromptBackend:
+    kind = PROMPT
+
+    def __init__(self, policy_path: str = ""):
+        self.prompts = policy_registry(policy_path)
+
+    async def classify(self, message: str) -> Verdict:
+        from google_genai import evaluate_msg_promptbased_gemini
+        return await evaluate_msg_promptbased_gemini(message, self.prompts.get("gemini"))
+
+    def fingerprint(self) -> str:
+        return "gemini-1.5-flash\n" + self.prompts.get("gemini")
+
+
+@register("lexicon")
+class LexiconBackend:
+    """
+    Deterministic word-list classifier. Flags a message if it contains any term from the lexicon file
+    (one term or phrase per line), with confidence growing with the number of matches.
+    """
+
+    def __init__(self, kind: str = PROMPT, path: str = ""):
+        self.kind = kind
+        with open(path or os.path.join(ASSETS_DIR, 'lexicon.txt'), encoding='utf8') as f:
+            terms = [normalize(line) for line in f if line.strip() and not line.startswith('#')]
+        self.pattern = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in terms) + r')\b')
+
+    async def classify(self, message: str):
+        hits = len(self.pattern.findall(normalize(message)))
+        score = min(0.99, 0.6 + 0.1 * hits) if hits else 0.0
+        if self.kind == MODERATION:
+            flagged = hits > 0
+            return {
+                "harrassment": (flagged, score),
+                "harrassment_threatening": (False, 0.0),
+                "hate": (flagged, score),
+                "hate_threatening": (False, 0.0),
+            }
+        return Verdict(True, round(score, 2)) if hits else Verdict(False, 0.6)
+
+    def fingerprint(self) -> str:
+        return self.pattern.pattern
+
+
+@register("replay")
+class ReplayBackend:
+    """
+    Serves responses recorded from a live backend (see record_response), looked up by the
+    normalized content hash of the message, after an injected delay that mimics network latency.
+    """
+
+    def __init__(self, kind: str = PROMPT, path: str = "", slot: str = "", latency_ms: float = 0,
+                 jitter_ms: float = 0, default=None):
+        self.kind = kind
+        self.path = path
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.default = None if default is None else decode_response("openai_moderation" if kind == MODERATION else slot, default)
+        self.responses = {}
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                record = json.loads(line)
+                if slot and record["slot"] != slot:
+                    continue
+                self.responses[record["key"]] = decode_response(record["slot"], record["response"])
+
+    async def classify(self, message: str):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        response = self.responses.get(content_key(message), self.default)
+        if response is None:
+            raise KeyError(f"No recorded response for message: {message[:50]}")
+        return response
+
+    def fingerprint(self) -> str:
+        return f"{self.path}\n{os.stat(self.path).st_mtime}"
+
+
+def record_response(path: str, slot: str, message: str, response):
+    """
+    Appends a live response in the format ReplayBackend reads
+    """
+    with open(path, "a", encoding='utf8') as f:
+        f.write(json.dumps({"key": content_key(message), "slot": slot, "response": encode_response(response)}) + "\n")
+
+
+def create_backend(spec: dict, slot: str = "") -> ClassifierBackend:
+    """
+    Builds a backend from its config entry, e.g. {"type": "replay", "path": "recorded.jsonl", "latency_ms": 80}
+    """
+    options = {k: v for k, v in spec.items() if k != "type"}
+    cls = BACKENDS[spec["type"]]
+    if cls is ReplayBackend:
+        options.setdefault("slot", slot)
+    if cls in (LexiconBackend, ReplayBackend):
+        options.setdefault("kind", MODERATION if slot == "openai_moderation" else PROMPT)
+    return cls(**options)
+
+
+def load_backends(settings: dict = None) -> dict:
+    """
+    Builds the backend for every slot of the detection pipeline
+    :return: Map from slot name to backend
+    """
+    settings = settings or config["backends"]
+    return {slot: create_backend(settings[slot], slot) for slot in ("openai_prompt", "openai_moderation", "gemini_prompt")}
@@ -0,0 +1,66 @@
+# batcher.py
+import asyncio
+
+
+class MicroBatcher:
+    """
+    Collects items submitted within a short window (or until `max_batch_size` is reached) and hands
+    them to `flush_fn` as a single list. `flush_fn` is a coroutine function that returns one result
+    per item, in order; each caller of submit() gets back its own result.
+    """
+
+    def __init__(self, flush_fn, window: float = 0.005, max_batch_size: int = 32):
+        self.flush_fn = flush_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.pending = [] # (item, future) pairs waiting for the next flush
+        self.timer = None
+        self.tasks = set() # Flushes currently awaiting their response
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+        if self.pending:
+            # More than one batch's worth arrived at once; send the remainder right after
+            self.timer = asyncio.get_running_loop().call_soon(self.flush)
+        # Callers that timed out while waiting no longer need a result
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.flush_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0,
+        }
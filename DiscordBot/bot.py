@@ -1,14 +1,13 @@
 # bot.py
 import discord
-from discord.ext import commands
 import os
+import asyncio
+import argparse
 import json
-import csv
 import logging
 import re
-import requests
+import collections
 from report import Report
-import pdb
 
 # There should be a file called 'tokens.json' inside the same folder as this file
 token_path = 'tokens.json'
@@ -18,16 +17,35 @@ with open(token_path) as f:
     # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
     tokens = json.load(f)
     discord_token = tokens['discord']
-    os.environ["GEMINI_API_KEY"] = tokens["gemini"]
-    os.environ["OPENAI_API_KEY"] = tokens["openai"]
+    # Provider keys are only needed when the matching backends are configured (see config.py)
+    if "gemini" in tokens:
+        os.environ["GEMINI_API_KEY"] = tokens["gemini"]
+    if "openai" in tokens:
+        os.environ["OPENAI_API_KEY"] = tokens["openai"]
+
+# launcher.py runs one process per group of shards; run directly, the bot runs every shard itself
+parser = argparse.ArgumentParser()
+parser.add_argument("--shard-count", type=int, default=None)
+parser.add_argument("--shard-ids", type=int, nargs="+", default=None)
+parser.add_argument("--process-index", type=int, default=0)
+args = parser.parse_args()
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "./google-service-account.json"
 # google imports must come after the above line
-from google_genai import test_generate_gemini
-from google_genai import run_evaluation_gemini
-from google_genai import evaluate_msg_promptbased_gemini
-from openai_genai import evaluate_msg_promptbased_openai
-from openai_genai import evaluate_msg_moderation_api_openai
+from classify import classify_message, screen_message
+from config import config
+from prefilter import load_prefilter
+from report_store import ReportStore, USER_REVIEW, PENDING
+from metrics import metrics, monitor_loop_lag, serve_metrics
+from alerts import ProgressiveAlert, harm_counter
+from risk_index import RiskIndex, LIGHT, FULL, ESCALATED
+from breaker import Unavailable
+from scheduler import lane, FLAGGED, LIVE
+from channel_registry import ChannelRegistry
+from outbound import Outbox
+from job_queue import JobQueue
+from classify_service import ServiceClient
+import evaluation
 
 # Set up logging to the console
 logger = logging.getLogger('discord')
@@ -37,20 +55,128 @@ handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(me
 logger.addHandler(handler)
 
 
-class ModBot(discord.Client):
-    def __init__(self): 
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, shard_ids=None, shard_count=None, process_index=0): 
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+        self.process_index = process_index # Position among the launcher's processes, to keep ports and spill files apart
         self.group_num = 3
-        self.mod_channels = {} # Map from guild to the mod channel id for that guild
+        self.channels = ChannelRegistry(config["channels"]) # Monitored and mod channels of every guild, kept current from events
+        self.reaction_stats = {"reactions": 0, "ignored": 0, "fetches_avoided": 0}
         self.reports = {} # Map from user IDs to the state of their report
-        self.user_review = {} # Map from report message IDs to the report
-        self.post_review = {}
+        self.report_store = ReportStore(config["report_store"]["path"]) # Reports awaiting (or done with) moderator review
+        self.eval_tasks = set() # Evaluations running in the background
+        service = config["classification_service"]
+        # With the classification service enabled, the pre-filter and providers run in that process instead
+        # A request may run every provider in turn (the cascade), so it gets their timeouts combined
+        self.classifier = ServiceClient(service["host"], service["port"], sum(config["classifier_timeouts"].values())) if service["enabled"] else None
+        self.prefilter = None if self.classifier else load_prefilter() # None when no pre-filter model has been trained
+        queue_settings = config["classification_queue"]
+        # Each process spills to its own file, so no process reads back jobs another one spilled
+        spill_root, spill_ext = os.path.splitext(queue_settings["spill_path"])
+        self.classification_queue = JobQueue(self.classify_channel_message, **{**queue_settings, "spill_path": f"{spill_root}.{process_index}{spill_ext}"})
+        self.risk_index = RiskIndex(**config["risk_index"]) # Per-author risk, which decides how deeply messages are classified
+        metrics.add_collector("risk_index", self.risk_index.stats)
+        metrics.add_collector("classification_queue", self.classification_queue.stats)
+        self.outbox = Outbox(self.deliver, **config["outbound"]) # Every message the bot sends, joined and paced per channel
+        metrics.add_collector("outbound", self.outbox.stats)
+        self.background_tasks = set() # Metrics endpoint, loop-lag monitor, periodic summary and report outbox
+        self.outbox_wakeup = asyncio.Event() # Set when a report is filed, so local guilds get it without waiting for a poll
+        metrics.add_collector("reactions", lambda: self.reaction_stats)
+        if self.prefilter:
+            metrics.add_collector("prefilter", self.prefilter.stats)
         
 
+    async def setup_hook(self):
+        # Runs once before connecting, unlike on_ready which fires again on every reconnect
+        self.classification_queue.start()
+        coros = [self.deliver_pending_reports(config["sharding"]["outbox_poll_interval"]), self.risk_index.run()]
+        settings = config["metrics"]
+        if settings["enabled"]:
+            await serve_metrics(settings["host"], settings["port"] + self.process_index)
+            coros += [monitor_loop_lag(), self.post_metrics_summaries(settings["summary_interval"])]
+        for coro in coros:
+            task = asyncio.create_task(coro)
+            self.background_tasks.add(task)
+
+    async def post_metrics_summaries(self, interval: float):
+        if not interval:
+            return
+        await self.wait_until_ready()
+        while True:
+            await asyncio.sleep(interval)
+            # Sized to fit one message, and sent on its own so it is never joined with other lines and split
+            summary = metrics.summary(config["outbound"]["max_length"])
+            for mod_channel in list(self.channels.mod_channels.values()):
+                await self.send(mod_channel, summary, alone=True)
+
+    async def deliver_pending_reports(self, interval: float):
+        """
+        Posts filed reports to the mod channel of their guild. DMs all arrive on shard 0, so the report
+        may have been filed in another process; every process picks up the reports for its own shards
+        from the shared store. Cards of reports that other users have since reported too are edited in
+        place, once per pass however many reports arrived in between.
+        """
+        await self.wait_until_ready()
+        shard_ids = self.shard_ids if self.shard_ids is not None else range(self.shard_count)
+        while True:
+            # A report that cannot be delivered (e.g. the bot lost access to the mod channel) stays
+            # pending and is tried again next pass, without holding up the others
+            for record in self.report_store.pending_reports(list(shard_ids), self.shard_count):
+                mod_channel = self.channels.mod_channel(record["guild_id"])
+                if mod_channel is None:
+                    continue
+                try:
+                    bot_message = await self.send(mod_channel, self.report_card(self.report_store.group(record["id"])), alone=True)
+                except Exception as e:
+                    print(f"Could not post report {record['id']}: {e!r}")
+                    continue
+                self.report_store.mark_posted(record["id"], bot_message.id)
+            for record in self.report_store.stale_cards(list(shard_ids), self.shard_count):
+                mod_channel = self.channels.mod_channel(record["guild_id"])
+                if mod_channel is None:
+                    continue
+                card = mod_channel.get_partial_message(record["card_message_id"])
+                try:
+                    with metrics.timer("discord_edit"):
+                        await card.edit(content=self.report_card(self.report_store.group(record["id"])))
+                except discord.errors.NotFound:
+                    pass # The card was deleted; the reports stay reviewable from their prompts
+                except Exception as e:
+                    print(f"Could not update the card of report {record['id']}: {e!r}")
+                    continue
+                self.report_store.mark_card_updated(record["id"])
+            try:
+                await asyncio.wait_for(self.outbox_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.outbox_wakeup.clear()
+
+    async def send(self, channel, content=None, alone: bool = False, **kwargs):
+        """
+        Sends a message to a channel or user through the outbox, which joins it with other lines queued
+        for the same destination and paces sends to Discord's rate limits
+        :param alone: Send the content as a message of its own, e.g. a report card moderators react to
+        :return: The Discord message the content went out in
+        """
+        return await self.outbox.send(channel, content, alone=alone, **kwargs)
+
+    async def send_all(self, channel, contents: list, alone: bool = False):
+        """
+        Sends several lines to a channel or user together, normally as a single message
+        :param alone: Keep other queued lines out of that message
+        :return: The (last) Discord message they went out in
+        """
+        return await self.outbox.send_all(channel, contents, alone=alone)
+
+    async def deliver(self, channel, content=None, **kwargs):
+        # The outbox's single request to Discord, timed for the metrics
+        with metrics.timer("discord_send"):
+            return await channel.send(content, **kwargs)
+
     async def on_ready(self):
-        print(f'{self.user.name} has connected to Discord! It is these guilds:')
+        print(f'{self.user.name} has connected to Discord on shards {sorted(self.shards)} of {self.shard_count}! It is these guilds:')
         for guild in self.guilds:
             print(f' - {guild.name}')
         print('Press Ctrl-C to quit.')
@@ -62,12 +188,30 @@ class ModBot(discord.Client):
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
 
-        # Find the mod channel in each guild that this bot should report to
+        # Find the monitored and mod channels in each guild; events keep this current from here on
+        self.channels.set_group(self.group_num)
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
-        
+            self.channels.add_guild(guild)
+        metrics.add_collector("channels", self.channels.stats)
+
+    async def on_guild_join(self, guild):
+        self.channels.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.channels.remove_guild(guild)
+
+    async def on_guild_channel_create(self, channel):
+        if isinstance(channel, discord.TextChannel):
+            self.channels.add_channel(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        if isinstance(after, discord.TextChannel):
+            self.channels.update_channel(before, after)
+
+    async def on_guild_channel_delete(self, channel):
+        if isinstance(channel, discord.TextChannel):
+            self.channels.remove_channel(channel)
+
 
     async def on_message(self, message):
         '''
@@ -104,45 +248,74 @@ class ModBot(discord.Client):
             return
         action = valid_reacts[payload.emoji.name]
         print(f"Action: {action}")
+        # Every decision feeds the author's risk score; "unsure" is how the user gets flagged in the system
+        self.risk_index.record(report["guild_id"], report["author_id"], action)
 
-        # Take action based on the reaction
+        # Take action based on the reaction. The mod-channel lines of each action go out as one message
+        # (the follow-up prompt included, kept apart from other reports' lines since moderators react
+        # to it); once it is posted, the DM to the author and the notice in the reported channel follow
         if action == 'ban':
-            banned_user = report.message.author
-            print(f"Banning user: {banned_user.name}")
-            await message.channel.send(f'{banned_user.name} has been banned from group {self.group_num}.')
-            bot_msg = await message.channel.send(reacts_msg)
-            self.post_review[bot_msg.id] = self.user_review.pop(message.id) 
-            await report.message.channel.send(f"User {banned_user.name} has been banned by a moderator for {report.reason}.")
+            banned_name = report["author_name"]
+            print(f"Banning user: {banned_name}")
+            channel = await self.reported_channel(report)
+            bot_msg = await self.act(
+                self.send_all(message.channel, [f'{banned_name} has been banned from group {self.group_num}.', reacts_msg], alone=True),
+                *([lambda: self.send(channel, f"User {banned_name} has been banned by a moderator for {report['reason']}.")] if channel else []),
+            )
+            self.report_store.move_to_post_review(report["id"], bot_msg.id, action)
         elif action == 'warn':
-            warned_user = report.message.author
+            warned_user = await self.reported_author(report)
             print(f"Warning user: {warned_user.name}")
-            await message.channel.send(f'{warned_user.name} has been sent a warning through direct message.')
-            warning = f"**Warning:** A message you have sent in group {self.group_num} has been flagged for review by a moderator. \n"
-            warning += f"This post may contain language that is considered {report.reason}. \n"
-            warning += "Please be mindful of the language you use in this group. \n"
-            warning += "If you have any questions, please reach out to a moderator."
-            await warned_user.send(warning)
-
-            bot_msg = await message.channel.send(reacts_msg)
-            self.post_review[bot_msg.id] = self.user_review.pop(message.id) # Remove the report from under review
+            bot_msg = await self.act(
+                self.send_all(message.channel, [f'{warned_user.name} has been sent a warning through direct message.', reacts_msg], alone=True),
+                lambda: self.send(warned_user, self.warning(report)),
+            )
+            self.report_store.move_to_post_review(report["id"], bot_msg.id, action) # Remove the report from under review
 
         elif action == 'ignore':
-            await message.channel.send(f'The report from {user.name} has been disregarded.')
-            await message.channel.send(f'**This report is finished.**')
-            self.user_review.pop(message.id)
+            await self.send_all(message.channel, [f'The report from {user.name} has been disregarded.', f'**This report is finished.**'])
+            self.report_store.close(report["id"], action)
         
         elif action == 'unsure':
-            await message.channel.send(f'If the user has been flagged in the past, please forward this report to an advanced moderator for further review.')
-            await message.channel.send(f'This user will be flagged in the system and warned in case of future reports.')
-            
-            warned_user = report.message.author
-            warning = f"**Warning:** A message you have sent in group {self.group_num} has been flagged for review by a moderator. \n"
-            warning += f"This post may contain language that is considered {report.reason}. \n"
-            warning += "Please be mindful of the language you use in this group. \n"
-            warning += "If you have any questions, please reach out to a moderator."
-            await warned_user.send(warning)
-            bot_msg = await message.channel.send(reacts_msg)
-            self.post_review[bot_msg.id] = self.user_review.pop(message.id)
+            warned_user = await self.reported_author(report)
+            bot_msg = await self.act(
+                self.send_all(message.channel, [
+                    f'If the user has been flagged in the past, please forward this report to an advanced moderator for further review.',
+                    f'This user will be flagged in the system and warned in case of future reports.',
+                    reacts_msg,
+                ], alone=True),
+                lambda: self.send(warned_user, self.warning(report)),
+            )
+            self.report_store.move_to_post_review(report["id"], bot_msg.id, action)
+
+    async def act(self, prompt, *side_effects):
+        """
+        Sends a moderator-channel message, then runs the side effects of the moderator action (a DM to
+        the author, a notice or deletion in the reported channel) concurrently. A failed side effect,
+        such as a DM to a user who has them closed, is logged rather than raised, so the report still
+        moves on.
+        :param prompt: Coroutine sending the moderator-channel message
+        :param side_effects: Coroutine functions, only called once the prompt has been sent
+        :return: The result of `prompt`
+        """
+        # If the prompt fails the report stays where it was and moderators react again, so nothing
+        # may have happened yet that a second reaction would repeat (such as a warning DM)
+        result = await prompt
+        outcomes = await asyncio.gather(*(effect() for effect in side_effects), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                print(f"Moderator action side effect failed: {outcome!r}")
+        return result
+
+    def warning(self, report) -> str:
+        """
+        The DM sent to the author of a reported message when a moderator warns them
+        """
+        warning = f"**Warning:** A message you have sent in group {self.group_num} has been flagged for review by a moderator. \n"
+        warning += f"This post may contain language that is considered {report['reason']}. \n"
+        warning += "Please be mindful of the language you use in this group. \n"
+        warning += "If you have any questions, please reach out to a moderator."
+        return warning
 
     
     async def handle_post_review(self, message, report, payload, user):
@@ -159,34 +332,110 @@ class ModBot(discord.Client):
         action = valid_reacts[payload.emoji.name]
         print(f"Action: {action}")
 
+        finished = f'**This report is finished.**'
         if action == 'delete':
-            message_author = report.message.author
-            await message.channel.send(f'The reported message from {message_author} has been deleted.')
-            await report.message.delete() # CHECK IN A BIT
-            self.post_review.pop(message.id)
+            message_author = report["author_name"]
+            await self.act(
+                self.send_all(message.channel, [f'The reported message from {message_author} has been deleted.', finished]),
+                lambda: self.delete_reported_message(report),
+            )
+            self.report_store.close(report["id"], action)
         elif action == 'disclaimer':
-            message_author = report.message.author
-            await message.channel.send(f'The reported message from {message_author} has received a disclaimer.')
+            message_author = report["author_name"]
             # SEND DISCLAIMER MESSAGE IN REPLY ON CHANNEL OF REPORTED MESSAGE
             disclaimer_msg = "**Disclaimer:** This message has been flagged for review by a moderator. \n"
-            disclaimer_msg += f"This post may contain language that is considered {report.reason}. \n"
-            await report.message.reply(disclaimer_msg)
+            disclaimer_msg += f"This post may contain language that is considered {report['reason']}. \n"
+            channel = await self.reported_channel(report)
+            await self.act(
+                self.send_all(message.channel, [f'The reported message from {message_author} has received a disclaimer.', finished]),
+                *([lambda: self.send(channel, disclaimer_msg, reference=channel.get_partial_message(report["message_id"]))] if channel else []),
+            )
         
-            self.post_review.pop(message.id)
+            self.report_store.close(report["id"], action)
         elif action == 'ignore':
-            await message.channel.send(f'No further action will be taken on the reported message.')
+            await self.send_all(message.channel, [f'No further action will be taken on the reported message.', finished])
             # await message.channel.send(f'Moderation flow complete.')
-            self.post_review.pop(message.id)
-        
-        await message.channel.send(f'**This report is finished.**')
+            self.report_store.close(report["id"], action)
+
+    async def delete_reported_message(self, report):
+        channel = await self.reported_channel(report)
+        if channel is None:
+            return # The channel, and the message with it, is gone
+        try:
+            await channel.get_partial_message(report["message_id"]).delete()
+        except discord.errors.NotFound:
+            pass # Already deleted by its author or another moderator
 
     
+    async def reported_channel(self, report):
+        """
+        Looks up the channel of a reported message, from the cache if possible
+        :return: The channel, or None if it was deleted or the bot can no longer see it
+        """
+        channel = self.get_channel(report["channel_id"])
+        if channel is None:
+            try:
+                channel = await self.fetch_channel(report["channel_id"])
+            except (discord.errors.NotFound, discord.errors.Forbidden):
+                print(f"The channel of report {report['id']} is no longer available")
+        return channel
+
+    async def reported_author(self, report):
+        """
+        Looks up the author of a reported message, from the cache if possible
+        """
+        return self.get_user(report["author_id"]) or await self.fetch_user(report["author_id"])
+
+    def report_card(self, reports: list) -> str:
+        """
+        The mod-channel message for a reported message, built from the store records of every report
+        of it (the primary report first)
+        """
+        report = reports[0]
+        report_data = []
+        if len(reports) == 1:
+            report_data.append(f"_Report from {report['reporter_name']} ({report['reporter_id']})_")
+        else:
+            # Name the first few reporters only, so a pile-on cannot push the card past Discord's length limit
+            reporters = ", ".join(f"{r['reporter_name']} ({r['reporter_id']})" for r in reports[:10])
+            if len(reports) > 10:
+                reporters += f" and {len(reports) - 10} more"
+            report_data.append(f"_Reported by {len(reports)} users: {reporters}_")
+        report_data.append(f"**Message:** \n```{report['content']}\n```")
+        if len(reports) == 1:
+            report_data.append(f"**Reason**: {report['reason']}")
+            report_data.append(f"**Category**: {report['category']}")
+        else:
+            reasons = collections.Counter(r["reason"] for r in reports)
+            categories = collections.Counter(r["category"] for r in reports)
+            report_data.append("**Reasons**: " + ", ".join(f"{reason} ({n})" for reason, n in reasons.most_common()))
+            report_data.append("**Categories**: " + ", ".join(f"{category} ({n})" for category, n in categories.most_common()))
+        details = sum(r["has_details"] for r in reports)
+        blocks = sum(r["should_block"] for r in reports)
+        if len(reports) == 1 and details:
+            report_data.append("📝 **User would like to provide more details to a moderator.**")
+        elif details:
+            report_data.append(f"📝 **{details} of {len(reports)} reporters would like to provide more details to a moderator.**")
+        if len(reports) == 1 and blocks:
+            report_data.append("🚫 **User has requested to block this user from contacting them further.**")
+        elif blocks:
+            report_data.append(f"🚫 **{blocks} of {len(reports)} reporters have requested to block this user from contacting them further.**")
+        report_data.append("Report complete. \n")
+        report_data.append("If you would like to see the message in context, click on the link below:")
+        report_data.append(f"https://discord.com/channels/{report['guild_id']}/{report['channel_id']}/{report['message_id']}\n")
+        report_data.append("**To take action**, react to this message with one of the following:")
+        report_data.append("🔨 to ban the user")
+        report_data.append("⚠️ to warn the user")
+        report_data.append("❌ to ignore the report")
+        report_data.append("❓ if you are unsure of what to do")
+        return "\n".join(report_data)
+
     async def handle_dm(self, message):
         # Handle a help message
         if message.content == Report.HELP_KEYWORD:
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            await self.send(message.channel, reply)
             return
 
         author_id = message.author.id
@@ -202,266 +451,179 @@ class ModBot(discord.Client):
 
         # Let the report class handle this message; forward all the messages it returns to uss
         responses = await self.reports[author_id].handle_message(message)
-        for r in responses:
-            await message.channel.send(r)
+        metrics.inc("dm_report_steps_total", state=self.reports[author_id].state.name)
+        await self.send_all(message.channel, responses)
 
         # If the report is complete or cancelled, remove it from our map
         if self.reports[author_id].report_complete():
-            # Send report information to mod channel for further action
+            # Send report information to mod channel for further action. The report goes through the
+            # shared store, so whichever process serves the reported message's guild posts it
             complete_report = self.reports.pop(author_id)
-            # print(self.mod_channels)
-            mod_channel = self.mod_channels[complete_report.guild_id] # CHANGE
-            reported_msg = complete_report.message
-            # print(reported_msg)
-            
-            report_data = []
-            report_data.append(f"_Report from {message.author.name} ({message.author.id})_")
-            report_data.append(f"**Message:** \n```{reported_msg.content}\n```")
-            report_data.append(f"**Reason**: {complete_report.reason}")
-            report_data.append(f"**Category**: {complete_report.category}")
-            if complete_report.has_details:
-                report_data.append("📝 **User would like to provide more details to a moderator.**")
-            if complete_report.should_block:
-                report_data.append("🚫 **User has requested to block this user from contacting them further.**")
-            report_data.append("Report complete. \n")
-            report_data.append("If you would like to see the message in context, click on the link below:")
-            report_data.append(f"https://discord.com/channels/{complete_report.guild_id}/{reported_msg.channel.id}/{reported_msg.id}\n")
-            report_data.append("**To take action**, react to this message with one of the following:")
-            report_data.append("🔨 to ban the user")
-            report_data.append("⚠️ to warn the user")
-            report_data.append("❌ to ignore the report")
-            report_data.append("❓ if you are unsure of what to do")
-            
-            bot_message = await mod_channel.send("\n".join(report_data))
-            self.user_review[bot_message.id] = complete_report
+            if complete_report.message is None:
+                return # Cancelled before a message was chosen
+            self.report_store.add(complete_report, message.author, None, state=PENDING)
+            self.outbox_wakeup.set()
 
             
     async def handle_channel_message(self, message):
-        # Only handle messages sent in the "group-#" channel
-        if not message.channel.name == f'group-{self.group_num}':
+        # Only handle messages sent in a monitored channel (by default "group-#")
+        if message.channel.id not in self.channels.monitored_ids:
             return
 
+        # Classification happens on the queue's workers, so the gateway handler returns straight away
+        # however busy they are. The author's risk decides how deeply the message is checked, and
+        # escalated authors skip ahead of the queue
+        depth = self.risk_index.depth(message.guild.id, message.author.id)
+        metrics.inc("classification_depth_total", depth=depth)
+        payload = {"channel_id": message.channel.id, "message_id": message.id, "depth": depth}
+        self.classification_queue.put(payload, message, urgent=depth == ESCALATED)
+
+    async def classify_channel_message(self, payload: dict, message=None):
+        """
+        Classifies a queued channel message and posts the result to the mod channel. Jobs read back from
+        the spill file only carry IDs, so their message is fetched again (and skipped if it is gone).
+        """
+        if message is None:
+            channel = self.get_channel(payload["channel_id"])
+            if channel is None:
+                return
+            try:
+                message = await channel.fetch_message(payload["message_id"])
+            except discord.errors.NotFound:
+                return
+        depth = payload.get("depth", FULL)
+        # Workers handle one job after another, so the lane is set for every job rather than reset
+        lane.set(FLAGGED if depth == ESCALATED else LIVE)
+
         # Forward the message to the mod channel
-        mod_channel = self.mod_channels[message.guild.id]
+        mod_channel = self.channels.mod_channel(message.guild.id)
+        if mod_channel is None:
+            print(f"No mod channel in {message.guild.name}; not classifying message {message.id}")
+            return
         
-        res = self.eval_text(message.content)
+        # The alert is posted as soon as the first provider answers and filled in as the others do
+        alert = ProgressiveAlert(message, mod_channel, self.send)
+        with metrics.timer("eval_text"):
+            try:
+                res = await self.eval_text(message.content, on_result=alert.update, depth=depth)
+            except Exception:
+                alert.fail()
+                await alert.finish()
+                raise
         type, msg = res[0], res[1]
+        if type == "SAFE":
+            # The local pre-filter (or the light screening) is confident this message is benign, so nothing is posted
+            self.risk_index.record_clean(message.guild.id, message.author.id)
+            return
+
         if type == "EVAL":
-            await mod_channel.send(msg)
+            # Evaluations take a long time, so they run in the background and report to the mod channel
+            task = asyncio.create_task(self.run_evaluation(res[2], res[3], mod_channel))
+            self.eval_tasks.add(task)
+            task.add_done_callback(self.eval_tasks.discard)
+            await self.send(mod_channel, msg)
             return
 
         if type == "AUTODETECT":
-          openai_prompt_res = res[2]
-          openai_mod_res = res[3]
-          gemini_prompt_res = res[4]
-
-          openai_p_classifier, openai_p_confidence = openai_prompt_res.split(" ")
-          gemini_p_classifier, gemini_p_confidence = gemini_prompt_res.split(" ")
-
-          embed = discord.Embed(
-            title="Automatic LGBT Violation Report",
-            description=f"Message content: {message.content}",
-          )
-
-          if (message.author.avatar):
-            embed.set_thumbnail(url=message.author.avatar.url)
-          embed.add_field(name="OpenAI Policy Violation Detection:", value=f"Classifier: {openai_p_classifier}, Confidence: {openai_p_confidence}", inline=False)
-          embed.add_field(name="Gemini Policy Violation Detection:", value=f"Classifier: {gemini_p_classifier}, Confidence: {gemini_p_confidence}", inline=False)
-
-          descriptors = ["Safe", "Potential Violation", "Probable Violation", "Clear Violation"]
-          colors = [
-              discord.Color.from_rgb(0, 255, 0),     # green
-              discord.Color.from_rgb(255, 255, 0),   # yellow
-              discord.Color.from_rgb(255, 165, 0),  # orange
-              discord.Color.from_rgb(255, 0, 0)      # red
-          ]
-          
-          harm_counter = 0
-          if openai_p_classifier == "1":
-              harm_counter += 1 
-          if gemini_p_classifier == "1":
-              harm_counter += 1
-          for key in openai_mod_res:
-              if openai_mod_res[key][0]:
-                  harm_counter += 1
-                  break
-          
-          mod_api_report = ""
-          for key in openai_mod_res:
-              mod_api_report += f"{key}: {openai_mod_res[key][0]}\n"
-
-          embed.add_field(name="OpenAI Moderation API Detection:", value=mod_api_report, inline=False)
-          embed.set_author(name=descriptors[harm_counter])
-          embed.color = colors[harm_counter]
-
-          footer_msg = f"Message Author: {message.author.name}\n"
-          footer_msg += "If you would like to see the message in context, click on the link below:\n"
-          footer_msg += f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}\n"
-          embed.add_field(name="Message Details", value=footer_msg)
-
-          await mod_channel.send(embed=embed)
-
+            # Every result has been handed to the alert; wait for its last edit to go out
+            await alert.finish()
+            results = {"openai_prompt": res[2], "openai_moderation": res[3], "gemini_prompt": res[4]}
+            votes = harm_counter(results)
+            if votes:
+                self.risk_index.record(message.guild.id, message.author.id, "auto_flag", votes / len(results))
+            elif not any(isinstance(r, Unavailable) for r in results.values()):
+                # Only a full set of verdicts counts towards a clean history
+                self.risk_index.record_clean(message.guild.id, message.author.id)
 
 
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
     
-        # Get the guild, channel, and message from the payload
-        guild = self.get_guild(payload.guild_id)
-        channel = guild.get_channel(payload.channel_id)
-        if channel not in self.mod_channels.values():
+        # Everything below runs from the payload and the report store, so reactions on messages we
+        # are not tracking are dropped without touching the network
+        self.reaction_stats["reactions"] += 1
+        if payload.channel_id not in self.channels.mod_channel_ids or payload.user_id == self.user.id:
+            self.reaction_stats["ignored"] += 1
+            return
+        if not self.report_store.is_open_review(payload.message_id):
+            self.reaction_stats["ignored"] += 1
             return
-        message = await channel.fetch_message(payload.message_id)
+
+        # Get the report associated with this message
+        report = self.report_store.by_review_message(payload.message_id)
+        if report is None:
+            return
+
+        # The handlers only need to reply in the mod channel, which a partial message supports
+        message = self.get_channel(payload.channel_id).get_partial_message(payload.message_id)
+        self.reaction_stats["fetches_avoided"] += 1
 
         # Get the user who reacted
-        # user = guild.get_member(payload.user_id)
-        # print(user)
         user = payload.member
-        print(user)
 
         # Print a test message to the console
-        print(f'{user} reacted with {payload.emoji} to message: "{message.content}"')
-
-        if message.id not in self.user_review and message.id not in self.post_review:
-            return
-        
-       
-
-        if message.id in self.user_review:
-             # Get the report associated with this message
-            report = self.user_review[message.id]
+        print(f'{user} reacted with {payload.emoji} to report {report["id"]} ({report["state"]})')
 
+        if report["state"] == USER_REVIEW:
             await self.handle_user_review(message, report, payload, user)
 
-            
-
         else:
-            # Get the report associated with this message
-            report = self.post_review[message.id]
-
             await self.handle_post_review(message, report, payload, user)
 
            
-    def eval_text(self, message):
+    async def eval_text(self, message, on_result=None, depth=FULL):
      
         if (message.startswith("gemini eval: ")):
             # create confusion matrix based on the file given
             print("Running gemini evaluation on file: " + message[13:])
-            msg = self.run_evaluation(message[13:], "gemini")
-            return ["EVAL", msg]
+            return ["EVAL", f"Started gemini evaluation on {message[13:]}.", message[13:], "gemini"]
         elif (message.startswith("openai eval: ")):
             # create confusion matrix based on the file given
             print("Running openai evaluation on file: " + message[13:])
-            msg = self.run_evaluation(message[13:], "openai")
-            return ["EVAL", msg]
+            return ["EVAL", f"Started openai evaluation on {message[13:]}.", message[13:], "openai"]
 
         else:
-            openai_prompt_response = evaluate_msg_promptbased_openai(message)
-            openai_moderation_response = evaluate_msg_moderation_api_openai(message)
-            gemini_prompt_response = evaluate_msg_promptbased_gemini(message)
+            if self.classifier:
+                # The service runs the pre-filter and streams provider results back as they arrive
+                responses = await self.classifier.classify(message, on_result, depth)
+                if responses is None:
+                    return ["SAFE", message]
+            else:
+                if self.prefilter and self.prefilter.is_safe(message):
+                    return ["SAFE", message]
+                # Long-standing clean authors get a single cheap check, and the full ensemble only if it
+                # flags the message; the screening answer is reused there rather than asked for again
+                known = {}
+                if depth == LIGHT:
+                    escalate, known = await screen_message(message, self.risk_index.screen_provider)
+                    if not escalate:
+                        return ["SAFE", message]
+
+                # All three providers run concurrently, so this waits only as long as the slowest one
+                responses = await classify_message(message, on_result, known)
+            openai_prompt_response = responses["openai_prompt"]
+            openai_moderation_response = responses["openai_moderation"]
+            gemini_prompt_response = responses["gemini_prompt"]
             return ["AUTODETECT", message, openai_prompt_response, openai_moderation_response, gemini_prompt_response]
 
     
-    def run_evaluation(self, file: str, model: str) -> str:
+    async def run_evaluation(self, file: str, model: str, mod_channel) -> str:
         """
-        Runs the evaluation of a dataset against the specified model (OpenAI or Gemini)
+        Runs the evaluation of a dataset against the specified model (OpenAI or Gemini), posting
+        progress and the final stats to the mod channel. Meant to be run as a background task.
         :param file: The filename of the dataset to evaluate
         :param model: The model to use for evaluation ("openai" or "gemini")
+        :param mod_channel: The channel to post progress updates and results to
         """
-
-        prefix = "../assets/"
-        # join the prefix with the file name
-        path = os.path.join(prefix, file)
-
-        with open(path, "r", encoding='utf8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip the header row
-            messages = [row for row in reader]
-
-        num_columns = len(messages[0]) if messages else 0
-
-        print(f"Loaded {len(messages)} messages from {file}")
-        print("First 5 messages:", messages[:5])
-        if num_columns == 3:
-            to_eval = [(msg[0], msg[1]) for msg in messages if len(msg) >= 2]
-        elif num_columns == 4:
-            # ignore first index
-            to_eval = [(msg[1], msg[2]) for msg in messages if len(msg) >= 3]
-        
-        # evaluate each message
-        eval_results = []
-        for message_id, message in to_eval:
-            if model == "openai":
-                response = evaluate_msg_promptbased_openai(message).strip()
-            elif model == "gemini":
-                response = evaluate_msg_promptbased_gemini(message).strip()
-            classification = int(response[:1])
-            confidence = float(response[2:])
-            eval_results.append((message_id, classification, float(confidence)))
-
-        print(f"Evaluated {len(eval_results)} messages.")
-        print("First 5 evaluation results:", eval_results[:5])
-        
-        # compare to ground truth labels
-        accuracy_results = []
-        true_pos = 0
-        true_neg = 0
-        false_pos = 0
-        false_neg = 0
-        for i in range(len(messages)):
-            if num_columns == 3:
-                message_id, message, ground_truth = messages[i][0], messages[i][1], messages[i][2]
-            elif num_columns == 4:
-                message_id, message, ground_truth = messages[i][1], messages[i][2], messages[i][3]
-            classification, confidence = eval_results[i][1], eval_results[i][2]
-            ground_truth_label = int(ground_truth)
-
-            # calculate accuracy
-            if classification == ground_truth_label:
-                if classification == 1:
-                    true_pos += 1
-                else:
-                    true_neg += 1
-            else:
-                if classification == 1:
-                    false_pos += 1
-                else:
-                    false_neg += 1
-            
-            # add to results
-            accuracy_results.append((message_id, classification, ground_truth_label, confidence))
-
-        # save results to a file
-        with open("evaluation_results.csv", "w") as f:
-            f.write(f"Evaluation results with model {model} for {file}\n")
-            f.write("message_id,classification,ground_truth_label,confidence\n")
-            for result in accuracy_results:
-                f.write(f"{result[0]},{result[1]},{result[2]},{result[3]}\n")
-
-            # return the aggregated stats of confusion matrix, recall, precision
-            recall = true_pos / (true_pos + false_neg) if (true_pos + false_neg) > 0 else 0
-            precision = true_pos / (true_pos + false_pos) if (true_pos + false_pos) > 0 else 0
-            accuracy = (true_pos + true_neg) / len(messages) if len(messages) > 0 else 0
-            confusion_matrix = {
-                "true_positive": true_pos,
-                "true_negative": true_neg,
-                "false_positive": false_pos,
-                "false_negative": false_neg,
-            }
-            print(f"Confusion Matrix: {confusion_matrix}")
-            print(f"Recall: {recall:.2f}, Precision: {precision:.2f}, Accuracy: {accuracy:.2f}")
-
-            # Add results to file
-            f.write(f"Total messages: {len(messages)}\n")
-            f.write(f"Confusion Matrix: {confusion_matrix}\n")
-            f.write(f"Recall: {recall:.2f}, Precision: {precision:.2f}, Accuracy: {accuracy:.2f}\n")
-        
-        # Create msg to return
-        msg = f"Running evaluation on {model} for file {file}:\n"
-        msg += f"Total messages: {len(messages)}\n"
-        msg += f"Confusion Matrix: {confusion_matrix}\n"
-        msg += f"Recall: {recall:.2f}, Precision: {precision:.2f}, Accuracy: {accuracy:.2f}\n"
+        try:
+            summary = await evaluation.run_evaluation(file, model, progress=lambda status: self.send(mod_channel, status))
+        except Exception as e:
+            print(f"Evaluation of {file} with {model} stopped: {e}")
+            await self.send(mod_channel, f"Evaluation of {file} with {model} stopped: {e}\nSend the same command again to resume from where it left off.")
+            return
+        msg = evaluation.format_summary(file, model, summary)
+        await self.send(mod_channel, msg)
         return msg
 
 
-client = ModBot()
+client = ModBot(args.shard_ids, args.shard_count, args.process_index)
 client.run(discord_token)
\ No newline at end of file
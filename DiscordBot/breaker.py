@@ -0,0 +1,110 @@
+# breaker.py
+import time
+import asyncio
+from metrics import metrics
+
+CLOSED = "closed"       # Calls go through normally
+OPEN = "open"           # The provider is failing; calls are refused without being attempted
+HALF_OPEN = "half_open" # Trial period after the cool-down; one probe call decides what happens next
+
+
+class Unavailable:
+    """
+    Stands in for a provider's response when it gave none (timeout, error or open circuit), so the
+    rest of the pipeline can carry on with the providers that did answer
+    """
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Unavailable({self.reason})"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0 # Consecutive failures while closed
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+                metrics.inc("circuit_opened_total", provider=self.name)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    async def call(self, fn):
+        """
+        Runs `fn()` if the circuit allows it, recording the outcome. Cancellation (e.g. the losing leg
+        of a hedged request) counts as neither success nor failure.
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self.probing = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+async def hedged(fn, delay: float):
+    """
+    Runs `fn()`, and if it has not finished after `delay` seconds starts a second identical attempt.
+    Whichever finishes first wins and the other is cancelled. A delay of None disables hedging.
+    """
+    first = asyncio.ensure_future(fn())
+    tasks = [first]
+    try:
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.inc("hedged_requests_total")
+        tasks.append(asyncio.ensure_future(fn()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            # One attempt failed; keep waiting on the other, and raise only if both failed
+        return first.result()
+    finally:
+        # Also reached when the caller is cancelled (e.g. by a timeout), so no attempt outlives it
+        for task in tasks:
+            task.cancel()
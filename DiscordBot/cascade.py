@@ -0,0 +1,173 @@
+# cascade.py
+"""
+Cost-ordered classifier cascade with early exit.
+
+Instead of asking every provider about every message, the cascade asks them one at a time, cheapest
+first (by default the free moderation endpoint, then Gemini, then OpenAI). After each answer the
+stage's thresholds are checked against the message's violation score: the highest category score
+for the moderation endpoint, and the confidence in a violation for the prompt classifiers. A score
+below `clear_below` decides the message is benign and one at or above `flag_above` decides it is a
+violation; either way the later stages are skipped and recorded as Skipped. A skipped stage votes in
+harm_counter with the decided outcome, so the severity bucket is settled with the decision: every
+provider counts as agreeing with the deciding stage (Safe or Clear Violation), and the alert shows
+the skipped ones as "not asked". Messages no stage decides get every provider's own vote, as in the
+full ensemble. A stage without thresholds, or an unavailable provider, never decides.
+
+Most traffic is clearly benign to the moderation endpoint, so most messages never reach the paid
+prompt classifiers. The trade-off is latency on the messages that do go through every stage, since
+the stages run in sequence rather than concurrently, which is why the cascade ships disabled.
+
+Thresholds can be checked offline against stored evaluation runs of all three models, without any
+provider calls: the evaluate command replays the cascade on the per-row scores saved by
+evaluation.py (see analytics.py) and compares recall and severity with the full ensemble.
+
+Usage: python cascade.py evaluate <file>
+"""
+import argparse
+import numpy as np
+from config import config
+from metrics import metrics
+from breaker import Unavailable
+from verdict import Skipped
+
+# Slots answered by the paid prompt classifiers, as opposed to the free moderation endpoint
+LLM_SLOTS = ("openai_prompt", "gemini_prompt")
+
+
+def violation_score(response) -> float:
+    """
+    Probability of a violation implied by a provider's answer
+    """
+    if isinstance(response, dict):
+        return max((score for _, score in response.values()), default=0.0)
+    return response.confidence if response.violation else 1 - response.confidence
+
+
+def decide(stage: dict, score: float):
+    """
+    :return: True or False if the score is decisive under the stage's thresholds, otherwise None
+    """
+    if stage.get("clear_below") is not None and score < stage["clear_below"]:
+        return False
+    if stage.get("flag_above") is not None and score >= stage["flag_above"]:
+        return True
+    return None
+
+
+class Cascade:
+    """
+    Runs the providers of the detection pipeline one stage at a time until one decides the message
+    :param stages: config["cascade"]["stages"], in the order to ask the providers
+    :param run: Coroutine function run(provider, message) returning a response or Unavailable
+    :param providers: Every provider of the pipeline; each must appear in exactly one stage, so every
+    result slot is filled
+    """
+
+    def __init__(self, stages: list, run, providers):
+        names = [stage["provider"] for stage in stages]
+        if sorted(names) != sorted(providers):
+            raise ValueError(f"Cascade stages {names} must list each of {sorted(providers)} once")
+        self.stages = stages
+        self.run_provider = run
+
+    async def run(self, message: str, on_result=None, known: dict = None) -> dict:
+        """
+        :param on_result: Optional callback, called as on_result(provider, response) for every stage,
+        including skipped ones
+        :param known: Responses already received for this message, used instead of asking again
+        :return: Map from provider name to its response, or Skipped for stages after the deciding one
+        """
+        known = known or {}
+        responses = {}
+        decision = None # (deciding provider, violation)
+        for stage in self.stages:
+            name = stage["provider"]
+            if decision is not None:
+                response = Skipped(*decision)
+            else:
+                response = known[name] if name in known else await self.run_provider(name, message)
+                if not isinstance(response, Unavailable):
+                    outcome = decide(stage, violation_score(response))
+                    if outcome is not None:
+                        decision = (name, outcome)
+            responses[name] = response
+            if on_result:
+                on_result(name, response)
+        metrics.inc("cascade_decisions_total", stage=decision[0] if decision else "all")
+        metrics.inc("cascade_llm_calls_total", sum(
+            1 for name, r in responses.items() if name in LLM_SLOTS and not isinstance(r, Skipped)
+        ))
+        return responses
+
+
+def simulate(stages: list, tables: dict) -> dict:
+    """
+    Replays the cascade on stored evaluation results, vectorized over every row
+    :param tables: Map from provider slot to its ScoreTable, all aligned on the same rows
+    :return: The stage index that decided each row (len(stages) if none did), the votes harm_counter
+    would count, and whether each stage was asked, per row
+    """
+    rows = len(next(iter(tables.values())).labels)
+    decided_at = np.full(rows, len(stages))
+    outcome = np.zeros(rows, dtype=bool)
+    votes = np.zeros(rows, dtype=int)
+    asked = {}
+    for i, stage in enumerate(stages):
+        table = tables[stage["provider"]]
+        pending = decided_at == len(stages)
+        asked[stage["provider"]] = pending
+        # Asked stages vote with their own answer, skipped ones with the decided outcome, as in harm_counter
+        votes += np.where(pending, table.classifications == 1, outcome)
+        scores = table.scores
+        clear = pending & (scores < stage["clear_below"]) if stage.get("clear_below") is not None else np.zeros(rows, dtype=bool)
+        flag = pending & ~clear & (scores >= stage["flag_above"]) if stage.get("flag_above") is not None else np.zeros(rows, dtype=bool)
+        outcome |= flag
+        decided_at[clear | flag] = i
+    return {"decided_at": decided_at, "votes": votes, "asked": asked}
+
+
+def format_simulation(stages: list, tables: dict, result: dict) -> str:
+    from analytics import confusion, rates
+
+    labels = next(iter(tables.values())).labels
+    full_votes = np.sum([t.classifications == 1 for t in tables.values()], axis=0)
+    rows = len(labels)
+    lines = [f"{rows} rows"]
+    for i, stage in enumerate(stages):
+        lines.append(f"  {stage['provider']:<18} asked for {result['asked'][stage['provider']].mean():6.1%} of rows, "
+                     f"decided {np.mean(result['decided_at'] == i):6.1%}")
+    llm_calls = sum(result["asked"][name].sum() for name in LLM_SLOTS if name in result["asked"])
+    lines.append(f"LLM calls per message: {llm_calls / rows:.2f} (full ensemble: {len(LLM_SLOTS)})")
+    lines.append(f"Severity bucket matches the full ensemble on {np.mean(result['votes'] == full_votes):.1%} of rows")
+    lines.append(f"{'flagged at':<12} {'full recall':>11} {'recall':>9} {'full prec':>10} {'precision':>9}")
+    for k in range(1, len(stages) + 1):
+        full = confusion(labels, full_votes >= k)
+        cascaded = confusion(labels, result["votes"] >= k)
+        full_rates = rates(full["true_positive"], full["false_positive"], full["false_negative"], full["true_negative"])
+        cascade_rates = rates(cascaded["true_positive"], cascaded["false_positive"], cascaded["false_negative"], cascaded["true_negative"])
+        lines.append(f"{'votes>=' + str(k):<12} {float(full_rates['recall']):>11.3f} {float(cascade_rates['recall']):>9.3f} "
+                     f"{float(full_rates['precision']):>10.3f} {float(cascade_rates['precision']):>9.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    from analytics import ScoreTable, scores_path
+    from evaluation import MODEL_SLOTS
+
+    parser = argparse.ArgumentParser(description="Check cascade thresholds against stored evaluation runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    evaluate_parser = sub.add_parser("evaluate")
+    evaluate_parser.add_argument("file", help="Dataset evaluated with every model (openai, gemini and moderation)")
+    args = parser.parse_args()
+
+    stages = config["cascade"]["stages"]
+    tables = {slot: ScoreTable.load(scores_path(args.file, model)) for model, slot in MODEL_SLOTS.items()}
+    common = None
+    for table in tables.values():
+        common = table.ids if common is None else np.intersect1d(common, table.ids)
+    tables = {slot: table.select(common) for slot, table in tables.items()}
+    print(format_simulation(stages, tables, simulate(stages, tables)))
+
+
+if __name__ == "__main__":
+    main()
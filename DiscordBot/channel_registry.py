@@ -0,0 +1,107 @@
+# channel_registry.py
+from metrics import metrics
+
+
+class ChannelRegistry:
+    """
+    Tracks which channel in each guild is monitored for automatic detection and which is its mod
+    channel. The bot fills it once when it connects and then keeps it current from guild and channel
+    events, so lookups per message or reaction are plain dict and set checks.
+
+    Channels are matched against config["channels"]: a default for every guild, overridable per guild
+    ID. Each entry is a channel name (which may use {group_num}) or a channel ID.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.group_num = None
+        self.mod_channels = {} # Map from guild ID to that guild's mod channel
+        self.monitored_ids = set() # IDs of every monitored channel, checked on each message
+        self.mod_channel_ids = set() # IDs of every mod channel, checked on each reaction
+        self.roles = {} # Map from channel ID to "monitored" or "mod"
+        self.rules = {} # Map from guild ID to its (monitored, mod) matchers, resolved once per guild
+
+    def set_group(self, group_num):
+        """
+        Fixes the group number used in channel names; forgets any channels matched with the old one
+        """
+        self.group_num = group_num
+        self.mod_channels.clear()
+        self.monitored_ids.clear()
+        self.mod_channel_ids.clear()
+        self.roles.clear()
+        self.rules.clear()
+
+    def _matchers(self, guild_id: int) -> tuple:
+        if guild_id not in self.rules:
+            entry = {**self.settings, **self.settings["guilds"].get(str(guild_id), {})}
+            resolve = lambda value: int(value) if str(value).isdigit() else str(value).format(group_num=self.group_num)
+            self.rules[guild_id] = ({resolve(v) for v in entry["monitored"]}, resolve(entry["mod"]))
+        return self.rules[guild_id]
+
+    def role_of(self, channel):
+        monitored, mod = self._matchers(channel.guild.id)
+        if channel.id == mod or channel.name == mod:
+            return "mod"
+        if channel.id in monitored or channel.name in monitored:
+            return "monitored"
+        return None
+
+    def add_guild(self, guild):
+        for channel in guild.text_channels:
+            self.add_channel(channel)
+
+    def remove_guild(self, guild):
+        for channel in guild.text_channels:
+            self.remove_channel(channel)
+        self.mod_channels.pop(guild.id, None)
+        self.rules.pop(guild.id, None)
+
+    def add_channel(self, channel):
+        role = self.role_of(channel)
+        if role == "mod":
+            # If a guild has several channels that match, the first one seen stays its mod channel
+            current = self.mod_channels.get(channel.guild.id)
+            if current is not None and current.id != channel.id:
+                return
+            self.mod_channels[channel.guild.id] = channel
+            self.mod_channel_ids.add(channel.id)
+        elif role == "monitored":
+            self.monitored_ids.add(channel.id)
+        else:
+            return
+        self.roles[channel.id] = role
+        metrics.inc("channel_registry_changes_total", role=role, change="added")
+
+    def remove_channel(self, channel):
+        role = self.roles.pop(channel.id, None)
+        if role is None:
+            return
+        self.monitored_ids.discard(channel.id)
+        self.mod_channel_ids.discard(channel.id)
+        current = self.mod_channels.get(channel.guild.id)
+        if current is not None and current.id == channel.id:
+            del self.mod_channels[channel.guild.id]
+            # Another channel in the guild may match too, now that this one is gone
+            for other in channel.guild.text_channels:
+                if other.id != channel.id and self.role_of(other) == "mod":
+                    self.add_channel(other)
+                    break
+        metrics.inc("channel_registry_changes_total", role=role, change="removed")
+
+    def update_channel(self, before, after):
+        # A rename can move a channel in or out of either role
+        self.remove_channel(before)
+        self.add_channel(after)
+
+    def mod_channel(self, guild_id: int):
+        """
+        The guild's mod channel, or None if it has none
+        """
+        return self.mod_channels.get(guild_id)
+
+    def stats(self) -> dict:
+        return {
+            "guilds_with_mod_channel": len(self.mod_channels),
+            "monitored_channels": len(self.monitored_ids),
+        }
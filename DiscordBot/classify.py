@@ -0,0 +1,157 @@
+# classify.py
+import asyncio
+from config import config
+from verdict_cache import VerdictCache
+from backends import load_backends, record_response
+from metrics import metrics
+from breaker import CLOSED, CircuitBreaker, CircuitOpenError, Unavailable, hedged
+from cascade import Cascade
+
+# Every provider that takes part in automatic detection, keyed by the slot name used in config
+PROVIDERS = load_backends()
+
+verdict_cache = VerdictCache(**config["verdict_cache"])
+metrics.add_collector("verdict_cache", verdict_cache.stats)
+
+resilience = config["resilience"]
+breakers = {
+    name: CircuitBreaker(name, resilience["failure_threshold"], resilience["reset_timeout"])
+    for name in PROVIDERS
+}
+metrics.add_collector("circuit", lambda: {f"{name}_open": int(b.state != CLOSED) for name, b in breakers.items()})
+
+
+def hedge_delay(name: str):
+    """
+    How long to wait on a provider before sending a second, hedged request: its recent p95 latency,
+    once enough calls have been seen to trust it. None disables hedging for now.
+    """
+    if not resilience["hedge"]:
+        return None
+    hist = metrics.histogram("provider_seconds", provider=name)
+    if hist is None or hist.count < resilience["hedge_min_samples"]:
+        return None
+    return max(resilience["hedge_min_delay"], hist.percentile(resilience["hedge_percentile"]))
+
+
+async def run_provider(name: str, message: str):
+    """
+    Runs a single provider on a message through its circuit breaker. If the call is slower than the
+    provider's usual tail latency a hedged duplicate is sent and the first answer wins; the whole
+    attempt is cancelled if it exceeds the provider's configured timeout.
+    """
+    timeout = config["classifier_timeouts"][name]
+    delay = hedge_delay(name)
+
+    async def attempt():
+        with metrics.timer("provider", provider=name):
+            return await asyncio.wait_for(hedged(lambda: PROVIDERS[name].classify(message), delay), timeout=timeout)
+
+    response = await breakers[name].call(attempt)
+    if config["backends"]["record_path"]:
+        record_response(config["backends"]["record_path"], name, message, response)
+    return response
+
+
+async def screen_message(message: str, provider: str) -> tuple:
+    """
+    The cheap check for low-risk authors: asks a single provider (by default the free moderation
+    endpoint) whether the message needs the full ensemble
+    :return: (escalate, known): escalate is True if the provider flagged the message or could not
+    answer; known maps the provider to its answer, for classify_message to reuse
+    """
+    known = {}
+    try:
+        response = await run_provider(provider, message)
+    except Exception:
+        escalate = True
+    else:
+        known[provider] = response
+        if isinstance(response, dict):
+            escalate = any(flagged for flagged, _ in response.values())
+        else:
+            escalate = response.violation
+    metrics.inc("risk_screens_total", escalated=str(escalate).lower())
+    return escalate, known
+
+
+async def classify_message(message: str, on_result=None, known: dict = None) -> dict:
+    """
+    Classifies a message with every provider, reusing the verdicts of any earlier message with the
+    same normalized content. Identical messages arriving together share one set of provider calls.
+    :param message: The text of the message to classify
+    :param on_result: Optional callback, called as on_result(provider, response) as each result arrives
+    :param known: Responses already received for this message (e.g. from screen_message), which are
+    used instead of asking those providers again
+    :return: Map from provider name to that provider's response
+    """
+    reported = set()
+
+    def report(name, response):
+        reported.add(name)
+        if on_result:
+            on_result(name, response)
+
+    # With the cascade enabled, providers are asked one at a time in cost order until one decides
+    compute = (lambda: cascade.run(message, report, known)) if cascade else (lambda: run_all_providers(message, report, known))
+    # Degraded results are not cached, so the next identical message asks the missing providers again
+    responses = await verdict_cache.get_or_compute(
+        message, compute,
+        cacheable=lambda verdicts: not any(isinstance(v, Unavailable) for v in verdicts.values()),
+    )
+    # Cache hits and coalesced lookups get every result at once
+    for name, response in responses.items():
+        if name not in reported:
+            report(name, response)
+    return responses
+
+
+async def run_safely(name: str, message: str):
+    """
+    Runs a provider, turning a failure, a timeout or an open circuit into Unavailable
+    """
+    try:
+        response = await run_provider(name, message)
+    except CircuitOpenError:
+        response = Unavailable("circuit open")
+    except asyncio.TimeoutError:
+        response = Unavailable("timeout")
+    except Exception as e:
+        print(f"{name} failed: {e!r}")
+        response = Unavailable("error")
+    if isinstance(response, Unavailable):
+        metrics.inc("provider_unavailable_total", provider=name, reason=response.reason)
+    return response
+
+
+async def run_all_providers(message: str, on_result=None, known: dict = None) -> dict:
+    """
+    Fans a message out to every provider concurrently, so the latency is that of the slowest
+    provider rather than the sum of all of them. A provider that fails, times out or has its
+    circuit open is reported as Unavailable rather than failing the others, so the caller always
+    gets whatever verdicts could be had. Providers with a response in `known` are not asked again.
+    """
+    known = known or {}
+
+    async def run_and_report(name):
+        response = known[name] if name in known else await run_safely(name, message)
+        if on_result:
+            on_result(name, response)
+        return response
+
+    tasks = {name: asyncio.create_task(run_and_report(name)) for name in PROVIDERS}
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        # Let the cancelled calls unwind so their exceptions are not left unretrieved
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    return {name: task.result() for name, task in tasks.items()}
+
+
+# Asks the providers one at a time in cost order, stopping once a stage decides (see cascade.py);
+# None fans every message out to all providers at once
+cascade = Cascade(config["cascade"]["stages"], run_safely, PROVIDERS) if config["cascade"]["enabled"] else None
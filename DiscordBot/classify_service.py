@@ -0,0 +1,178 @@
+# classify_service.py
+"""
+Standalone classification service, so the pre-filter, provider calls and response parsing run in a
+process of their own instead of sharing the Discord gateway's event loop.
+
+Usage: python classify_service.py
+
+The bot connects over a local TCP socket and speaks JSON lines. A request is
+    {"id": 7, "text": "...", "depth": "full"}
+where "depth" is the author's classification depth from the risk index (see risk_index.py)
+and the service streams back one line per provider as it answers, then a final line:
+    {"id": 7, "provider": "gemini_prompt", "response": {"violation": 1, "confidence": 0.85}}
+    {"id": 7, "done": true, "safe": false}
+"safe" is true when the pre-filter (or, at light depth, the screening provider) cleared the message
+and the full ensemble was not asked. A request that
+fails gets {"id": 7, "error": "..."} instead.
+"""
+import os
+import json
+import asyncio
+from config import config
+from metrics import metrics
+from verdict import encode_response, decode_response
+from risk_index import LIGHT, FULL, ESCALATED
+
+# Longest line either side will read; messages are at most a few KB
+LINE_LIMIT = 2 ** 20
+
+
+class ServiceClient:
+    """
+    Bot-side connection to the classification service. Requests are multiplexed over one connection
+    and matched to their results by ID; the connection is reopened on the next request after a failure.
+    A request that gets no final answer within `timeout` seconds fails, so a hung service cannot hold
+    a classification worker forever.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.writer = None
+        self.reader_task = None
+        self.pending = {} # Map from request ID to (on_result, future, responses so far)
+        self.next_id = 0
+        self.connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self.connect_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+            reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=LINE_LIMIT)
+            self.reader_task = asyncio.create_task(self._read(reader, self.writer))
+
+    async def _read(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                result = json.loads(line)
+                on_result, future, responses = self.pending.get(result["id"], (None, None, None))
+                if future is None or future.done():
+                    continue
+                if "provider" in result:
+                    response = decode_response(result["provider"], result["response"])
+                    responses[result["provider"]] = response
+                    if on_result:
+                        on_result(result["provider"], response)
+                elif "error" in result:
+                    future.set_exception(RuntimeError(result["error"]))
+                else:
+                    future.set_result(None if result["safe"] else responses)
+        finally:
+            # The service went away; fail everything still waiting so callers don't hang
+            writer.close()
+            for _, future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Classification service connection lost"))
+
+    async def classify(self, text: str, on_result=None, depth: str = FULL):
+        """
+        Classifies a message in the service
+        :param on_result: Optional callback, called as on_result(provider, response) as each result arrives
+        :param depth: LIGHT, FULL or ESCALATED, from the risk index
+        :return: Map from provider name to response, or None if the pre-filter or screening cleared the message
+        :raises asyncio.TimeoutError: If the service does not finish the request within the timeout
+        """
+        return await asyncio.wait_for(self._classify(text, on_result, depth), timeout=self.timeout)
+
+    async def _classify(self, text: str, on_result, depth: str):
+        await self._connect()
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (on_result, future, {})
+        try:
+            self.writer.write((json.dumps({"id": request_id, "text": text, "depth": depth}) + "\n").encode('utf8'))
+            await self.writer.drain()
+            return await future
+        finally:
+            del self.pending[request_id]
+
+
+async def handle_connection(reader, writer, prefilter, limit: asyncio.Semaphore):
+    from classify import classify_message, screen_message
+    from scheduler import lane, FLAGGED
+
+    def send(obj):
+        writer.write((json.dumps(obj) + "\n").encode('utf8'))
+
+    async def serve(request):
+        request_id = request["id"]
+        depth = request.get("depth", FULL)
+        if depth == ESCALATED:
+            lane.set(FLAGGED) # Each request runs in its own task, so this only affects its own calls
+        async with limit:
+            try:
+                safe = bool(prefilter) and prefilter.is_safe(request["text"])
+                known = {}
+                if not safe and depth == LIGHT:
+                    escalate, known = await screen_message(request["text"], config["risk_index"]["screen_provider"])
+                    safe = not escalate
+                if not safe:
+                    await classify_message(
+                        request["text"],
+                        lambda name, response: send({"id": request_id, "provider": name, "response": encode_response(response)}),
+                        known,
+                    )
+                send({"id": request_id, "done": True, "safe": safe})
+            except Exception as e:
+                print(f"Request {request_id} failed: {e!r}")
+                send({"id": request_id, "error": repr(e)})
+        await writer.drain()
+
+    tasks = set()
+    while line := await reader.readline():
+        task = asyncio.create_task(serve(json.loads(line)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    for task in tasks:
+        task.cancel()
+    writer.close()
+
+
+async def serve_classification(host: str, port: int, max_concurrency: int):
+    from prefilter import load_prefilter
+    from metrics import monitor_loop_lag, serve_metrics
+
+    prefilter = load_prefilter()
+    if prefilter:
+        metrics.add_collector("prefilter", prefilter.stats)
+    if config["metrics"]["enabled"]:
+        await serve_metrics(config["metrics"]["host"], config["classification_service"]["metrics_port"])
+        lag_task = asyncio.create_task(monitor_loop_lag())
+
+    limit = asyncio.Semaphore(max_concurrency)
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, prefilter, limit), host, port, limit=LINE_LIMIT
+    )
+    print(f"Classification service listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    # Same token file as the bot; only the provider keys are used here
+    with open('tokens.json') as f:
+        tokens = json.load(f)
+    if "gemini" in tokens:
+        os.environ["GEMINI_API_KEY"] = tokens["gemini"]
+    if "openai" in tokens:
+        os.environ["OPENAI_API_KEY"] = tokens["openai"]
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "./google-service-account.json"
+
+    settings = config["classification_service"]
+    asyncio.run(serve_classification(settings["host"], settings["port"], settings["max_concurrency"]))
+
+
+if __name__ == "__main__":
+    main()
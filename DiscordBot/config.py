@@ -0,0 +1,204 @@
+# config.py
+import os
+import json
+
+# Optional deployment overrides live in a 'config.json' next to this file. Any key that is
+# missing there falls back to the defaults below, so an empty (or absent) file is valid.
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+DEFAULTS = {
+    # Seconds each provider gets before its call is cancelled
+    "classifier_timeouts": {
+        "openai_prompt": 10.0,
+        "openai_moderation": 5.0,
+        "gemini_prompt": 10.0,
+    },
+    # Policy used by the prompt-based classifiers; an empty path means assets/policy.txt
+    "prompts": {
+        "policy_path": "",
+        "reload_check_interval": 1.0,
+    },
+    # Cache of combined verdicts keyed by normalized message content; an empty db_path keeps it in memory only
+    "verdict_cache": {
+        "max_entries": 10000,
+        "ttl": 3600,
+        "db_path": "",
+    },
+    # Batch evaluation of labelled datasets
+    "evaluation": {
+        "concurrency": 8,
+        "prediction_store": "predictions.db", # Every prediction made, keyed by row, model and prompt
+        "progress_every": 250,
+        "scores_dir": "eval_scores", # Per-row results of finished runs, for analytics.py
+        "sweep_concurrency": 32, # Requests in flight across all configurations of a sweep.py run
+        "recall_target": 0.8, # Minimum recall sweep.py requires when recommending a configuration
+    },
+    # Local classifier that lets clearly benign messages skip the remote providers.
+    # Train it with `python prefilter.py train`; `python prefilter.py report` shows the trade-off per threshold.
+    "prefilter": {
+        "enabled": True,
+        "model_path": "",
+        "safe_threshold": 0.02,
+    },
+    # Moderation requests are grouped for up to window_ms or max_batch_size messages, whichever comes first
+    "moderation_batching": {
+        "window_ms": 5,
+        "max_batch_size": 32,
+    },
+    # SQLite file holding reports under moderator review, relative to the bot's working directory
+    "report_store": {
+        "path": "reports.db",
+    },
+    # Cost-ordered classifier cascade (see cascade.py). Stages run one after another, cheapest first;
+    # a stage decides the message when its violation score (the highest category score for the
+    # moderation endpoint, the confidence in a violation for the prompts) is below clear_below or at
+    # least flag_above, and the later stages are then skipped. Check thresholds against stored
+    # evaluation runs with `python cascade.py evaluate <file>` before enabling the cascade or changing
+    # them. Disabled, every provider is asked at once.
+    "cascade": {
+        "enabled": False,
+        "stages": [
+            {"provider": "openai_moderation", "clear_below": 0.01, "flag_above": 0.9},
+            {"provider": "gemini_prompt", "clear_below": 0.05, "flag_above": 0.95},
+            {"provider": "openai_prompt"},
+        ],
+    },
+    # Outgoing messages (see outbound.py): lines queued for the same channel or user are joined up to
+    # max_length characters, and each destination sends at most `burst` messages every `period` seconds
+    "outbound": {
+        "max_length": 2000,
+        "burst": 5,
+        "period": 5.0,
+        "idle_timeout": 60,
+    },
+    # Per-author risk scores that decide how deeply their messages are classified (see risk_index.py).
+    # Authors under light_max_score with light_min_clean_messages clean messages since their last
+    # incident are screened by screen_provider alone, and only get the full ensemble if it flags the
+    # message; authors at escalate_score or above jump the queue. Scores halve every half_life_days.
+    "risk_index": {
+        "enabled": True,
+        "path": "risk.db",
+        "half_life_days": 30,
+        "weights": {"ban": 10.0, "warn": 3.0, "unsure": 2.0, "ignore": -1.0, "auto_flag": 1.0},
+        "light_max_score": 0.5,
+        "light_min_clean_messages": 50,
+        "escalate_score": 2.5,
+        "screen_provider": "openai_moderation",
+        "flush_interval": 5.0,
+    },
+    # Channels the bot watches ("monitored") and reports to ("mod") in each guild, by name ({group_num}
+    # is filled in from the bot's name) or by channel ID. Entries under "guilds", keyed by guild ID,
+    # override either setting for that guild, e.g. {"1234": {"monitored": ["general"], "mod": "mods"}}.
+    "channels": {
+        "monitored": ["group-{group_num}"],
+        "mod": "group-{group_num}-mod",
+        "guilds": {},
+    },
+    # Queue between channel messages and classification. When it holds maxsize jobs, `policy` decides
+    # what gives: "drop_oldest", "sample" (keep a sample_rate share of the overflow) or "spill" (write
+    # jobs to spill_path and read them back once the queue drains). Each process of the launcher spills
+    # to its own file, spill_path with the process index inserted before the extension
+    "classification_queue": {
+        "maxsize": 1000,
+        "workers": 32,
+        "policy": "drop_oldest",
+        "sample_rate": 0.1,
+        "spill_path": "classification_spill.jsonl",
+    },
+    # Out-of-process classification (see classify_service.py); start the service before the bot
+    "classification_service": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9210,
+        "max_concurrency": 64,
+        "metrics_port": 9200,
+    },
+    # Multi-process deployment (see launcher.py). shard_count 0 asks Discord for its recommended count;
+    # each process also polls the shared report store every outbox_poll_interval seconds for reports
+    # filed through DMs (which all arrive on shard 0) that belong to one of its guilds.
+    "sharding": {
+        "shard_count": 0,
+        "processes": 0, # 0 = one per CPU core, capped at the shard count
+        "outbox_poll_interval": 1.0,
+        "restart_delay": 5.0,
+    },
+    # Backend filling each detection slot. Types: openai_prompt, openai_moderation, gemini_prompt,
+    # lexicon (offline word list) and replay (recorded responses, e.g. {"type": "replay",
+    # "path": "recorded.jsonl", "latency_ms": 300}). When record_path is set, every live response is
+    # appended there in the format the replay backend reads.
+    "backends": {
+        "openai_prompt": {"type": "openai_prompt"},
+        "openai_moderation": {"type": "openai_moderation"},
+        "gemini_prompt": {"type": "gemini_prompt"},
+        "record_path": "",
+    },
+    # Estimated USD per 1M tokens, used for the cost metrics
+    "pricing": {
+        "gpt-4.1-mini": {"input": 0.40, "output": 1.60},
+        "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+    },
+    # Prometheus-style endpoint on host:port/metrics, plus a summary posted to the mod channels
+    # every summary_interval seconds (0 turns the summary off)
+    "metrics": {
+        "enabled": True,
+        "host": "127.0.0.1",
+        "port": 9108,
+        "summary_interval": 3600,
+    },
+    # Quotas per "provider/model" (requests and tokens per minute; 0 or missing means unlimited) and how
+    # many times a rate-limited call is retried after backing off
+    "rate_limits": {
+        "limits": {
+            "openai/gpt-4.1-mini": {"rpm": 500, "tpm": 200000},
+            "openai/text-moderation-latest": {"rpm": 1000},
+            "gemini/gemini-1.5-flash": {"rpm": 1000, "tpm": 1000000},
+        },
+        "max_retries": 3,
+    },
+    # Mod-channel alerts are posted on the first verdict and edited as the rest arrive, at most once per interval
+    "alerts": {
+        "min_edit_interval": 1.0,
+    },
+    # Prompt classifiers answer in their providers' structured output modes, at temperature 0, with at
+    # most max_output_tokens; an answer that still cannot be parsed is requested again up to parse_retries times
+    "structured_output": {
+        "max_output_tokens": 24,
+        "parse_retries": 1,
+    },
+    # Per-provider circuit breakers and hedged requests. A circuit opens after `failure_threshold`
+    # consecutive failures and lets a probe through after `reset_timeout` seconds. Once a provider has
+    # `hedge_min_samples` calls on record, a duplicate request is sent when a call outlives its
+    # `hedge_percentile` latency (but never sooner than `hedge_min_delay` seconds).
+    "resilience": {
+        "failure_threshold": 5,
+        "reset_timeout": 30,
+        "hedge": True,
+        "hedge_percentile": 95,
+        "hedge_min_samples": 20,
+        "hedge_min_delay": 0.25,
+    },
+}
+
+
+def _merge(base: dict, overrides: dict) -> dict:
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    """
+    Loads the deployment config, layering config.json (if present) over DEFAULTS
+    :param path: Path to the JSON overrides file
+    """
+    if not os.path.isfile(path):
+        return _merge(DEFAULTS, {})
+    with open(path, encoding='utf8') as f:
+        return _merge(DEFAULTS, json.load(f))
+
+
+config = load_config()
@@ -0,0 +1,295 @@
+# evaluation.py
+"""
+Batch evaluation of the prompt-based classifiers against a labelled CSV.
+
+Rows are streamed from the file and classified by a bounded pool of concurrent workers. Every
+answer goes into the prediction store (see prediction_store.py) as it arrives, and rows that already
+have a prediction for the same model and prompt are not sent again. A row the provider fails on is
+counted as failed and left for the next run, and a run that is interrupted picks up where it
+stopped; re-running after changing a few rows only pays for those rows.
+
+Finished runs also store their per-row results for analytics.py, which computes threshold sweeps,
+curves, calibration and provider comparisons from them without querying the models again.
+
+Usage: python evaluation.py <openai|gemini|moderation|backend type> <file> [--concurrency N]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+from config import config
+from prompts import ASSETS_DIR
+from backends import BACKENDS, create_backend
+from scheduler import lane, EVAL
+from verdict import Verdict, parse_verdict
+from analytics import ScoreTable, confusion, rates, scores_path
+from prediction_store import PredictionStore
+from verdict_cache import content_key
+from metrics import usage
+
+# Detection slot whose backend each model name evaluates
+MODEL_SLOTS = {"openai": "openai_prompt", "gemini": "gemini_prompt", "moderation": "openai_moderation"}
+
+
+def resolve_dataset(file: str) -> str:
+    """
+    Accepts either a path or the name of a file in the assets folder
+    """
+    if os.path.isfile(file):
+        return file
+    return os.path.join(ASSETS_DIR, file)
+
+
+def read_rows(path: str):
+    """
+    Yields (message_id, text, label) for each row of a labelled CSV. Both the original
+    three-column export (id,text,label) and the four-column one with a leading index are accepted.
+    """
+    with open(path, "r", encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip the header row
+        for row in reader:
+            if len(row) < 3:
+                continue
+            # The pandas export writes an index column that its header row does not name
+            offset = 1 if len(row) == 4 else 0
+            yield row[offset], row[offset + 1], int(float(row[offset + 2]))
+
+
+def model_spec(model: str) -> tuple:
+    """
+    Returns the backend config and slot for a model: "openai", "gemini" and "moderation" use whatever
+    backend fills that slot in config, and any other backend type (e.g. "lexicon") is built on its own
+    """
+    if model in MODEL_SLOTS:
+        slot = MODEL_SLOTS[model]
+        return config["backends"][slot], slot
+    if model in BACKENDS:
+        return {"type": model}, ""
+    raise ValueError(f"Unknown model {model}. Use \"openai\", \"gemini\" or one of {', '.join(BACKENDS)}.")
+
+
+def parse_response(response):
+    """
+    Reads a backend's answer (a Verdict, text from an older recording, or a moderation result) as
+    (label, confidence). A moderation result counts as a violation if any category is flagged, with
+    the highest category score as its confidence.
+    :raises VerdictParseError: If the text holds no verdict
+    """
+    if isinstance(response, dict):
+        flagged = any(f for f, _ in response.values())
+        score = max((s for _, s in response.values()), default=0.0)
+        return int(flagged), score if flagged else 1 - score
+    verdict = response if isinstance(response, Verdict) else parse_verdict(response)
+    return int(verdict.violation), verdict.confidence
+
+
+def prompt_hash(spec: dict, backend) -> str:
+    """
+    Hash of everything that determines a backend's answers, so predictions are only reused while it is unchanged
+    """
+    data = json.dumps({"backend": spec, "fingerprint": backend.fingerprint(), "output": config["structured_output"]}, sort_keys=True)
+    return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+
+async def measured(call) -> tuple:
+    """
+    Awaits a backend call, measuring it for the prediction store
+    :return: (response, (latency_ms, input_tokens, output_tokens, cost_usd)). The latency is the time
+    spent on provider requests, without waiting for quota; offline backends make none, so theirs is
+    the time the call took.
+    """
+    spent = {}
+    token = usage.set(spent)
+    start = time.perf_counter()
+    try:
+        response = await call
+    finally:
+        usage.reset(token)
+    seconds = spent.get("provider_seconds", time.perf_counter() - start)
+    return response, (seconds * 1000, spent.get("input_tokens", 0), spent.get("output_tokens", 0), spent.get("cost_usd", 0.0))
+
+
+def results_path(file: str, model: str, run_id: int) -> str:
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(config["evaluation"]["scores_dir"], f"{name}.{model}.run{run_id}.csv")
+
+
+def summarize(table: ScoreTable) -> dict:
+    counts = confusion(table.labels, table.classifications)
+    stats = rates(counts["true_positive"], counts["false_positive"], counts["false_negative"], counts["true_negative"])
+    return {
+        "total": len(table.labels),
+        "confusion_matrix": counts,
+        "recall": float(stats["recall"]),
+        "precision": float(stats["precision"]),
+        "accuracy": float(stats["accuracy"]),
+    }
+
+
+def write_results(path: str, file: str, model: str, results: list, summary: dict):
+    with open(path, "w", encoding='utf8') as f:
+        f.write(f"Evaluation results with model {model} for {file}\n")
+        f.write("message_id,classification,ground_truth_label,confidence\n")
+        for r in results:
+            f.write(f"{r['id']},{r['classification']},{r['label']},{r['confidence']}\n")
+        f.write(f"Total messages: {summary['total']}\n")
+        f.write(f"Confusion Matrix: {summary['confusion_matrix']}\n")
+        f.write(f"Recall: {summary['recall']:.2f}, Precision: {summary['precision']:.2f}, Accuracy: {summary['accuracy']:.2f}\n")
+
+
+def format_summary(file: str, model: str, summary: dict) -> str:
+    msg = f"Running evaluation on {model} for file {file}:\n"
+    msg += f"Total messages: {summary['total']}\n"
+    msg += f"Confusion Matrix: {summary['confusion_matrix']}\n"
+    msg += f"Recall: {summary['recall']:.2f}, Precision: {summary['precision']:.2f}, Accuracy: {summary['accuracy']:.2f}\n"
+    if "queried" in summary:
+        msg += f"Model queried for {summary['queried']} rows; {summary['reused']} reused from earlier runs (run {summary['run_id']})\n"
+    if summary.get("failed"):
+        msg += f"Rows that could not be classified: {summary['failed']}\n"
+    return msg
+
+
+async def run_evaluation(file: str, model: str, concurrency: int = None, progress=None) -> dict:
+    """
+    Evaluates every row of a labelled dataset against a model, querying it only for rows without a
+    stored prediction under the current model and prompt
+    :param file: The dataset, as a path or the name of a file in the assets folder
+    :param model: The model to use for evaluation ("openai", "gemini", "moderation" or a backend type)
+    :param concurrency: Maximum number of requests in flight at once
+    :param progress: Optional coroutine function called with a status string every few hundred rows
+    :return: Summary stats of the run
+    """
+    # Offline evaluations yield provider quota to live moderation
+    lane.set(EVAL)
+    spec, slot = model_spec(model)
+    backend = create_backend(spec, slot)
+    fingerprint = prompt_hash(spec, backend)
+    concurrency = concurrency or config["evaluation"]["concurrency"]
+    progress_every = config["evaluation"]["progress_every"]
+    path = resolve_dataset(file)
+    dataset = os.path.basename(path)
+    store = PredictionStore(config["evaluation"]["prediction_store"])
+    run_id = store.start_run(dataset, model, fingerprint)
+
+    results = []
+    failed = []
+    reused = 0
+    queried = 0
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    started = time.monotonic()
+
+    async def worker():
+        nonlocal queried
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            message_id, text, label, row_hash = item
+            try:
+                response, measurement = await measured(backend.classify(text))
+                classification, confidence = parse_response(response)
+            except ValueError:
+                # The model answered in an unexpected format; leave the row for a later run
+                failed.append(message_id)
+                continue
+            except Exception as e:
+                # A provider error (or a row missing from a replay file) only costs this row, which the
+                # next run tries again
+                print(f"Evaluation of {file} with {model}: row {message_id} failed: {e!r}")
+                failed.append(message_id)
+                continue
+            results.append({"id": message_id, "label": label, "classification": classification, "confidence": confidence})
+            store.add(row_hash, model, fingerprint, classification, confidence, measurement)
+            queried += 1
+            # Reused rows arrive in bursts, so progress follows the rows the model was asked about
+            if queried % progress_every == 0:
+                rate = queried / (time.monotonic() - started)
+                status = f"Evaluation of {file} with {model}: {queried} rows classified, {reused} reused ({rate:.1f} rows/s)"
+                await store.flush()
+                print(status)
+                if progress:
+                    await progress(status)
+
+    def read_chunk(rows):
+        # Reads the next rows and looks up their stored predictions, on a thread so neither the file
+        # nor the database blocks the event loop
+        chunk = [(*row, content_key(row[1])) for _, row in zip(range(500), rows)]
+        known = store.lookup([row[3] for row in chunk], model, fingerprint)
+        store.add_run_rows(run_id, [(row[0], row[3], row[2]) for row in chunk])
+        return chunk, known
+
+    async def producer():
+        nonlocal reused
+        rows = read_rows(path)
+        while True:
+            chunk, known = await asyncio.to_thread(read_chunk, rows)
+            if not chunk:
+                break
+            for row in chunk:
+                if row[3] in known:
+                    classification, confidence = known[row[3]]
+                    results.append({"id": row[0], "label": row[2], "classification": classification, "confidence": confidence})
+                    reused += 1
+                else:
+                    await queue.put(row)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    tasks = [asyncio.create_task(producer())] + [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # An interruption (or a crash outside the per-row handling) aborts the run; every answer received so far is kept
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        await store.flush()
+
+    table = ScoreTable.from_records(results)
+    await asyncio.to_thread(table.save, scores_path(file, model))
+    summary = summarize(table)
+    summary["failed"] = len(failed)
+    summary["queried"] = queried
+    summary["reused"] = reused
+    summary["run_id"] = run_id
+    store.finish_run(run_id, summary["queried"], reused, len(failed), summary)
+    print(f"Evaluated {len(results)} messages.")
+    print(f"Confusion Matrix: {summary['confusion_matrix']}")
+    print(f"Recall: {summary['recall']:.2f}, Precision: {summary['precision']:.2f}, Accuracy: {summary['accuracy']:.2f}")
+    await asyncio.to_thread(write_results, results_path(file, model, run_id), file, model, results, summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a prompt-based classifier against a labelled CSV")
+    parser.add_argument("model", help="openai, gemini, or a backend type such as lexicon")
+    parser.add_argument("file", help="Dataset path, or the name of a file in the assets folder")
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    # Offline backends need no keys, so a missing tokens.json is fine
+    if os.path.isfile('tokens.json'):
+        with open('tokens.json') as f:
+            tokens = json.load(f)
+            if "gemini" in tokens:
+                os.environ["GEMINI_API_KEY"] = tokens["gemini"]
+            if "openai" in tokens:
+                os.environ["OPENAI_API_KEY"] = tokens["openai"]
+
+    try:
+        summary = asyncio.run(run_evaluation(args.file, args.model, args.concurrency))
+    except KeyboardInterrupt:
+        print("Evaluation interrupted; run the same command again to resume.")
+        sys.exit(1)
+    print(format_summary(args.file, args.model, summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,30 @@
 import os
 from google import genai
 from google.genai import types
-import base64 # need this if we wanna send images and not just text
-
-client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+from prompts import registry
+from metrics import metrics
+from scheduler import scheduler, estimate_tokens
+from config import config
+from verdict import Verdict, request_verdict
+
+client = None
+
+# Gemini takes an OpenAPI-style schema; enums are only allowed on strings, so violation is a plain integer
+GEMINI_VERDICT_SCHEMA = {
+  "type": "OBJECT",
+  "properties": {
+    "violation": {"type": "INTEGER"},
+    "confidence": {"type": "NUMBER"},
+  },
+  "required": ["violation", "confidence"],
+}
+
+# The client is created on first use, so importing this module does not require an API key
+def get_client() -> genai.Client:
+  global client
+  if client is None:
+    client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+  return client
 
 def test_generate_gemini(prompt: str) -> str:
   """
@@ -13,7 +34,7 @@ def test_generate_gemini(prompt: str) -> str:
   it will afford more customizing of generation params (see below)
   """
 
-  response = client.models.generate_content(
+  response = get_client().models.generate_content(
       model="gemini-1.5-flash",
       contents=prompt
   )
@@ -21,30 +42,40 @@ def test_generate_gemini(prompt: str) -> str:
   return response.text.strip()
 
 
-def evaluate_msg_promptbased_gemini(message: str) -> str:
+async def evaluate_msg_promptbased_gemini(message: str, instructions: str = None) -> Verdict:
   """
   Uses a prompt-based approach to evaluate a message against a policy
   This is similar to the OpenAI example but uses Gemini's capabilities
+  The policy goes in the system instruction so the static prefix is identical on every call
+  The answer is JSON constrained to GEMINI_VERDICT_SCHEMA, at temperature 0 and capped at a few tokens
+  `instructions` overrides the policy prompt, e.g. to evaluate a draft policy
   """
-  with open("../assets/policy.txt") as file:
-    policy = file.read()
-
-  instructions = (
-      "Answer with only a single character: 0 or 1 and a float from 0.0 to 1.0. Make sure there is a space between the int and float in the output"
-      "Make sure your response is limited to only one of those two integers.\n"
-      "Below is given a policy that describes what type of language counts as harassment or hate speech on our platform.\n"
-      "If the user inputted message violates the criteria of the policy, respond with 1, otherwise, respond with 0.\n"
-      "Then, give a confidence score for this classification. The closer to 1.0, the higher the confidence.\n\n"
-      f"{policy}\n\n"
-      f"User message: {message}"
-  )
+  settings = config["structured_output"]
+  instructions = instructions or registry.get("gemini")
+  contents = f"User message: {message}"
+  estimate = estimate_tokens(instructions, contents, output=settings["max_output_tokens"])
+
+  async def call() -> str:
+    # Goes through the scheduler, which enforces our quota and backs off on rate limits
+    response = await scheduler.call("gemini", "gemini-1.5-flash", lambda: get_client().aio.models.generate_content(
+        model="gemini-1.5-flash",
+        contents=contents,
+        config=types.GenerateContentConfig(
+            system_instruction=instructions,
+            temperature=0,
+            max_output_tokens=settings["max_output_tokens"],
+            response_mime_type="application/json",
+            response_schema=GEMINI_VERDICT_SCHEMA,
+        )
+    ), tokens=estimate)
 
-  response = client.models.generate_content(
-      model="gemini-1.5-flash",
-      contents=instructions
-  )
+    usage = response.usage_metadata
+    if usage:
+      scheduler.settle("gemini", "gemini-1.5-flash", estimate, (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0))
+      metrics.record_usage("gemini", "gemini-1.5-flash", usage.prompt_token_count, usage.candidates_token_count)
+    return response.text or ""
 
-  return response.text.strip()
+  return await request_verdict("gemini_prompt", call, settings["parse_retries"])
 
 
 # This is a simple test function that takes a single string prompt using vertex ai (currently not working)
@@ -0,0 +1,160 @@
+# job_queue.py
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from metrics import metrics
+
+# What to do with a new job when the queue is full
+DROP_OLDEST = "drop_oldest" # Make room by discarding the job that has waited longest
+SAMPLE = "sample"           # Keep a random `sample_rate` share of the overflow (each replacing the oldest job)
+SPILL = "spill"             # Append the job to a file on disk and re-queue it once there is room
+POLICIES = (DROP_OLDEST, SAMPLE, SPILL)
+
+
+class JobQueue:
+    """
+    Bounded queue between the gateway event handlers and the classification workers. put() never
+    waits, so a burst of messages cannot stall event handling; when the queue is full the configured
+    policy decides which jobs are shed. Workers call `handler(payload, obj)`, where `payload` is a
+    JSON-serializable dict and `obj` an optional in-memory object (None for jobs restored from disk).
+    Urgent jobs are served before all others and are never shed.
+    """
+
+    def __init__(self, handler, maxsize: int = 1000, workers: int = 32, policy: str = DROP_OLDEST,
+                 sample_rate: float = 0.1, spill_path: str = ""):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}; expected one of {POLICIES}")
+        if policy == SPILL and not spill_path:
+            raise ValueError("The spill policy needs a spill_path")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.spill_path = spill_path
+        self.jobs = deque() # (enqueued_at, payload, obj)
+        self.urgent = deque() # Same, served first
+        self.available = asyncio.Event()
+        self.tasks = set()
+        self.spilled = 0 # Spilled jobs not yet read back, in the file or waiting to be written to it
+        self.spill_offset = 0 # Where to resume reading the spill file
+        self.spill_buffer = [] # Spilled jobs not yet written to the file
+        self.spill_writer = None # Task writing spill_buffer, while it has anything
+        self.spill_lock = asyncio.Lock() # File access happens on worker threads, one operation at a time
+        self.counts = {"accepted": 0, "dropped": 0, "spilled": 0, "restored": 0, "failed": 0}
+        if policy == SPILL and os.path.exists(spill_path):
+            # Jobs spilled before a restart are still waiting
+            with open(spill_path, encoding='utf8') as f:
+                self.spilled = sum(1 for _ in f)
+
+    def start(self):
+        for _ in range(self.workers):
+            task = asyncio.create_task(self._work())
+            self.tasks.add(task)
+
+    def put(self, payload: dict, obj=None, urgent: bool = False):
+        """
+        Queues a job without waiting, applying the backpressure policy if the queue is full
+        :param urgent: Serve the job ahead of the others, exempt from the backpressure policy
+        """
+        if urgent:
+            self.urgent.append((time.perf_counter(), payload, obj))
+            self.counts["accepted"] += 1
+            self.available.set()
+            return
+        if len(self.jobs) >= self.maxsize or (self.policy == SPILL and self.spilled):
+            if self.policy == DROP_OLDEST:
+                self.jobs.popleft()
+                self.counts["dropped"] += 1
+            elif self.policy == SAMPLE:
+                if random.random() >= self.sample_rate:
+                    self.counts["dropped"] += 1
+                    return
+                self.jobs.popleft()
+                self.counts["dropped"] += 1
+            else:
+                # Once anything is on disk, new jobs go there too so they are served in arrival order
+                self._spill(payload)
+                self.available.set() # An idle worker will read it back
+                return
+        self.jobs.append((time.perf_counter(), payload, obj))
+        self.counts["accepted"] += 1
+        self.available.set()
+
+    def _spill(self, payload: dict):
+        # put() runs on the gateway's event loop, so the file is written by a task on a worker thread
+        self.spill_buffer.append(json.dumps(payload) + "\n")
+        self.spilled += 1
+        self.counts["spilled"] += 1
+        if self.spill_writer is None:
+            self.spill_writer = asyncio.create_task(self._write_spilled())
+
+    async def _write_spilled(self):
+        try:
+            while self.spill_buffer:
+                async with self.spill_lock:
+                    lines, self.spill_buffer = self.spill_buffer, []
+                    await asyncio.to_thread(self._append_lines, lines)
+                self.available.set() # An idle worker will read them back
+        finally:
+            self.spill_writer = None
+
+    def _append_lines(self, lines: list):
+        with open(self.spill_path, "a", encoding='utf8') as f:
+            f.writelines(lines)
+
+    def _read_lines(self, offset: int, count: int) -> tuple:
+        """
+        :return: (up to `count` jobs from the spill file starting at `offset`, the offset after them)
+        """
+        payloads = []
+        with open(self.spill_path, encoding='utf8') as f:
+            f.seek(offset)
+            for _ in range(count):
+                line = f.readline()
+                if not line:
+                    break
+                payloads.append(json.loads(line))
+            return payloads, f.tell()
+
+    async def _restore(self):
+        """
+        Moves spilled jobs back into the queue while there is room, up to half its capacity so live
+        traffic keeps some headroom
+        """
+        async with self.spill_lock:
+            room = max(1, self.maxsize // 2) - len(self.jobs)
+            if room <= 0 or self.spilled <= len(self.spill_buffer):
+                return # No room, or nothing on disk yet
+            payloads, self.spill_offset = await asyncio.to_thread(self._read_lines, self.spill_offset, room)
+            for payload in payloads:
+                self.jobs.append((time.perf_counter(), payload, None))
+            self.spilled -= len(payloads)
+            self.counts["restored"] += len(payloads)
+            if not self.spilled:
+                # Everything has been read back; start the file afresh
+                await asyncio.to_thread(os.remove, self.spill_path)
+                self.spill_offset = 0
+        self.available.set()
+
+    async def _work(self):
+        while True:
+            if self.spilled:
+                await self._restore()
+            if not self.jobs and not self.urgent:
+                self.available.clear()
+                await self.available.wait()
+                continue
+            enqueued_at, payload, obj = (self.urgent or self.jobs).popleft()
+            metrics.observe("job_queue_wait_seconds", time.perf_counter() - enqueued_at)
+            try:
+                await self.handler(payload, obj)
+            except Exception as e:
+                self.counts["failed"] += 1
+                print(f"Job failed: {e!r}")
+
+    def stats(self) -> dict:
+        return {"depth": len(self.jobs), "urgent_depth": len(self.urgent), "spill_depth": self.spilled, **self.counts}
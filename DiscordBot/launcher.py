@@ -0,0 +1,90 @@
+# launcher.py
+"""
+Runs ModBot as several processes, each connected to Discord with its own group of shards, so the bot
+can use more than one core and gateway connection as it joins more guilds.
+
+Usage: python launcher.py [--shard-count N] [--processes P]
+
+Discord assigns every guild to shard (guild_id >> 22) % shard_count, so each process only ever sees
+its own guilds' channels, messages and reactions. The processes share the report store (SQLite in
+WAL mode); reports filed through DMs, which Discord delivers to shard 0 only, are picked up from it by
+the process that serves the reported message's guild. A process that exits is restarted.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import requests
+from config import config
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def recommended_shard_count(token: str) -> int:
+    """
+    Asks Discord how many shards it recommends for this bot (roughly one per 1000 guilds)
+    """
+    response = requests.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"})
+    response.raise_for_status()
+    return response.json()["shards"]
+
+
+def partition(shard_count: int, processes: int) -> list:
+    """
+    Splits the shards into contiguous groups, one per process
+    :return: List of shard ID lists
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def spawn(index: int, shard_ids: list, shard_count: int) -> subprocess.Popen:
+    print(f"Starting process {index} with shards {shard_ids} of {shard_count}")
+    return subprocess.Popen(
+        [sys.executable, BOT_PATH, "--shard-count", str(shard_count), "--shard-ids", *map(str, shard_ids),
+         "--process-index", str(index)],
+        cwd=os.path.dirname(BOT_PATH),
+    )
+
+
+def main():
+    settings = config["sharding"]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard-count", type=int, default=settings["shard_count"])
+    parser.add_argument("--processes", type=int, default=settings["processes"])
+    args = parser.parse_args()
+
+    shard_count = args.shard_count
+    if not shard_count:
+        with open(os.path.join(os.path.dirname(BOT_PATH), "tokens.json")) as f:
+            shard_count = recommended_shard_count(json.load(f)["discord"])
+    groups = partition(shard_count, args.processes or os.cpu_count() or 1)
+
+    procs = {i: spawn(i, shard_ids, shard_count) for i, shard_ids in enumerate(groups)}
+    try:
+        while True:
+            time.sleep(1)
+            for i, proc in procs.items():
+                if proc.poll() is not None:
+                    print(f"Process {i} exited with code {proc.returncode}; restarting in {settings['restart_delay']}s")
+                    time.sleep(settings["restart_delay"])
+                    procs[i] = spawn(i, groups[i], shard_count)
+    except KeyboardInterrupt:
+        print("Stopping shard processes")
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# metrics.py
+"""
+In-process instrumentation for the moderation pipeline.
+
+Counters and latency histograms are keyed by a metric name plus labels (for example the provider),
+and can be read three ways: as Prometheus text from a small local HTTP endpoint, as a short summary
+posted to the mod channel, or directly through `metrics` in code.
+"""
+import time
+import random
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from config import config
+
+# Upper bounds (seconds) of the latency buckets exposed to Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Observations kept per histogram for the p50/p95/p99 estimates
+RESERVOIR_SIZE = 2048
+
+# Optional dict that record_usage also adds tokens and cost to (and the scheduler the seconds spent on
+# provider requests), so a caller (such as an evaluation sweep) can attribute usage to the work it
+# started without sharing counters with everything else
+usage = contextvars.ContextVar("usage", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.reservoir = []
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        # Reservoir sampling keeps a uniform sample of everything observed in bounded memory
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < RESERVOIR_SIZE:
+                self.reservoir[i] = value
+
+    def percentile(self, p: float) -> float:
+        if not self.reservoir:
+            return 0.0
+        ordered = sorted(self.reservoir)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def _label_str(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {} # Map from (name, labels) to value
+        self.histograms = {} # Map from (name, labels) to Histogram
+        self.collectors = {} # Map from prefix to a function returning a dict of current values
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def histogram(self, name: str, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Records how long the block takes in `<name>_seconds`, and counts timeouts and errors
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self.inc(f"{name}_timeouts_total", **labels)
+            raise
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def record_usage(self, provider: str, model: str, input_tokens: int, output_tokens: int):
+        """
+        Counts tokens used by a provider call and the estimated cost from config["pricing"] (USD per 1M tokens)
+        """
+        input_tokens, output_tokens = input_tokens or 0, output_tokens or 0
+        self.inc("tokens_total", input_tokens, provider=provider, model=model, direction="input")
+        self.inc("tokens_total", output_tokens, provider=provider, model=model, direction="output")
+        price = config["pricing"].get(model)
+        if price:
+            cost = (input_tokens * price["input"] + output_tokens * price["output"]) / 1_000_000
+            self.inc("cost_usd_total", cost, provider=provider, model=model)
+        else:
+            cost = 0.0
+        sink = usage.get()
+        if sink is not None:
+            sink["input_tokens"] = sink.get("input_tokens", 0) + input_tokens
+            sink["output_tokens"] = sink.get("output_tokens", 0) + output_tokens
+            sink["cost_usd"] = sink.get("cost_usd", 0.0) + cost
+
+    def add_collector(self, prefix: str, fn):
+        """
+        Exposes the numeric values of fn() (e.g. a component's stats()) as gauges named <prefix>_<key>
+        """
+        self.collectors[prefix] = fn
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_label_str(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{_label_str(labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_label_str(labels, le)} {hist.count}")
+            lines.append(f"{name}_sum{_label_str(labels)} {hist.sum}")
+            lines.append(f"{name}_count{_label_str(labels)} {hist.count}")
+        for prefix, fn in self.collectors.items():
+            for key, value in fn().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, max_length: int = 2000) -> str:
+        """
+        Human-readable digest for the mod channel: latency percentiles per stage, errors and cost
+        :param max_length: Longest message to return (Discord's limit). When the stages do not all fit,
+        the busiest are kept and the rest are left to the Prometheus endpoint.
+        """
+        footer = ""
+        failures = [(k, v) for k, v in self.counters.items() if k[0].endswith(("_errors_total", "_timeouts_total"))]
+        if failures:
+            footer += "\n" + _truncate("**Errors and timeouts:** " + ", ".join(f"{name}{_label_str(labels)}: {int(v)}" for (name, labels), v in failures), max_length // 4)
+        costs = [(dict(labels)["provider"], v) for (name, labels), v in self.counters.items() if name == "cost_usd_total"]
+        if costs:
+            footer += "\n" + _truncate("**Estimated cost:** " + ", ".join(f"{provider}: ${v:.4f}" for provider, v in costs), max_length // 4)
+
+        header = "**Pipeline metrics**\n```\n" + f"{'stage':<45} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8}\n"
+        rows = {}
+        for (name, labels), hist in self.histograms.items():
+            stage = name + _label_str(labels)
+            rows[(name, labels)] = f"{stage[:45]:<45} {hist.count:>7} {hist.percentile(50):>8.3f} {hist.percentile(95):>8.3f} {hist.percentile(99):>8.3f}\n"
+        # Room for the table rows, keeping space for a note on the stages left out
+        budget = max_length - len(header) - len("```") - len(footer) - 60
+        kept = set()
+        for key in sorted(rows, key=lambda key: -self.histograms[key].count):
+            if len(rows[key]) > budget:
+                break
+            kept.add(key)
+            budget -= len(rows[key])
+        msg = header + "".join(rows[key] for key in sorted(kept))
+        if len(kept) < len(rows):
+            msg += f"... {len(rows) - len(kept)} more stages on the metrics endpoint\n"
+        return msg + "```" + footer
+
+
+metrics = Metrics()
+
+
+def _truncate(text: str, max_length: int) -> str:
+    return text if len(text) <= max_length else text[:max_length - 3] + "..."
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """
+    Measures how late the event loop wakes a sleeping task; anything beyond a few milliseconds means
+    some handler is blocking the loop
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop_lag_seconds", max(0.0, time.perf_counter() - start - interval))
+
+
+async def serve_metrics(host: str, port: int):
+    """
+    Starts the Prometheus endpoint at http://<host>:<port>/metrics
+    """
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,50 +1,81 @@
 # google_genai.py
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI
+from prompts import registry
+from config import config
+from batcher import MicroBatcher
+from metrics import metrics
+from scheduler import scheduler, estimate_tokens
+from verdict import Verdict, VERDICT_SCHEMA, request_verdict
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+client = None
+
+# The client is created on first use, so importing this module does not require an API key
+def get_client() -> AsyncOpenAI:
+  global client
+  if client is None:
+    client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+  return client
 
 # Simple prompt based approach for detecting hate speech / harassment
 # Uses policy as prompt engineered input for classifying a chat message
-def evaluate_msg_promptbased_openai(message: str) -> int:
-  with open("../assets/policy.txt") as file:
-    policy = file.read()
-
-  instructions = """
-  Answer only in the following format int, float: 0 or 1 and a float from 0.0 to 1.0. Make sure your response is limited to only one of those two integers for
-  the first value. Also make sure that there is a space between the int and float.
-  Below is given a policy that describes what type of language counts as harassment or hate speech on our platform.
-  If the user inputted message violates the criteria of the policy, respond with 1, otherwise, respond with 0
-  Then, give a confidence score for this classification between 0.0 and 1.0. The closer to 1.0, the the higher you are confident in correctly
-  classifying the message.\n
-  """
+# Every request goes through the scheduler, which enforces our quota and backs off on rate limits
+# The answer is constrained to the verdict JSON schema, deterministic and capped at a few tokens
+# `instructions` overrides the policy prompt, e.g. to evaluate a draft policy
+async def evaluate_msg_promptbased_openai(message: str, instructions: str = None) -> Verdict:
+  settings = config["structured_output"]
+  instructions = instructions or registry.get("openai")
+  estimate = estimate_tokens(instructions, message, output=settings["max_output_tokens"])
 
-  instructions += policy
+  async def call() -> str:
+    raw = await scheduler.call("openai", "gpt-4.1-mini", lambda: get_client().responses.with_raw_response.create(
+      model="gpt-4.1-mini",
+      instructions=instructions,
+      input=message,
+      temperature=0,
+      max_output_tokens=settings["max_output_tokens"],
+      text={"format": {"type": "json_schema", "name": "verdict", "schema": VERDICT_SCHEMA, "strict": True}}
+    ), tokens=estimate)
+    scheduler.observe_headers("openai", "gpt-4.1-mini", raw.headers)
+    response = raw.parse()
 
-  response = client.responses.create(
-    model="gpt-4.1-mini",
-    instructions=instructions,
-    input=message
-  )
+    scheduler.settle("openai", "gpt-4.1-mini", estimate, response.usage.input_tokens + response.usage.output_tokens)
+    metrics.record_usage("openai", "gpt-4.1-mini", response.usage.input_tokens, response.usage.output_tokens)
+    return response.output_text
 
-  return response.output_text.strip()
+  return await request_verdict("openai_prompt", call, settings["parse_retries"])
 
 # Uses the default openai moderation endpoint to detect hate speech / harassment
-def evaluate_msg_moderation_api_openai(message: str) -> dict:
-  response = client.moderations.create(
+# Messages arriving close together are sent as one batched request (see moderation_batcher below)
+async def evaluate_msg_moderation_api_openai(message: str) -> dict:
+  return await moderation_batcher.submit(message)
+
+# Sends a list of messages in a single moderation request and returns one result dict per message
+async def moderate_batch(messages: list) -> list:
+  raw = await scheduler.call("openai", "text-moderation-latest", lambda: get_client().moderations.with_raw_response.create(
     model="text-moderation-latest",
-    input=message
-  )
+    input=messages
+  ))
+  scheduler.observe_headers("openai", "text-moderation-latest", raw.headers)
+  response = raw.parse()
+  metrics.inc("moderation_requests_total")
 
-  categories = response.results[0].categories
-  category_scores = response.results[0].category_scores 
+  results = []
+  for result in response.results:
+    categories = result.categories
+    category_scores = result.category_scores
 
-  data = {
-    "harrassment": (categories.harassment, category_scores.harassment),
-    "harrassment_threatening": (categories.harassment_threatening, category_scores.harassment_threatening),
-    "hate": (categories.hate, category_scores.hate),
-    "hate_threatening": (categories.hate_threatening, category_scores.hate_threatening)
-  }
+    results.append({
+      "harrassment": (categories.harassment, category_scores.harassment),
+      "harrassment_threatening": (categories.harassment_threatening, category_scores.harassment_threatening),
+      "hate": (categories.hate, category_scores.hate),
+      "hate_threatening": (categories.hate_threatening, category_scores.hate_threatening)
+    })
+  return results
 
-  print(data)
-  return data
+moderation_batcher = MicroBatcher(
+  moderate_batch,
+  window=config["moderation_batching"]["window_ms"] / 1000,
+  max_batch_size=config["moderation_batching"]["max_batch_size"]
+)
+metrics.add_collector("moderation_batcher", moderation_batcher.stats)
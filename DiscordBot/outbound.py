@@ -0,0 +1,174 @@
+# outbound.py
+import time
+import asyncio
+from collections import deque
+from metrics import metrics
+
+FENCE = "```"
+
+
+def split_text(text: str, max_length: int) -> list:
+    """
+    Splits text into pieces of at most max_length characters, at line breaks where possible. A code
+    block cut by a split is closed at the end of its piece and reopened at the start of the next, so
+    every piece renders on its own.
+    """
+    pieces = []
+    while len(text) > max_length:
+        # Leave room to close a code block
+        limit = max_length - len(FENCE) - 1
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        piece, text = text[:cut], text[cut:].lstrip("\n")
+        if piece.count(FENCE) % 2:
+            piece += "\n" + FENCE
+            text = FENCE + "\n" + text
+        pieces.append(piece)
+    pieces.append(text)
+    return pieces
+
+
+class Outbox:
+    """
+    Every message the bot sends goes through here. Each destination (a channel, or a user for DMs)
+    has its own queue and a task that serves it, so a slow or rate-limited channel never holds up
+    the others. Plain text messages waiting in a queue are joined into as few messages as fit in
+    Discord's `max_length` characters, so a flow that sends several lines at once costs one request.
+    Each destination sends at most `burst` messages per `period` seconds, which keeps us under
+    Discord's per-channel limit; messages that arrive while a queue waits for the limit are joined
+    into the next send instead of piling up 429s.
+
+    send() resolves to the Discord message that carried the text, so a caller that needs a message
+    ID (e.g. to watch for reactions) gets the message its text is part of.
+    """
+
+    def __init__(self, deliver, max_length: int = 2000, burst: int = 5, period: float = 5.0, idle_timeout: float = 60):
+        """
+        :param deliver: Coroutine function deliver(destination, content, **kwargs) that makes one send request
+        """
+        self.deliver = deliver
+        self.max_length = max_length
+        self.burst = burst
+        self.period = period
+        self.idle_timeout = idle_timeout
+        self.queues = {} # Map from destination key to its deque of (content, alone, kwargs, future)
+        self.wakeups = {} # Map from destination key to the event its task waits on
+        self.sent = {} # Map from destination key to the times of its recent sends
+        self.tasks = set()
+        self.counts = {"queued": 0, "requests": 0, "coalesced": 0, "failed": 0}
+
+    @staticmethod
+    def key(destination) -> tuple:
+        # Users and channels can share an ID space, so the type is part of the key
+        return type(destination).__name__, destination.id
+
+    async def send(self, destination, content: str = None, alone: bool = False, **kwargs):
+        """
+        Queues a message and waits until Discord has accepted it
+        :param alone: Never join this message with others, e.g. because moderators react to it
+        :param kwargs: Passed to destination.send(); messages with any (an embed, a reply reference)
+        are sent on their own too
+        :return: The Discord message the content was sent in
+        """
+        return await self._enqueue(destination, content, alone, kwargs)
+
+    async def send_all(self, destination, contents: list, alone: bool = False):
+        """
+        Queues several messages at once, so they go out together, and returns the last one sent
+        :param alone: Join them only with each other, e.g. when the last one is a prompt moderators react to
+        """
+        if alone:
+            return await self.send(destination, "\n".join(contents), alone=True)
+        # Every message is queued before anything else can run, so they keep their place in line
+        futures = [self._enqueue(destination, content, False, {}) for content in contents]
+        messages = await asyncio.gather(*futures)
+        return messages[-1] if messages else None
+
+    def _enqueue(self, destination, content: str, alone: bool, kwargs: dict) -> asyncio.Future:
+        # Synchronous, so messages are queued in the order send() and send_all() were called
+        future = asyncio.get_running_loop().create_future()
+        key = self.key(destination)
+        if key not in self.queues:
+            self.queues[key] = deque()
+            self.wakeups[key] = asyncio.Event()
+            self.sent[key] = deque()
+            task = asyncio.create_task(self._serve(key, destination))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        self.queues[key].append((content, alone, kwargs, future))
+        self.wakeups[key].set()
+        self.counts["queued"] += 1
+        return future
+
+    def _take_batch(self, queue: deque) -> tuple:
+        """
+        Pops the next message, joined with the plain text messages right behind it while they fit
+        :return: (content, kwargs, futures)
+        """
+        content, alone, kwargs, future = queue.popleft()
+        futures = [future]
+        if alone or kwargs or content is None:
+            return content, kwargs, futures
+        parts = [content]
+        length = len(content)
+        while queue:
+            next_content, next_alone, next_kwargs, next_future = queue[0]
+            if next_alone or next_kwargs or next_content is None or length + 1 + len(next_content) > self.max_length:
+                break
+            queue.popleft()
+            parts.append(next_content)
+            length += 1 + len(next_content)
+            futures.append(next_future)
+        self.counts["coalesced"] += len(parts) - 1
+        return "\n".join(parts), kwargs, futures
+
+    async def _wait_for_slot(self, key: tuple):
+        # Sliding window of the last `burst` sends to this destination
+        sent = self.sent[key]
+        while sent and time.monotonic() - sent[0] >= self.period:
+            sent.popleft()
+        if len(sent) >= self.burst:
+            delay = self.period - (time.monotonic() - sent[0])
+            metrics.observe("outbound_wait_seconds", delay)
+            await asyncio.sleep(delay)
+            sent.popleft()
+
+    async def _serve(self, key: tuple, destination):
+        queue, wakeup = self.queues[key], self.wakeups[key]
+        try:
+            while True:
+                if not queue:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout=self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        if not queue:
+                            return
+                    continue
+                await self._wait_for_slot(key)
+                content, kwargs, futures = self._take_batch(queue)
+                try:
+                    # Text that is still too long on its own is sent in pieces; callers get the last one
+                    pieces = split_text(content, self.max_length) if content else [content]
+                    for i, piece in enumerate(pieces):
+                        if i:
+                            await self._wait_for_slot(key)
+                        message = await self.deliver(destination, piece, **kwargs)
+                        self.sent[key].append(time.monotonic())
+                        self.counts["requests"] += 1
+                except Exception as e:
+                    self.counts["failed"] += 1
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            # Nothing is left in the queue when the task ends normally; it is recreated on the next send
+            del self.queues[key], self.wakeups[key], self.sent[key]
+
+    def stats(self) -> dict:
+        return {"destinations": len(self.queues), **self.counts}
@@ -0,0 +1,241 @@
+# prediction_store.py
+"""
+Persistent store of evaluation predictions, so re-running an evaluation only pays for rows the model
+has not answered yet under the same configuration.
+
+A prediction is keyed by (row hash, model, prompt hash): the row hash covers the normalized message
+text, and the prompt hash covers everything that could change the answer (backend config, model
+name, instructions and policy). Editing assets/policy.txt therefore invalidates every prediction of
+the prompt-based models, while relabelling a row or re-running an unchanged setup reuses them all.
+An interrupted run resumes the same way, since every answer is stored as it arrives.
+
+Each run is recorded with the rows it covered, so runs can be listed and compared. Predictions
+made by evaluation.py and sweep.py also keep the request's provider latency, tokens and cost, so a
+sweep answered entirely from the store can still compare the configurations' speed and cost.
+
+Usage:
+    python prediction_store.py runs [<file>]
+    python prediction_store.py diff <run id> <run id>
+"""
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import argparse
+from config import config
+
+MIGRATIONS = [
+    """
+    CREATE TABLE predictions (
+        row_hash TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_hash TEXT NOT NULL,
+        classification INTEGER NOT NULL,
+        confidence REAL NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (row_hash, model, prompt_hash)
+    ) WITHOUT ROWID;
+    CREATE TABLE runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dataset TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_hash TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        queried INTEGER NOT NULL DEFAULT 0,
+        reused INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        summary TEXT
+    );
+    CREATE TABLE run_rows (
+        run_id INTEGER NOT NULL,
+        row_id TEXT NOT NULL,
+        row_hash TEXT NOT NULL,
+        label INTEGER NOT NULL,
+        PRIMARY KEY (run_id, row_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX runs_dataset ON runs (dataset, model);
+    """,
+    """
+    ALTER TABLE predictions ADD COLUMN latency_ms REAL;
+    ALTER TABLE predictions ADD COLUMN input_tokens INTEGER;
+    ALTER TABLE predictions ADD COLUMN output_tokens INTEGER;
+    ALTER TABLE predictions ADD COLUMN cost_usd REAL;
+    """,
+]
+
+# Rows per IN (...) lookup, comfortably below SQLite's variable limit
+LOOKUP_BATCH = 500
+
+
+class PredictionStore:
+    def __init__(self, path: str):
+        # Lookups and flushes run on worker threads so the event loop never waits on disk; they can
+        # overlap, so every use of the connection holds the lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.pending = [] # Predictions not yet written
+
+    def migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.db.executescript(migration)
+            self.db.execute(f"PRAGMA user_version = {i}")
+        self.db.commit()
+
+    def lookup(self, row_hashes: list, model: str, prompt_hash: str) -> dict:
+        """
+        :return: Map from row hash to (classification, confidence) for the rows already predicted
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(row_hashes), LOOKUP_BATCH):
+                batch = row_hashes[i:i + LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for row in self.db.execute(
+                    f"""SELECT row_hash, classification, confidence FROM predictions
+                    WHERE model = ? AND prompt_hash = ? AND row_hash IN ({placeholders})""",
+                    (model, prompt_hash, *batch)
+                ):
+                    found[row["row_hash"]] = (row["classification"], row["confidence"])
+        return found
+
+    def measurements(self, row_hashes: list, model: str, prompt_hash: str) -> dict:
+        """
+        :return: Map from row hash to (latency_ms, input_tokens, output_tokens, cost_usd) for the rows
+        whose prediction was stored with measurements
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(row_hashes), LOOKUP_BATCH):
+                batch = row_hashes[i:i + LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for row in self.db.execute(
+                    f"""SELECT row_hash, latency_ms, input_tokens, output_tokens, cost_usd FROM predictions
+                    WHERE model = ? AND prompt_hash = ? AND row_hash IN ({placeholders}) AND latency_ms IS NOT NULL""",
+                    (model, prompt_hash, *batch)
+                ):
+                    found[row["row_hash"]] = (row["latency_ms"], row["input_tokens"], row["output_tokens"], row["cost_usd"])
+        return found
+
+    def add(self, row_hash: str, model: str, prompt_hash: str, classification: int, confidence: float,
+            measured: tuple = (None, None, None, None)):
+        """
+        :param measured: (latency_ms, input_tokens, output_tokens, cost_usd) of the request that made the prediction
+        """
+        self.pending.append((row_hash, model, prompt_hash, classification, confidence, time.time(), *measured))
+
+    def _write(self, predictions: list):
+        with self.lock:
+            self.db.executemany(
+                """INSERT OR REPLACE INTO predictions (row_hash, model, prompt_hash, classification, confidence,
+                    created_at, latency_ms, input_tokens, output_tokens, cost_usd)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                predictions
+            )
+            self.db.commit()
+
+    async def flush(self):
+        predictions, self.pending = self.pending, []
+        if predictions:
+            await asyncio.to_thread(self._write, predictions)
+
+    def start_run(self, dataset: str, model: str, prompt_hash: str) -> int:
+        with self.lock:
+            cur = self.db.execute(
+                "INSERT INTO runs (dataset, model, prompt_hash, started_at) VALUES (?, ?, ?, ?)",
+                (dataset, model, prompt_hash, time.time())
+            )
+            self.db.commit()
+        return cur.lastrowid
+
+    def add_run_rows(self, run_id: int, rows: list):
+        """
+        :param rows: (row ID, row hash, label) of every dataset row the run covers
+        """
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO run_rows VALUES (?, ?, ?, ?)", [(run_id, *row) for row in rows])
+            self.db.commit()
+
+    def finish_run(self, run_id: int, queried: int, reused: int, failed: int, summary: dict):
+        with self.lock:
+            self.db.execute(
+                "UPDATE runs SET finished_at = ?, queried = ?, reused = ?, failed = ?, summary = ? WHERE id = ?",
+                (time.time(), queried, reused, failed, json.dumps(summary), run_id)
+            )
+            self.db.commit()
+
+    def runs(self, dataset: str = None) -> list:
+        if dataset:
+            return self.db.execute("SELECT * FROM runs WHERE dataset = ? ORDER BY id", (dataset,)).fetchall()
+        return self.db.execute("SELECT * FROM runs ORDER BY id").fetchall()
+
+    def run_predictions(self, run_id: int) -> list:
+        """
+        Every row of a run with its label and prediction (rows the run failed to classify are left out)
+        """
+        return self.db.execute(
+            """SELECT r.row_id, r.label, p.classification, p.confidence FROM run_rows r
+            JOIN runs ON runs.id = r.run_id
+            JOIN predictions p ON p.row_hash = r.row_hash AND p.model = runs.model AND p.prompt_hash = runs.prompt_hash
+            WHERE r.run_id = ? ORDER BY r.row_id""",
+            (run_id,)
+        ).fetchall()
+
+    def diff(self, old_run: int, new_run: int) -> list:
+        """
+        Rows present in both runs whose verdict changed
+        :return: Dicts with the row ID, its label and the old and new classification and confidence
+        """
+        old = {row["row_id"]: row for row in self.run_predictions(old_run)}
+        changed = []
+        for row in self.run_predictions(new_run):
+            before = old.get(row["row_id"])
+            if before is not None and before["classification"] != row["classification"]:
+                changed.append({
+                    "id": row["row_id"],
+                    "label": row["label"],
+                    "old": (before["classification"], before["confidence"]),
+                    "new": (row["classification"], row["confidence"]),
+                })
+        return changed
+
+
+def format_diff(old_run: int, new_run: int, changed: list) -> str:
+    fixed = [c for c in changed if c["new"][0] == c["label"]]
+    broken = [c for c in changed if c["old"][0] == c["label"]]
+    msg = f"Run {old_run} -> run {new_run}: {len(changed)} verdicts changed, {len(fixed)} now correct, {len(broken)} now wrong\n"
+    for c in changed:
+        mark = "fixed" if c in fixed else "broken" if c in broken else "changed"
+        msg += f"{c['id']:>10} label {c['label']}: {c['old'][0]} ({c['old'][1]:.2f}) -> {c['new'][0]} ({c['new'][1]:.2f}) {mark}\n"
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect stored evaluation runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    runs_parser = sub.add_parser("runs")
+    runs_parser.add_argument("file", nargs="?")
+    diff_parser = sub.add_parser("diff")
+    diff_parser.add_argument("old_run", type=int)
+    diff_parser.add_argument("new_run", type=int)
+    args = parser.parse_args()
+
+    store = PredictionStore(config["evaluation"]["prediction_store"])
+    if args.command == "runs":
+        for run in store.runs(args.file):
+            summary = json.loads(run["summary"]) if run["summary"] else {}
+            status = f"recall {summary['recall']:.2f}, precision {summary['precision']:.2f}" if summary else "unfinished"
+            print(f"{run['id']:>4} {run['dataset']} {run['model']} prompt {run['prompt_hash'][:8]} "
+                  f"queried {run['queried']}, reused {run['reused']}, failed {run['failed']}: {status}")
+    else:
+        print(format_diff(args.old_run, args.new_run, store.diff(args.old_run, args.new_run)), end="")
+
+
+if __name__ == "__main__":
+    main()
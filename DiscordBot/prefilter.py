@@ -0,0 +1,176 @@
+# prefilter.py
+"""
+Local first-stage classifier that runs before the remote providers.
+
+Messages are turned into hashed word and character n-gram features and scored by a logistic
+regression trained offline on the labelled CSV. The weights are stored as a small NumPy artifact,
+so scoring a message is a handful of array lookups. Messages that score below `safe_threshold`
+are treated as clearly benign and never reach the paid classifiers; everything else is escalated.
+
+Usage:
+  python prefilter.py train [--data anti-lgbt-cyberbullying.csv] [--out ../assets/prefilter.npz]
+  python prefilter.py report [--thresholds 0.02 0.05 0.1] [files ...]
+"""
+import os
+import zlib
+import argparse
+import numpy as np
+from config import config
+from prompts import ASSETS_DIR
+from evaluation import read_rows, resolve_dataset
+from verdict_cache import normalize
+
+MODEL_PATH = os.path.join(ASSETS_DIR, 'prefilter.npz')
+N_FEATURES = 2 ** 18
+# One in HOLDOUT_MOD rows (picked by a hash of the row id) is kept out of training for the report
+HOLDOUT_MOD = 5
+
+
+def features(text: str, n_features: int = N_FEATURES) -> np.ndarray:
+    """
+    Hashes word unigrams and bigrams plus character 3- to 5-grams into feature indices. crc32 is used
+    rather than hash() so the indices are the same in every process.
+    """
+    text = normalize(text)
+    words = text.split(' ')
+    grams = words + [a + ' ' + b for a, b in zip(words, words[1:])]
+    padded = f' {text} '
+    for n in (3, 4, 5):
+        grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return np.unique(np.fromiter((zlib.crc32(g.encode('utf8')) % n_features for g in grams), dtype=np.int64))
+
+
+def is_holdout(message_id: str) -> bool:
+    return zlib.crc32(message_id.encode('utf8')) % HOLDOUT_MOD == 0
+
+
+class Prefilter:
+    def __init__(self, weights: np.ndarray, bias: float, safe_threshold: float = 0.02):
+        self.weights = weights
+        self.bias = bias
+        self.n_features = len(weights)
+        self.safe_threshold = safe_threshold
+        self.seen = 0
+        self.short_circuited = 0
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH, safe_threshold: float = 0.02):
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"]), safe_threshold)
+
+    def save(self, path: str = MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights.astype(np.float32), bias=np.float32(self.bias))
+
+    def score(self, text: str) -> float:
+        """
+        Returns the estimated probability that a message violates the policy
+        """
+        idx = features(text, self.n_features)
+        if len(idx) == 0:
+            return 0.0
+        z = self.bias + self.weights[idx].sum() / np.sqrt(len(idx))
+        return float(1.0 / (1.0 + np.exp(-z)))
+
+    def is_safe(self, text: str) -> bool:
+        """
+        True if the message is confidently benign and the remote providers can be skipped
+        """
+        self.seen += 1
+        if self.score(text) < self.safe_threshold:
+            self.short_circuited += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "seen": self.seen,
+            "short_circuited": self.short_circuited,
+            "short_circuit_rate": self.short_circuited / self.seen if self.seen else 0,
+        }
+
+
+def train(rows, epochs: int = 8, lr: float = 0.5, l2: float = 1e-6, n_features: int = N_FEATURES) -> Prefilter:
+    """
+    Fits the logistic regression with plain SGD over the sparse feature indices
+    :param rows: Iterable of (message_id, text, label)
+    """
+    samples = [(features(text, n_features), label) for _, text, label in rows]
+    weights = np.zeros(n_features, dtype=np.float64)
+    bias = 0.0
+    rng = np.random.default_rng(0)
+    for epoch in range(epochs):
+        loss = 0.0
+        for i in rng.permutation(len(samples)):
+            idx, label = samples[i]
+            if len(idx) == 0:
+                continue
+            scale = 1.0 / np.sqrt(len(idx))
+            p = 1.0 / (1.0 + np.exp(-(bias + weights[idx].sum() * scale)))
+            grad = p - label
+            weights[idx] -= lr * (grad * scale + l2 * weights[idx])
+            bias -= lr * grad
+            loss -= np.log((p if label else 1.0 - p) + 1e-12)
+        print(f"Epoch {epoch + 1}/{epochs}: mean log loss {loss / len(samples):.4f}")
+    return Prefilter(weights, bias)
+
+
+def report(prefilter: Prefilter, paths: list, thresholds: list):
+    """
+    Prints, for each threshold, the share of messages that would skip the remote providers and the
+    share of violating messages that would still be escalated (the best recall the pipeline can reach)
+    """
+    for path in paths:
+        rows = list(read_rows(path))
+        scores = np.array([prefilter.score(text) for _, text, _ in rows])
+        labels = np.array([label for _, _, label in rows])
+        holdout = np.array([is_holdout(message_id) for message_id, _, _ in rows])
+        print(f"\n{os.path.basename(path)} ({len(rows)} rows, {holdout.sum()} held out of training)")
+        print("threshold  short-circuited  escalation recall  holdout short-circuited  holdout recall")
+        for t in thresholds:
+            safe = scores < t
+            line = f"{t:9.3f}  {safe.mean():15.1%}  {(~safe[labels == 1]).mean():17.1%}"
+            if holdout.any():
+                h_safe, h_labels = safe[holdout], labels[holdout]
+                line += f"  {h_safe.mean():23.1%}  {(~h_safe[h_labels == 1]).mean():14.1%}"
+            print(line)
+
+
+def load_prefilter():
+    """
+    Loads the artifact according to config, or returns None if the pre-filter is disabled or untrained
+    """
+    settings = config["prefilter"]
+    path = settings["model_path"] or MODEL_PATH
+    if not settings["enabled"]:
+        return None
+    if not os.path.isfile(path):
+        print(f"No pre-filter model at {path}; every message will be sent to the remote classifiers.")
+        return None
+    return Prefilter.load(path, settings["safe_threshold"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local pre-filter")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_parser = sub.add_parser("train")
+    train_parser.add_argument("--data", default="anti-lgbt-cyberbullying.csv")
+    train_parser.add_argument("--out", default=MODEL_PATH)
+    train_parser.add_argument("--epochs", type=int, default=8)
+    report_parser = sub.add_parser("report")
+    report_parser.add_argument("files", nargs="*", default=["anti-lgbt-cyberbullying.csv", "anti-lgbt-cyberbullying-filtered.csv"])
+    report_parser.add_argument("--model", default=MODEL_PATH)
+    report_parser.add_argument("--thresholds", type=float, nargs="+", default=[0.01, 0.02, 0.05, 0.1, 0.2])
+    args = parser.parse_args()
+
+    if args.command == "train":
+        rows = [row for row in read_rows(resolve_dataset(args.data)) if not is_holdout(row[0])]
+        prefilter = train(rows, epochs=args.epochs)
+        prefilter.save(args.out)
+        print(f"Saved pre-filter to {args.out}")
+    else:
+        prefilter = Prefilter.load(args.model)
+        report(prefilter, [resolve_dataset(f) for f in args.files], args.thresholds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# prompts.py
+import os
+import time
+from config import config
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+POLICY_PATH = os.path.join(ASSETS_DIR, 'policy.txt')
+
+# The task description comes first and the policy right after it, so every request starts with the
+# exact same static prefix and only the user message at the end varies. That is what lets the
+# providers' prompt caching reuse the prefix between calls.
+# The answer format itself is enforced by each provider's structured output mode (see verdict.py)
+OPENAI_HEADER = """
+  Answer with a JSON object {"violation": 0 or 1, "confidence": float from 0.0 to 1.0} and nothing else.
+  Below is given a policy that describes what type of language counts as harassment or hate speech on our platform.
+  If the user inputted message violates the criteria of the policy, set violation to 1, otherwise, set it to 0.
+  Then, give a confidence score for this classification between 0.0 and 1.0. The closer to 1.0, the the higher you are confident in correctly
+  classifying the message.\n
+  """
+
+GEMINI_HEADER = (
+    "Answer with a JSON object {\"violation\": 0 or 1, \"confidence\": float from 0.0 to 1.0} and nothing else.\n"
+    "Below is given a policy that describes what type of language counts as harassment or hate speech on our platform.\n"
+    "If the user inputted message violates the criteria of the policy, set violation to 1, otherwise, set it to 0.\n"
+    "Then, give a confidence score for this classification. The closer to 1.0, the higher the confidence.\n\n"
+)
+
+
+class PromptRegistry:
+    """
+    Holds the policy and the provider instructions built from it. The policy file is read once and
+    only read again when its modification time changes; the file is stat'ed at most once every
+    `check_interval` seconds, so a call normally costs a clock read and a dict lookup.
+    """
+
+    def __init__(self, policy_path: str = POLICY_PATH, check_interval: float = 1.0):
+        self.policy_path = policy_path
+        self.check_interval = check_interval
+        self.policy = ""
+        self.instructions = {}
+        self._mtime = None
+        self._last_check = 0.0
+        self.reload()
+
+    def reload(self):
+        with open(self.policy_path, encoding='utf8') as f:
+            self.policy = f.read()
+        self._mtime = os.stat(self.policy_path).st_mtime
+        self.instructions = {
+            "openai": OPENAI_HEADER + self.policy,
+            "gemini": GEMINI_HEADER + self.policy,
+        }
+        print(f"Loaded policy from {self.policy_path}")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.policy_path).st_mtime
+        except OSError:
+            # Keep serving the last good policy if the file is briefly missing mid-edit
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def get(self, provider: str) -> str:
+        """
+        Returns the instruction prefix for a provider ("openai" or "gemini")
+        """
+        self._refresh()
+        return self.instructions[provider]
+
+
+registry = PromptRegistry(
+    policy_path=config["prompts"]["policy_path"] or POLICY_PATH,
+    check_interval=config["prompts"]["reload_check_interval"],
+)
@@ -62,10 +62,17 @@ class Report:
                 return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
             guild = self.client.get_guild(int(m.group(1)))
             
-            if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
+            if guild:
+                channel = guild.get_channel(int(m.group(2)))
+            else:
+                # The guild may be served by a shard in another process, which the REST API can still reach
+                try:
+                    channel = await self.client.fetch_channel(int(m.group(2)))
+                except (discord.errors.NotFound, discord.errors.Forbidden):
+                    channel = None
+                if not channel or getattr(channel, "guild", None) is None or channel.guild.id != int(m.group(1)):
+                    return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
             self.guild_id = int(m.group(1))
-            channel = guild.get_channel(int(m.group(2)))
             if not channel:
                 return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
             try:
@@ -0,0 +1,243 @@
+# report_store.py
+import time
+import sqlite3
+from metrics import metrics
+
+# Report states, in the order a report moves through them
+PENDING = "pending" # Filed, waiting for the shard that owns its guild to post it to the mod channel
+USER_REVIEW = "user_review" # Waiting for a moderator to ban / warn / ignore / mark unsure
+POST_REVIEW = "post_review" # Waiting for a moderator to delete / add a disclaimer / ignore
+CLOSED = "closed"
+
+# Each entry upgrades the schema by one version; the database's user_version records how many have run
+MIGRATIONS = [
+    """
+    CREATE TABLE reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reporter_id INTEGER,
+        reporter_name TEXT,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        author_name TEXT,
+        content TEXT,
+        reason TEXT,
+        category TEXT,
+        has_details INTEGER NOT NULL DEFAULT 0,
+        should_block INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        review_message_id INTEGER,
+        action TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX reports_message ON reports (message_id);
+    CREATE INDEX reports_guild_state ON reports (guild_id, state);
+    CREATE INDEX reports_author ON reports (guild_id, author_id);
+    CREATE INDEX reports_state ON reports (state);
+    CREATE UNIQUE INDEX reports_review_message ON reports (review_message_id);
+    """,
+    # Reports of a message that already has an open report are linked to that first ("primary")
+    # report: only the primary has a card and review messages, and the whole group moves together.
+    # card_message_id keeps the card once review_message_id moves on to the post-review prompt, and
+    # card_stale marks cards to edit because reports joined the group after the card was posted.
+    """
+    ALTER TABLE reports ADD COLUMN primary_id INTEGER REFERENCES reports (id);
+    ALTER TABLE reports ADD COLUMN card_message_id INTEGER;
+    ALTER TABLE reports ADD COLUMN card_stale INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX reports_primary ON reports (primary_id);
+    UPDATE reports SET card_message_id = review_message_id WHERE state = 'user_review';
+    """,
+]
+
+
+class ReportStore:
+    """
+    Durable record of every report the bot has posted for review. Only IDs and the few fields the
+    moderation flow needs are kept; Discord objects are looked up again when a moderator acts.
+    Rows are returned as sqlite3.Row, so fields are read as record["reason"].
+
+    Reports of the same message are aggregated: while a report of a message is open, later reports
+    of it are linked to that primary report instead of getting their own card, and every state
+    change of the primary applies to the whole group.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        # Review messages that still accept reactions, kept in memory so most reactions need no query
+        self.open_review_ids = {
+            row[0] for row in self.db.execute(
+                "SELECT review_message_id FROM reports WHERE state != ? AND review_message_id IS NOT NULL", (CLOSED,)
+            )
+        }
+
+    def migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.db.executescript(migration)
+            self.db.execute(f"PRAGMA user_version = {i}")
+        self.db.commit()
+
+    def add(self, report, reporter, review_message_id: int, state: str = USER_REVIEW) -> sqlite3.Row:
+        """
+        Records a completed report. If the reported message already has an open report, the new one
+        is linked to it and takes its state, and the primary's card is marked for an update.
+        :param report: The completed Report from the DM flow
+        :param reporter: The user who filed it
+        :param review_message_id: ID of the mod-channel message moderators react to, or None while PENDING
+        """
+        now = time.time()
+        message = report.message
+        primary = self.open_primary(report.guild_id, message.id) if review_message_id is None else None
+        if primary is not None:
+            state = primary["state"]
+        cur = self.db.execute(
+            """INSERT INTO reports (reporter_id, reporter_name, guild_id, channel_id, message_id, author_id,
+                author_name, content, reason, category, has_details, should_block, state, review_message_id,
+                card_message_id, primary_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (reporter.id if reporter else None, reporter.name if reporter else None, report.guild_id,
+             message.channel.id, message.id, message.author.id, message.author.name, message.content,
+             report.reason, report.category, int(report.has_details), int(report.should_block), state,
+             review_message_id, review_message_id if state == USER_REVIEW else None,
+             primary["id"] if primary is not None else None, now, now)
+        )
+        if primary is not None:
+            # A card that is not posted yet will include the new report anyway
+            self.db.execute(
+                "UPDATE reports SET card_stale = 1 WHERE id = ? AND card_message_id IS NOT NULL", (primary["id"],)
+            )
+            metrics.inc("reports_linked_total")
+        self.db.commit()
+        if review_message_id is not None:
+            self.open_review_ids.add(review_message_id)
+        metrics.inc("report_transitions_total", state=state)
+        return self.get(cur.lastrowid)
+
+    def open_primary(self, guild_id: int, message_id: int):
+        """
+        The open report that later reports of this message are linked to, or None
+        """
+        return self.db.execute(
+            """SELECT * FROM reports WHERE guild_id = ? AND message_id = ? AND primary_id IS NULL AND state != ?
+            ORDER BY created_at LIMIT 1""",
+            (guild_id, message_id, CLOSED)
+        ).fetchone()
+
+    def group(self, report_id: int) -> list:
+        """
+        A primary report followed by every report linked to it, oldest first
+        """
+        return self.db.execute(
+            "SELECT * FROM reports WHERE id = ? OR primary_id = ? ORDER BY primary_id IS NOT NULL, created_at",
+            (report_id, report_id)
+        ).fetchall()
+
+    def pending_reports(self, shard_ids, shard_count: int) -> list:
+        """
+        Reports waiting to be posted in guilds served by the given shards, oldest first. Discord assigns
+        a guild to shard (guild_id >> 22) % shard_count, and the same formula is applied here in SQL.
+        """
+        placeholders = ",".join("?" * len(shard_ids))
+        return self.db.execute(
+            f"""SELECT * FROM reports WHERE state = ? AND primary_id IS NULL AND ((guild_id >> 22) % ?) IN ({placeholders})
+            ORDER BY created_at""",
+            (PENDING, shard_count, *shard_ids)
+        ).fetchall()
+
+    def stale_cards(self, shard_ids, shard_count: int) -> list:
+        """
+        Posted primary reports whose card is missing reports linked since, in guilds served by the given shards
+        """
+        placeholders = ",".join("?" * len(shard_ids))
+        return self.db.execute(
+            f"""SELECT * FROM reports WHERE card_stale = 1 AND state != ? AND ((guild_id >> 22) % ?) IN ({placeholders})
+            ORDER BY updated_at""",
+            (CLOSED, shard_count, *shard_ids)
+        ).fetchall()
+
+    def mark_card_updated(self, report_id: int):
+        self.db.execute("UPDATE reports SET card_stale = 0 WHERE id = ?", (report_id,))
+        self.db.commit()
+
+    def mark_posted(self, report_id: int, review_message_id: int):
+        """
+        Records that a PENDING report (and the reports linked to it) has been posted to the mod channel
+        and now awaits a moderator
+        """
+        now = time.time()
+        self.db.execute(
+            """UPDATE reports SET state = ?, review_message_id = ?, card_message_id = ?, card_stale = 0,
+            updated_at = ? WHERE id = ?""",
+            (USER_REVIEW, review_message_id, review_message_id, now, report_id)
+        )
+        self.db.execute("UPDATE reports SET state = ?, updated_at = ? WHERE primary_id = ?", (USER_REVIEW, now, report_id))
+        self.db.commit()
+        self.open_review_ids.add(review_message_id)
+        metrics.inc("report_transitions_total", state=USER_REVIEW)
+
+    def get(self, report_id: int):
+        return self.db.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+
+    def is_open_review(self, review_message_id: int) -> bool:
+        return review_message_id in self.open_review_ids
+
+    def by_review_message(self, review_message_id: int):
+        """
+        Returns the open report a mod-channel message belongs to, or None
+        """
+        return self.db.execute(
+            "SELECT * FROM reports WHERE review_message_id = ? AND state != ?", (review_message_id, CLOSED)
+        ).fetchone()
+
+    def move_to_post_review(self, report_id: int, review_message_id: int, action: str):
+        self.open_review_ids.discard(self.get(report_id)["review_message_id"])
+        self.open_review_ids.add(review_message_id)
+        now = time.time()
+        self.db.execute(
+            "UPDATE reports SET state = ?, review_message_id = ?, action = ?, updated_at = ? WHERE id = ?",
+            (POST_REVIEW, review_message_id, action, now, report_id)
+        )
+        self.db.execute(
+            "UPDATE reports SET state = ?, action = ?, updated_at = ? WHERE primary_id = ?",
+            (POST_REVIEW, action, now, report_id)
+        )
+        self.db.commit()
+        metrics.inc("report_transitions_total", state=POST_REVIEW, action=action)
+
+    def close(self, report_id: int, action: str):
+        """
+        Closes a report together with every open report linked to it
+        """
+        now = time.time()
+        reports = [r for r in self.group(report_id) if r["state"] != CLOSED]
+        for report in reports:
+            self.open_review_ids.discard(report["review_message_id"])
+            metrics.inc("report_transitions_total", state=CLOSED, action=action)
+            metrics.observe("report_resolution_seconds", now - report["created_at"])
+        self.db.executemany(
+            "UPDATE reports SET state = ?, action = COALESCE(action || ',', '') || ?, updated_at = ? WHERE id = ?",
+            [(CLOSED, action, now, report["id"]) for report in reports]
+        )
+        self.db.commit()
+
+    def open_reports(self, guild_id: int) -> list:
+        """
+        All reports in a guild that are still waiting on a moderator, oldest first
+        """
+        return self.db.execute(
+            "SELECT * FROM reports WHERE guild_id = ? AND state != ? ORDER BY created_at", (guild_id, CLOSED)
+        ).fetchall()
+
+    def reports_for_message(self, message_id: int) -> list:
+        return self.db.execute("SELECT * FROM reports WHERE message_id = ? ORDER BY created_at", (message_id,)).fetchall()
+
+    def reports_for_author(self, guild_id: int, author_id: int) -> list:
+        return self.db.execute(
+            "SELECT * FROM reports WHERE guild_id = ? AND author_id = ? ORDER BY created_at", (guild_id, author_id)
+        ).fetchall()
@@ -0,0 +1,148 @@
+# risk_index.py
+import math
+import time
+import asyncio
+import sqlite3
+from metrics import metrics
+
+# How deeply to classify an author's messages
+LIGHT = "light" # Cheap screening first; the full ensemble only if it flags the message
+FULL = "full" # Every provider, as for any message
+ESCALATED = "escalated" # Every provider, ahead of other traffic in the job queue and provider quotas
+
+# Each entry upgrades the schema by one version; the database's user_version records how many have run
+MIGRATIONS = [
+    """
+    CREATE TABLE author_risk (
+        guild_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        clean_messages INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, author_id)
+    ) WITHOUT ROWID;
+    """,
+]
+
+
+class RiskIndex:
+    """
+    Per-author, per-guild risk score built from moderator actions and automatic verdicts, used to
+    choose how deeply each message is classified.
+
+    Scores decay exponentially with `half_life_days`, so an old warning matters less than a recent
+    one; the decay is applied when a score is read or updated, so nothing has to be swept. Authors
+    also count the clean verdicts they have had since their last incident. Every entry is held in
+    memory, so depth() is a dict lookup; changes are written back to SQLite by flush().
+
+    Each guild is served by exactly one process, so processes sharing the database never write the
+    same entry.
+
+    Settings come from config["risk_index"]; `weights` maps each event to the score it adds.
+    """
+
+    def __init__(self, path: str, enabled: bool = True, half_life_days: float = 30, weights: dict = None,
+                 light_max_score: float = 0.5, light_min_clean_messages: int = 50, escalate_score: float = 2.5,
+                 flush_interval: float = 5.0, screen_provider: str = ""):
+        self.enabled = enabled
+        self.decay_rate = math.log(2) / (half_life_days * 86400)
+        self.weights = weights or {}
+        self.light_max_score = light_max_score
+        self.light_min_clean_messages = light_min_clean_messages
+        self.escalate_score = escalate_score
+        self.flush_interval = flush_interval
+        self.screen_provider = screen_provider # Provider asked for the LIGHT check
+        self.entries = {} # Map from (guild ID, author ID) to [score, updated_at, clean_messages]
+        self.dirty = set() # Keys changed since the last flush
+        self.counts = {LIGHT: 0, FULL: 0, ESCALATED: 0}
+        if not enabled:
+            return
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        for guild_id, author_id, score, updated_at, clean in self.db.execute("SELECT * FROM author_risk"):
+            self.entries[(guild_id, author_id)] = [score, updated_at, clean]
+
+    def migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.db.executescript(migration)
+            self.db.execute(f"PRAGMA user_version = {i}")
+        self.db.commit()
+
+    def score(self, guild_id: int, author_id: int, now: float = None) -> float:
+        entry = self.entries.get((guild_id, author_id))
+        if entry is None:
+            return 0.0
+        now = time.time() if now is None else now
+        return entry[0] * math.exp(-self.decay_rate * (now - entry[1]))
+
+    def record(self, guild_id: int, author_id: int, event: str, amount: float = 1.0):
+        """
+        Adds an event to an author's score
+        :param event: A moderator action ("ban", "warn", "unsure", "ignore") or "auto_flag"; its weight
+        comes from config, and negative weights (a report dismissed as unfounded) lower the score
+        :param amount: Multiplier on the weight, e.g. the share of providers that flagged the message
+        """
+        if not self.enabled:
+            return
+        delta = self.weights.get(event, 0.0) * amount
+        now = time.time()
+        key = (guild_id, author_id)
+        entry = self.entries.setdefault(key, [0.0, now, 0])
+        entry[0] = max(0.0, self.score(guild_id, author_id, now) + delta)
+        entry[1] = now
+        if delta > 0:
+            # Only history since the last incident counts as clean
+            entry[2] = 0
+        self.dirty.add(key)
+        metrics.inc("risk_events_total", event=event)
+
+    def record_clean(self, guild_id: int, author_id: int):
+        """
+        Counts a message that the automatic classification found benign
+        """
+        if not self.enabled:
+            return
+        key = (guild_id, author_id)
+        entry = self.entries.setdefault(key, [0.0, time.time(), 0])
+        entry[2] += 1
+        self.dirty.add(key)
+
+    def depth(self, guild_id: int, author_id: int) -> str:
+        """
+        LIGHT for authors with a low score and a long clean history, ESCALATED for high scores, and
+        FULL for everyone else (including authors seen for the first time)
+        """
+        tier = FULL
+        if self.enabled:
+            entry = self.entries.get((guild_id, author_id))
+            if entry is not None:
+                score = self.score(guild_id, author_id)
+                if score >= self.escalate_score:
+                    tier = ESCALATED
+                elif score < self.light_max_score and entry[2] >= self.light_min_clean_messages:
+                    tier = LIGHT
+        self.counts[tier] += 1
+        return tier
+
+    def _write(self, rows: list):
+        self.db.executemany("INSERT OR REPLACE INTO author_risk VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    async def flush(self):
+        keys, self.dirty = self.dirty, set()
+        if keys:
+            await asyncio.to_thread(self._write, [(*key, *self.entries[key]) for key in keys])
+
+    async def run(self):
+        """
+        Writes changes back every `flush_interval` seconds
+        """
+        while self.enabled:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {"authors": len(self.entries), **{f"{tier}_messages": n for tier, n in self.counts.items()}}
@@ -0,0 +1,233 @@
+# scheduler.py
+"""
+Central rate-limit-aware scheduler for provider calls.
+
+Each (provider, model) pair has a limiter with token buckets for requests per minute and tokens per
+minute. Callers wait in priority lanes, so live channel moderation is always served before offline
+evaluations; messages from authors the risk index has escalated
+(see risk_index.py) go ahead of all other live traffic. When a provider answers 429, or its rate-limit headers
+say the quota is spent, the limiter pauses for the advertised reset time before serving anyone else.
+
+The lane of a call comes from the `lane` context variable, so a whole evaluation run can be put in
+the EVAL lane with a single `lane.set(EVAL)` and every call it makes inherits it.
+"""
+import re
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from config import config
+from metrics import metrics, usage
+
+# Priority lanes, lowest value served first
+FLAGGED = 0 # Live messages from authors the risk index has escalated
+LIVE = 1
+EVAL = 2
+LANE_NAMES = {FLAGGED: "flagged", LIVE: "live", EVAL: "eval"}
+
+lane = contextvars.ContextVar("lane", default=LIVE)
+
+DURATION_PART = re.compile(r'([\d.]+)(ms|s|m|h)')
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses durations in the formats providers use in rate-limit headers ("12", "1.5s", "6m0s", "20ms")
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[unit] for n, unit in DURATION_PART.findall(value or ""))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        # May go below zero when a call used more tokens than estimated; later callers then wait it off
+        self._refill()
+        self.level -= amount
+
+
+class Limiter:
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waiters = [] # Heap of (lane, sequence, tokens, future)
+        self.sequence = itertools.count()
+        self.paused_until = 0.0
+        self.failures = 0 # Consecutive rate-limited responses, for exponential backoff
+        self.wakeup = None
+        self.pump_task = None
+
+    async def acquire(self, tokens: float, priority: int):
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), tokens, future))
+        self.wakeup.set()
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self._pump())
+        await future
+
+    def _wait_time(self, tokens: float) -> float:
+        wait = self.paused_until - time.monotonic()
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def _pump(self):
+        while True:
+            # Callers that gave up (timeout or cancellation) leave a finished future behind
+            while self.waiters and self.waiters[0][3].done():
+                heapq.heappop(self.waiters)
+            if not self.waiters:
+                return
+            wait = self._wait_time(self.waiters[0][2])
+            if wait > 0:
+                # Sleep until the quota refills, but wake early if a higher-priority caller arrives
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, tokens, future = heapq.heappop(self.waiters)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            future.set_result(None)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        metrics.inc("scheduler_backoffs_total", limiter=self.name)
+
+    def depth(self) -> dict:
+        depths = {name: 0 for name in LANE_NAMES.values()}
+        for priority, _, _, future in self.waiters:
+            if not future.done():
+                depths[LANE_NAMES[priority]] += 1
+        return depths
+
+
+class Scheduler:
+    def __init__(self, limits: dict, max_retries: int = 3):
+        self.limits = limits
+        self.max_retries = max_retries
+        self.limiters = {} # Map from "provider/model" to Limiter
+
+    def limiter(self, provider: str, model: str) -> Limiter:
+        name = f"{provider}/{model}"
+        if name not in self.limiters:
+            limit = self.limits.get(name, {})
+            self.limiters[name] = Limiter(name, limit.get("rpm", 0), limit.get("tpm", 0))
+        return self.limiters[name]
+
+    async def call(self, provider: str, model: str, fn, tokens: float = 0):
+        """
+        Runs `fn()` (a coroutine function making one provider request) once the provider's quota and
+        the caller's lane allow it, retrying with backoff if the provider answers with a rate limit
+        :param tokens: Estimated tokens the request will use, charged against the tokens-per-minute bucket
+        """
+        limiter = self.limiter(provider, model)
+        priority = lane.get()
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            await limiter.acquire(tokens, priority)
+            metrics.observe("scheduler_wait_seconds", time.monotonic() - start, limiter=limiter.name, lane=LANE_NAMES[priority])
+            called = time.perf_counter()
+            try:
+                result = await fn()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                limiter.failures += 1
+                delay = retry_after(e) or min(60.0, 2 ** limiter.failures)
+                print(f"{limiter.name} rate limited; backing off for {delay:.1f}s")
+                limiter.pause(delay)
+                continue
+            limiter.failures = 0
+            sink = usage.get()
+            if sink is not None:
+                # Time spent on the provider itself, without the wait for quota above
+                sink["provider_seconds"] = sink.get("provider_seconds", 0.0) + time.perf_counter() - called
+            return result
+
+    def settle(self, provider: str, model: str, estimated: float, actual: float):
+        """
+        Charges (or refunds) the difference between a call's estimated and actual token usage
+        """
+        limiter = self.limiter(provider, model)
+        if limiter.tokens and actual:
+            limiter.tokens.take(actual - estimated)
+
+    def observe_headers(self, provider: str, model: str, headers):
+        """
+        Pauses a limiter ahead of time when the provider's headers say its quota is used up
+        """
+        limiter = self.limiter(provider, model)
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and float(remaining) <= 0:
+                limiter.pause(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0)
+
+    def stats(self) -> dict:
+        return {
+            f"{name.replace('/', '_').replace('-', '_').replace('.', '_')}_{lane_name}_queue_depth": depth
+            for name, limiter in self.limiters.items()
+            for lane_name, depth in limiter.depth().items()
+        }
+
+
+def estimate_tokens(*texts: str, output: int = 16) -> int:
+    """
+    Rough token count for a request (about four characters per token) used until the real usage is known
+    """
+    return sum(len(t) for t in texts) // 4 + output
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or getattr(e, "code", None) == 429
+
+
+def retry_after(e: Exception) -> float:
+    """
+    Reads how long to wait from a rate-limit error: the Retry-After style headers on OpenAI errors,
+    or the RetryInfo detail on Gemini errors
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        if headers.get(header):
+            return parse_duration(headers.get(header))
+    details = getattr(e, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []):
+            if "retryDelay" in detail:
+                return parse_duration(detail["retryDelay"])
+    return 0.0
+
+
+scheduler = Scheduler(config["rate_limits"]["limits"], config["rate_limits"]["max_retries"])
+metrics.add_collector("scheduler", scheduler.stats)
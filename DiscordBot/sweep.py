@@ -0,0 +1,261 @@
+# sweep.py
+"""
+Evaluation sweeps: a matrix of models and policy variants run over one dataset in a single pass.
+
+The dataset is read once into compact arrays shared by every configuration, and all configurations
+run at the same time under one global concurrency budget (config["evaluation"]["sweep_concurrency"]),
+so a sweep never sends more requests at once than a single evaluation would be allowed to. Like
+evaluation.py, every answer goes into the prediction store, and rows already predicted under the
+same model and prompt are reused rather than sent again.
+
+The report compares accuracy, recall, precision, p50 / p95 latency, throughput, and tokens and cost
+per 1k messages for each configuration, and recommends the fastest one (lowest p50 latency) that
+meets the recall target. Latency is the time spent on the provider's requests, not waiting for quota.
+Latency, tokens and cost are stored with every prediction, so they also cover reused rows; throughput
+only covers rows queried in this sweep, and is measured under the shared budget, so it is best
+compared within one sweep. --no-reuse queries every row again, for a fresh throughput measurement.
+
+Usage: python sweep.py <file> --models openai gemini lexicon [--policies draft.txt ...]
+                       [--concurrency N] [--recall-target R] [--no-reuse]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import dataclass
+import numpy as np
+from config import config
+from scheduler import lane, EVAL
+from backends import create_backend
+from analytics import ScoreTable, scores_path
+from prediction_store import PredictionStore
+from verdict_cache import content_key
+from evaluation import resolve_dataset, read_rows, model_spec, parse_response, prompt_hash, summarize, measured
+
+# Backend types whose instructions come from a policy file, and so can be swept over policy variants
+POLICY_BACKENDS = ("openai_prompt", "gemini_prompt")
+
+
+class Dataset:
+    """
+    The rows of a labelled CSV, read once and shared read-only by every configuration of a sweep
+    """
+
+    def __init__(self, path: str):
+        ids, texts, labels = [], [], []
+        for message_id, text, label in read_rows(path):
+            ids.append(message_id)
+            texts.append(text)
+            labels.append(label)
+        self.ids = np.asarray(ids, dtype=str)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.texts = texts
+        self.hashes = [content_key(text) for text in texts]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+@dataclass
+class Configuration:
+    name: str # Model name, plus "@<policy file>" for a policy variant
+    model: str
+    backend: object
+    fingerprint: str
+
+
+def build_configurations(models: list, policies: list) -> list:
+    """
+    Every model with the live policy, plus every prompt-based model with each extra policy file
+    """
+    configurations = []
+    for model in models:
+        spec, slot = model_spec(model)
+        variants = [""] + (policies if spec["type"] in POLICY_BACKENDS else [])
+        for policy in variants:
+            variant_spec = {**spec, "policy_path": policy} if policy else spec
+            backend = create_backend(variant_spec, slot)
+            name = f"{model}@{os.path.splitext(os.path.basename(policy))[0]}" if policy else model
+            configurations.append(Configuration(name, model, backend, prompt_hash(variant_spec, backend)))
+    return configurations
+
+
+async def run_configuration(conf: Configuration, dataset: Dataset, file: str, store: PredictionStore,
+                            budget: asyncio.Semaphore, workers: int, reuse: bool = True) -> dict:
+    """
+    Classifies every row of the dataset with one configuration, sharing `budget` with the others
+    :param workers: Concurrent workers for this configuration; each holds the budget while it waits on a request
+    :param reuse: Answer rows from the prediction store where possible
+    :return: Summary stats of the configuration, with latency, throughput and usage
+    """
+    # Set inside the task, so the lane only applies to this configuration's calls
+    lane.set(EVAL)
+    name = os.path.basename(resolve_dataset(file))
+    run_id = store.start_run(name, conf.model, conf.fingerprint)
+    await asyncio.to_thread(store.add_run_rows, run_id,
+                            [(dataset.ids[i], dataset.hashes[i], int(dataset.labels[i])) for i in range(len(dataset))])
+    known = await asyncio.to_thread(store.lookup, dataset.hashes, conf.model, conf.fingerprint) if reuse else {}
+    # Latency, tokens and cost per answered row, from the store for reused rows
+    measurements = await asyncio.to_thread(store.measurements, dataset.hashes, conf.model, conf.fingerprint) if reuse else {}
+
+    classifications = np.full(len(dataset), -1, dtype=np.int8)
+    confidences = np.zeros(len(dataset), dtype=np.float32)
+    pending = []
+    for i, row_hash in enumerate(dataset.hashes):
+        if row_hash in known:
+            classifications[i], confidences[i] = known[row_hash]
+        else:
+            pending.append(i)
+    reused = len(dataset) - len(pending)
+    queried = 0
+    failed = 0
+    progress_every = config["evaluation"]["progress_every"]
+    rows = iter(pending)
+    started = time.monotonic()
+
+    async def worker():
+        nonlocal failed, queried
+        for i in rows:
+            async with budget:
+                try:
+                    response, measurement = await measured(conf.backend.classify(dataset.texts[i]))
+                except ValueError:
+                    # The model answered in an unexpected format; leave the row for a later run
+                    failed += 1
+                    continue
+            queried += 1
+            try:
+                classifications[i], confidences[i] = parse_response(response)
+            except ValueError:
+                failed += 1
+                continue
+            measurements[dataset.hashes[i]] = measurement
+            store.add(dataset.hashes[i], conf.model, conf.fingerprint, int(classifications[i]), float(confidences[i]), measurement)
+            if queried % progress_every == 0:
+                await store.flush()
+                print(f"Sweep of {file}, {conf.name}: {queried} of {len(pending)} rows queried")
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the other workers too, so a failed configuration makes no more paid requests
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        await store.flush()
+    elapsed = time.monotonic() - started
+
+    done = classifications >= 0
+    table = ScoreTable(dataset.ids[done], dataset.labels[done], classifications[done], confidences[done])
+    await asyncio.to_thread(table.save, scores_path(file, conf.name))
+    summary = summarize(table)
+    # One entry per dataset row that has a measured prediction, so repeated texts count every time
+    measured_rows = np.array([measurements[h] for h in dataset.hashes if h in measurements], dtype=float).reshape(-1, 4)
+    latencies, tokens, costs = measured_rows[:, 0], measured_rows[:, 1] + measured_rows[:, 2], measured_rows[:, 3]
+    summary.update({
+        "queried": queried,
+        "reused": reused,
+        "failed": failed,
+        "run_id": run_id,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "rows_per_second": queried / elapsed if queried and elapsed > 0 else None,
+        "tokens_per_1k": float(tokens.mean() * 1000) if len(tokens) else None,
+        "cost_per_1k": float(costs.mean() * 1000) if len(costs) else None,
+    })
+    store.finish_run(run_id, queried, reused, failed, summary)
+    return summary
+
+
+async def run_sweep(file: str, models: list, policies: list = (), concurrency: int = None, reuse: bool = True) -> dict:
+    """
+    Runs every configuration of the matrix over a dataset at once
+    :param file: The dataset, as a path or the name of a file in the assets folder
+    :param models: Model names as accepted by evaluation.py ("openai", "gemini", "moderation" or a backend type)
+    :param policies: Extra policy files to evaluate the prompt-based models with, besides the live policy
+    :param concurrency: Requests in flight across all configurations
+    :param reuse: Answer rows from the prediction store where possible; False queries every row again
+    :return: Map from configuration name to its summary, or to {"error": ...} if it could not run
+    """
+    configurations = build_configurations(models, list(policies))
+    dataset = await asyncio.to_thread(Dataset, resolve_dataset(file))
+    print(f"Loaded {len(dataset)} rows from {file}; sweeping {', '.join(c.name for c in configurations)}")
+    concurrency = concurrency or config["evaluation"]["sweep_concurrency"]
+    budget = asyncio.Semaphore(concurrency)
+    store = PredictionStore(config["evaluation"]["prediction_store"])
+    results = await asyncio.gather(*(run_configuration(c, dataset, file, store, budget, concurrency, reuse) for c in configurations),
+                                   return_exceptions=True)
+    report = {}
+    for conf, result in zip(configurations, results):
+        if isinstance(result, BaseException):
+            # One configuration failing (e.g. no API key, or a replay file missing rows) leaves the rest usable
+            print(f"Configuration {conf.name} failed: {result!r}")
+            result = {"error": repr(result)}
+        report[conf.name] = result
+    return report
+
+
+def recommend(report: dict, recall_target: float):
+    """
+    The fastest configuration (lowest p50 latency) whose recall meets the target, or None
+    """
+    candidates = [(row["p50_ms"], name) for name, row in report.items()
+                  if "error" not in row and row["recall"] >= recall_target and row["p50_ms"] is not None]
+    return min(candidates)[1] if candidates else None
+
+
+def format_report(report: dict, recall_target: float) -> str:
+    # (summary key, column header, format)
+    columns = (("accuracy", "accuracy", "{:.3f}"), ("recall", "recall", "{:.3f}"), ("precision", "precision", "{:.3f}"),
+               ("p50_ms", "p50 ms", "{:.0f}"), ("p95_ms", "p95 ms", "{:.0f}"), ("rows_per_second", "rows/s", "{:.1f}"),
+               ("tokens_per_1k", "tokens/1k", "{:.0f}"), ("cost_per_1k", "USD/1k", "{:.4f}"))
+    width = max([24] + [len(name) for name in report])
+    lines = [f"{'configuration':<{width}} {'rows':>7} " + " ".join(f"{header:>9}" for _, header, _ in columns)]
+    for name, row in report.items():
+        if "error" in row:
+            lines.append(f"{name:<{width}} failed: {row['error']}")
+            continue
+        values = " ".join(f"{fmt.format(row[c]) if row[c] is not None else '-':>9}" for c, _, fmt in columns)
+        lines.append(f"{name:<{width}} {row['total']:>7} {values}")
+    best = recommend(report, recall_target)
+    if best:
+        lines.append(f"Fastest configuration with recall >= {recall_target:.2f}: {best}")
+    else:
+        lines.append(f"No configuration with measured latency reaches recall {recall_target:.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a matrix of models and policy variants against a labelled CSV")
+    parser.add_argument("file", help="Dataset path, or the name of a file in the assets folder")
+    parser.add_argument("--models", nargs="+", required=True, help="openai, gemini, moderation, or backend types such as lexicon")
+    parser.add_argument("--policies", nargs="*", default=[], help="Extra policy files for the prompt-based models")
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--recall-target", type=float, default=config["evaluation"]["recall_target"])
+    parser.add_argument("--no-reuse", action="store_true", help="Query every row again instead of reusing stored predictions")
+    args = parser.parse_args()
+
+    # Offline backends need no keys, so a missing tokens.json is fine
+    if os.path.isfile('tokens.json'):
+        with open('tokens.json') as f:
+            tokens = json.load(f)
+            if "gemini" in tokens:
+                os.environ["GEMINI_API_KEY"] = tokens["gemini"]
+            if "openai" in tokens:
+                os.environ["OPENAI_API_KEY"] = tokens["openai"]
+
+    try:
+        report = asyncio.run(run_sweep(args.file, args.models, args.policies, args.concurrency, not args.no_reuse))
+    except KeyboardInterrupt:
+        print("Sweep interrupted; run the same command again to resume.")
+        sys.exit(1)
+    print(format_report(report, args.recall_target))
+
+
+if __name__ == "__main__":
+    main()
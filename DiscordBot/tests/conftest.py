@@ -0,0 +1,5 @@
+# The bot's modules are flat in DiscordBot/ and import each other by name
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from breaker import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, CircuitOpenError, hedged
+
+
+async def fail():
+    raise RuntimeError("provider error")
+
+
+async def succeed():
+    return "ok"
+
+
+def test_circuit_opens_after_consecutive_failures_and_recovers():
+    async def main():
+        breaker = CircuitBreaker("provider", failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await breaker.call(fail)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(succeed)
+        await asyncio.sleep(0.06)
+        assert await breaker.call(succeed) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(main())
+
+
+def test_failed_probe_reopens_the_circuit():
+    async def main():
+        breaker = CircuitBreaker("provider", failure_threshold=1, reset_timeout=0.01)
+        with pytest.raises(RuntimeError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+        assert breaker.allow() and breaker.state == HALF_OPEN
+        assert not breaker.allow() # Only one probe at a time
+        breaker.record_failure()
+        assert breaker.state == OPEN
+
+    asyncio.run(main())
+
+
+def test_hedged_request_wins_over_a_slow_first_attempt():
+    async def main():
+        delays = [1.0, 0.0]
+        cancelled = []
+
+        async def call():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        result = await hedged(call, 0.01)
+        await asyncio.sleep(0)
+        return result, cancelled
+
+    assert asyncio.run(main()) == (0.0, [1.0])
+
+
+def test_hedged_attempts_are_cancelled_with_the_caller():
+    async def main():
+        cancelled = []
+
+        async def call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged(call, 0.01), timeout=0.05)
+        await asyncio.sleep(0)
+        return cancelled
+
+    assert asyncio.run(main()) == [True, True]
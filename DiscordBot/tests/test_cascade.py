@@ -0,0 +1,103 @@
+import asyncio
+import numpy as np
+from alerts import harm_counter
+from analytics import ScoreTable
+from breaker import Unavailable
+from cascade import Cascade, simulate
+from verdict import Skipped, Verdict
+
+STAGES = [
+    {"provider": "openai_moderation", "clear_below": 0.01, "flag_above": 0.9},
+    {"provider": "gemini_prompt", "clear_below": 0.05, "flag_above": 0.95},
+    {"provider": "openai_prompt"},
+]
+PROVIDERS = ["openai_moderation", "gemini_prompt", "openai_prompt"]
+
+
+def run_cascade(answers: dict) -> tuple:
+    """
+    Runs the cascade over fixed provider answers
+    :return: (responses, names of the providers that were asked)
+    """
+    asked = []
+
+    async def run(name, message):
+        asked.append(name)
+        return answers[name]
+
+    responses = asyncio.run(Cascade(STAGES, run, PROVIDERS).run("message"))
+    return responses, asked
+
+
+def test_flagged_by_first_stage_matches_ensemble():
+    answers = {
+        "openai_moderation": {"hate": (True, 0.97)},
+        "gemini_prompt": Verdict(True, 0.9),
+        "openai_prompt": Verdict(True, 0.9),
+    }
+    responses, asked = run_cascade(answers)
+    assert asked == ["openai_moderation"]
+    assert responses["openai_prompt"] == Skipped("openai_moderation", True)
+    assert harm_counter(responses) == harm_counter(answers) == 3
+
+
+def test_cleared_by_first_stage_matches_ensemble():
+    answers = {
+        "openai_moderation": {"hate": (False, 0.001)},
+        "gemini_prompt": Verdict(False, 0.99),
+        "openai_prompt": Verdict(False, 0.99),
+    }
+    responses, asked = run_cascade(answers)
+    assert asked == ["openai_moderation"]
+    assert harm_counter(responses) == harm_counter(answers) == 0
+
+
+def test_decided_by_second_stage_matches_ensemble():
+    answers = {
+        "openai_moderation": {"hate": (True, 0.5)},
+        "gemini_prompt": Verdict(True, 0.97),
+        "openai_prompt": Verdict(True, 0.8),
+    }
+    responses, asked = run_cascade(answers)
+    assert asked == ["openai_moderation", "gemini_prompt"]
+    assert responses["openai_prompt"] == Skipped("gemini_prompt", True)
+    assert harm_counter(responses) == harm_counter(answers) == 3
+
+
+def test_undecided_message_asks_every_provider():
+    answers = {
+        "openai_moderation": {"hate": (True, 0.5)},
+        "gemini_prompt": Verdict(False, 0.6),
+        "openai_prompt": Verdict(True, 0.7),
+    }
+    responses, asked = run_cascade(answers)
+    assert asked == PROVIDERS
+    assert responses == answers
+    assert harm_counter(responses) == 2
+
+
+def test_unavailable_stage_never_decides():
+    answers = {
+        "openai_moderation": Unavailable("timeout"),
+        "gemini_prompt": Verdict(False, 0.99),
+        "openai_prompt": Verdict(False, 0.99),
+    }
+    responses, asked = run_cascade(answers)
+    assert asked == ["openai_moderation", "gemini_prompt"]
+    assert responses["openai_prompt"] == Skipped("gemini_prompt", False)
+    assert harm_counter(responses) == 0
+
+
+def test_simulate_agrees_with_cascade_run():
+    # Rows: flagged by moderation, cleared by moderation, decided by gemini, undecided
+    labels = [1, 0, 1, 1]
+    tables = {
+        "openai_moderation": ScoreTable(range(4), labels, [1, 0, 1, 1], [0.97, 0.999, 0.5, 0.5]),
+        "gemini_prompt": ScoreTable(range(4), labels, [1, 0, 1, 0], [0.9, 0.99, 0.97, 0.6]),
+        "openai_prompt": ScoreTable(range(4), labels, [1, 0, 1, 1], [0.9, 0.99, 0.8, 0.7]),
+    }
+    result = simulate(STAGES, tables)
+    assert list(result["decided_at"]) == [0, 0, 1, 3]
+    full_votes = np.sum([t.classifications == 1 for t in tables.values()], axis=0)
+    assert list(result["votes"]) == list(full_votes) == [3, 0, 3, 2]
+    assert list(result["asked"]["openai_prompt"]) == [False, False, False, True]
@@ -0,0 +1,76 @@
+import asyncio
+from job_queue import JobQueue, DROP_OLDEST, SAMPLE, SPILL
+
+
+def fill(queue: JobQueue, count: int):
+    for i in range(count):
+        queue.put({"n": i})
+
+
+def queued(queue: JobQueue) -> list:
+    return [payload["n"] for _, payload, _ in queue.jobs]
+
+
+def test_drop_oldest_keeps_the_newest_jobs():
+    async def main():
+        queue = JobQueue(None, maxsize=3, policy=DROP_OLDEST)
+        fill(queue, 5)
+        return queue
+
+    queue = asyncio.run(main())
+    assert queued(queue) == [2, 3, 4]
+    assert queue.counts["dropped"] == 2
+
+
+def test_sample_with_zero_rate_sheds_all_overflow():
+    async def main():
+        queue = JobQueue(None, maxsize=3, policy=SAMPLE, sample_rate=0.0)
+        fill(queue, 5)
+        return queue
+
+    queue = asyncio.run(main())
+    assert queued(queue) == [0, 1, 2]
+    assert queue.counts["dropped"] == 2
+
+
+def test_urgent_jobs_are_served_first_and_never_shed():
+    async def main():
+        handled = []
+
+        async def handler(payload, obj):
+            handled.append(payload["n"])
+
+        queue = JobQueue(handler, maxsize=2, workers=1, policy=DROP_OLDEST)
+        fill(queue, 2)
+        queue.put({"n": "urgent"}, urgent=True)
+        queue.start()
+        await asyncio.sleep(0.05)
+        return handled
+
+    assert asyncio.run(main()) == ["urgent", 0, 1]
+
+
+def test_spill_serves_every_job_in_arrival_order(tmp_path):
+    path = str(tmp_path / "spill.jsonl")
+
+    async def main():
+        handled = []
+
+        async def handler(payload, obj):
+            handled.append(payload["n"])
+            await asyncio.sleep(0)
+
+        queue = JobQueue(handler, maxsize=4, workers=1, policy=SPILL, spill_path=path)
+        fill(queue, 20)
+        assert queue.counts["spilled"] == 16
+        queue.start()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(handled) == 20:
+                break
+        return handled, queue
+
+    handled, queue = asyncio.run(main())
+    assert handled == list(range(20))
+    assert queue.spilled == 0
+    assert not (tmp_path / "spill.jsonl").exists()
@@ -0,0 +1,101 @@
+import asyncio
+from outbound import FENCE, Outbox, split_text
+
+
+class Destination:
+    def __init__(self, id):
+        self.id = id
+
+
+def make_outbox(**kwargs) -> tuple:
+    """
+    :return: (outbox, list of (destination ID, content) in the order they were delivered)
+    """
+    delivered = []
+
+    async def deliver(destination, content=None, **_):
+        await asyncio.sleep(0)
+        delivered.append((destination.id, content))
+        return len(delivered)
+
+    return Outbox(deliver, **kwargs), delivered
+
+
+def test_concurrent_sends_are_delivered_in_call_order():
+    async def main():
+        outbox, delivered = make_outbox()
+        channel = Destination(1)
+        await asyncio.gather(
+            outbox.send_all(channel, ["one", "two"]),
+            outbox.send(channel, "card", alone=True),
+            outbox.send_all(channel, ["three", "four"]),
+            outbox.send(channel, "prompt", alone=True),
+        )
+        return delivered
+
+    assert asyncio.run(main()) == [(1, "one\ntwo"), (1, "card"), (1, "three\nfour"), (1, "prompt")]
+
+
+def test_send_returns_the_message_that_carried_the_text():
+    async def main():
+        outbox, delivered = make_outbox()
+        channel = Destination(1)
+        first, second = await asyncio.gather(outbox.send(channel, "a"), outbox.send(channel, "b"))
+        return first, second, delivered
+
+    first, second, delivered = asyncio.run(main())
+    assert delivered == [(1, "a\nb")]
+    assert first == second == 1
+
+
+def test_destinations_have_separate_queues():
+    async def main():
+        outbox, delivered = make_outbox()
+        await asyncio.gather(outbox.send(Destination(1), "a"), outbox.send(Destination(2), "b"))
+        return delivered
+
+    assert sorted(asyncio.run(main())) == [(1, "a"), (2, "b")]
+
+
+def test_burst_limit_spreads_sends_over_the_period():
+    async def main():
+        outbox, delivered = make_outbox(burst=2, period=0.2)
+        channel = Destination(1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for content in ("a", "b", "c"):
+            await outbox.send(channel, content)
+        return loop.time() - start, delivered
+
+    elapsed, delivered = asyncio.run(main())
+    assert [content for _, content in delivered] == ["a", "b", "c"]
+    assert elapsed >= 0.15
+
+
+def test_split_text_respects_max_length_and_line_breaks():
+    text = "\n".join(f"line {i}" for i in range(100))
+    pieces = split_text(text, 50)
+    assert all(len(piece) <= 50 for piece in pieces)
+    assert "\n".join(pieces) == text
+
+
+def test_split_text_closes_and_reopens_code_blocks():
+    text = "Intro\n" + FENCE + "\n" + "\n".join(f"row {i}" for i in range(60)) + "\n" + FENCE + "\nOutro"
+    pieces = split_text(text, 100)
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert len(piece) <= 100
+        assert piece.count(FENCE) % 2 == 0
+
+
+def test_coalesced_code_block_splits_cleanly():
+    async def main():
+        outbox, delivered = make_outbox(max_length=60)
+        channel = Destination(1)
+        block = FENCE + "\n" + "\n".join(f"row {i}" for i in range(8)) + "\n" + FENCE
+        await outbox.send_all(channel, ["Before", block, "After"])
+        return delivered
+
+    for _, content in asyncio.run(main()):
+        assert len(content) <= 60
+        assert content.count(FENCE) % 2 == 0
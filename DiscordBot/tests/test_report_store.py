@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+from report_store import ReportStore, PENDING, USER_REVIEW, POST_REVIEW, CLOSED
+
+GUILD = 1 << 22 # Served by shard 1 of 2
+
+
+def make_report(message_id: int, reason: str = "hate speech"):
+    message = SimpleNamespace(
+        id=message_id, content="reported text",
+        channel=SimpleNamespace(id=10), author=SimpleNamespace(id=20, name="author"),
+    )
+    return SimpleNamespace(message=message, guild_id=GUILD, reason=reason, category="slur",
+                           has_details=False, should_block=False)
+
+
+def reporter(user_id: int):
+    return SimpleNamespace(id=user_id, name=f"user{user_id}")
+
+
+def test_reports_of_the_same_message_share_one_card(tmp_path):
+    store = ReportStore(str(tmp_path / "reports.db"))
+    first = store.add(make_report(100), reporter(1), None, state=PENDING)
+    second = store.add(make_report(100, "harassment"), reporter(2), None, state=PENDING)
+    other = store.add(make_report(101), reporter(3), None, state=PENDING)
+
+    assert second["primary_id"] == first["id"]
+    assert [r["id"] for r in store.pending_reports([1], 2)] == [first["id"], other["id"]]
+    assert [r["id"] for r in store.group(first["id"])] == [first["id"], second["id"]]
+    assert store.pending_reports([0], 2) == []
+
+
+def test_a_report_linked_after_posting_marks_the_card_stale(tmp_path):
+    store = ReportStore(str(tmp_path / "reports.db"))
+    first = store.add(make_report(100), reporter(1), None, state=PENDING)
+    store.mark_posted(first["id"], 500)
+    assert store.is_open_review(500)
+
+    linked = store.add(make_report(100), reporter(2), None, state=PENDING)
+    assert linked["state"] == USER_REVIEW
+    assert [r["id"] for r in store.stale_cards([1], 2)] == [first["id"]]
+    store.mark_card_updated(first["id"])
+    assert store.stale_cards([1], 2) == []
+
+
+def test_state_changes_apply_to_the_whole_group(tmp_path):
+    store = ReportStore(str(tmp_path / "reports.db"))
+    first = store.add(make_report(100), reporter(1), None, state=PENDING)
+    second = store.add(make_report(100), reporter(2), None, state=PENDING)
+    store.mark_posted(first["id"], 500)
+    store.move_to_post_review(first["id"], 501, "warn")
+
+    assert store.get(second["id"])["state"] == POST_REVIEW
+    assert store.by_review_message(501)["id"] == first["id"]
+    assert not store.is_open_review(500)
+
+    store.close(first["id"], "delete")
+    assert {r["state"] for r in store.group(first["id"])} == {CLOSED}
+    assert store.get(first["id"])["action"] == "warn,delete"
+    assert not store.is_open_review(501)
+    # With the first report closed, a new report of the message starts a new group
+    assert store.add(make_report(100), reporter(3), None, state=PENDING)["primary_id"] is None
@@ -0,0 +1,34 @@
+import pytest
+from breaker import Unavailable
+from verdict import Skipped, Verdict, VerdictParseError, decode_response, encode_response, parse_verdict
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"violation": 1, "confidence": 0.85}', Verdict(True, 0.85)),
+    ('```json\n{"violation": 0, "confidence": 0.9}\n```', Verdict(False, 0.9)),
+    ('Here is my answer: {"violation": 1, "confidence": 0.6} as requested', Verdict(True, 0.6)),
+    ("1 0.75", Verdict(True, 0.75)),
+    ("0, .9", Verdict(False, 0.9)),
+])
+def test_parse_verdict_accepts_supported_formats(text, expected):
+    assert parse_verdict(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "maybe", '{"violation": 2, "confidence": 0.5}'])
+def test_parse_verdict_rejects_other_answers(text):
+    with pytest.raises(VerdictParseError):
+        parse_verdict(text)
+
+
+@pytest.mark.parametrize("slot, response", [
+    ("openai_prompt", Verdict(True, 0.8)),
+    ("openai_moderation", {"hate": (True, 0.97), "harassment": (False, 0.1)}),
+    ("gemini_prompt", Skipped("openai_moderation", False)),
+])
+def test_responses_round_trip(slot, response):
+    assert decode_response(slot, encode_response(response)) == response
+
+
+def test_unavailable_round_trips():
+    decoded = decode_response("gemini_prompt", encode_response(Unavailable("timeout")))
+    assert isinstance(decoded, Unavailable) and decoded.reason == "timeout"
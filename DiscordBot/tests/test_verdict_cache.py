@@ -0,0 +1,55 @@
+import asyncio
+from verdict_cache import VerdictCache, content_key
+
+
+def test_identical_messages_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"openai_prompt": "result"}
+
+    async def main():
+        cache = VerdictCache()
+        return await asyncio.gather(*(cache.get_or_compute("Hello  there", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == [{"openai_prompt": "result"}] * 5
+    assert len(calls) == 1
+
+
+def test_waiters_recompute_when_the_leader_is_cancelled():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"openai_prompt": "result"}
+
+    async def main():
+        cache = VerdictCache()
+        leader = asyncio.create_task(cache.get_or_compute("message", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute("message", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == {"openai_prompt": "result"}
+    assert len(calls) == 2
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "verdicts.db")
+
+    async def compute():
+        return {"openai_moderation": {"hate": (False, 0.01)}}
+
+    async def fill():
+        cache = VerdictCache(db_path=path)
+        await cache.get_or_compute("message", compute)
+        await cache.writer
+
+    asyncio.run(fill())
+    cache = VerdictCache(db_path=path)
+    assert cache.get(content_key("message")) == {"openai_moderation": {"hate": (False, 0.01)}}
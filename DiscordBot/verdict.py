@@ -0,0 +1,120 @@
+# verdict.py
+"""
+The typed result of a prompt classifier, and the parsing that turns model output into one.
+
+The OpenAI and Gemini prompts ask for JSON matching VERDICT_SCHEMA through each provider's structured
+output mode, so a well-behaved answer is a single small object like {"violation": 1, "confidence": 0.9}.
+parse_verdict() also accepts that object wrapped in a code fence or surrounded by prose, and the
+older "<0|1> <confidence>" text format, so recorded responses and replays keep working.
+"""
+import re
+import json
+from dataclasses import dataclass
+from metrics import metrics
+from breaker import Unavailable
+
+# JSON schema for the structured output modes; kept to two short fields to minimise output tokens
+VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "violation": {"type": "integer", "enum": [0, 1]},
+        "confidence": {"type": "number"},
+    },
+    "required": ["violation", "confidence"],
+    "additionalProperties": False,
+}
+
+JSON_OBJECT = re.compile(r'\{.*?\}', re.DOTALL)
+LEGACY_FORMAT = re.compile(r'^\s*([01])\s*[, ]\s*(\d*\.?\d+)')
+
+
+class VerdictParseError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Verdict:
+    violation: bool
+    confidence: float
+
+    def to_dict(self) -> dict:
+        return {"violation": int(self.violation), "confidence": self.confidence}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Verdict":
+        violation = data["violation"]
+        if violation not in (0, 1, True, False):
+            raise VerdictParseError(f"violation must be 0 or 1, got {violation!r}")
+        confidence = float(data["confidence"])
+        return cls(bool(violation), min(1.0, max(0.0, confidence)))
+
+
+@dataclass(frozen=True)
+class Skipped:
+    """
+    A provider the cascade did not ask because an earlier stage already decided the message (see
+    cascade.py). `violation` is the decided outcome, which stands in for the provider's vote.
+    """
+    decided_by: str
+    violation: bool
+
+
+def parse_verdict(text: str) -> Verdict:
+    """
+    Reads a verdict from model output, tolerating code fences, surrounding text and the legacy format
+    :raises VerdictParseError: If no verdict can be found
+    """
+    match = JSON_OBJECT.search(text)
+    if match:
+        try:
+            return Verdict.from_dict(json.loads(match.group(0)))
+        except (ValueError, KeyError, TypeError):
+            pass
+    match = LEGACY_FORMAT.match(text)
+    if match:
+        return Verdict(match.group(1) == "1", min(1.0, float(match.group(2))))
+    raise VerdictParseError(f"Unparseable verdict: {text[:100]!r}")
+
+
+async def request_verdict(provider: str, call, retries: int) -> Verdict:
+    """
+    Runs `call()` (a coroutine function returning the model's text) and parses the answer, asking
+    again up to `retries` times if the output cannot be parsed
+    """
+    for attempt in range(retries + 1):
+        text = await call()
+        try:
+            return parse_verdict(text)
+        except VerdictParseError:
+            metrics.inc("verdict_parse_failures_total", provider=provider)
+            if attempt == retries:
+                raise
+
+
+def encode_response(response):
+    """
+    Turns a provider response into plain JSON data (for caches, recordings and the classification service)
+    """
+    if isinstance(response, Verdict):
+        return response.to_dict()
+    if isinstance(response, Unavailable):
+        return {"unavailable": response.reason}
+    if isinstance(response, Skipped):
+        return {"skipped": response.decided_by, "violation": int(response.violation)}
+    return response
+
+
+def decode_response(slot: str, data):
+    """
+    Inverse of encode_response. Prompt responses recorded as text before verdicts were typed are parsed.
+    """
+    if isinstance(data, dict) and "unavailable" in data:
+        return Unavailable(data["unavailable"])
+    if isinstance(data, dict) and "skipped" in data:
+        return Skipped(data["skipped"], bool(data["violation"]))
+    if slot == "openai_moderation":
+        # JSON has no tuples, so restore the (flagged, score) pairs
+        return {k: tuple(v) for k, v in data.items()}
+    if isinstance(data, str):
+        return parse_verdict(data)
+    return Verdict.from_dict(data)
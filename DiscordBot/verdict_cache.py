@@ -0,0 +1,168 @@
+# verdict_cache.py
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from verdict import encode_response, decode_response
+
+# Characters that render as nothing and are commonly used to dodge exact-match filters
+ZERO_WIDTH = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff\u00ad"), None)
+WHITESPACE = re.compile(r'\s+')
+
+# Result of an in-flight computation whose leader was cancelled: coalesced waiters look up again
+RETRY = object()
+
+
+def normalize(text: str) -> str:
+    """
+    Folds case, zero-width characters and runs of whitespace so copy-pasted variants of a message
+    map to the same text
+    """
+    text = unicodedata.normalize('NFKC', text).translate(ZERO_WIDTH).casefold()
+    return WHITESPACE.sub(' ', text).strip()
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode('utf8')).hexdigest()
+
+
+def _encode(verdicts: dict) -> str:
+    return json.dumps({name: encode_response(response) for name, response in verdicts.items()})
+
+
+def _decode(data: str) -> dict:
+    return {name: decode_response(name, response) for name, response in json.loads(data).items()}
+
+
+class VerdictCache:
+    """
+    Caches the combined classifier verdicts for a message, keyed by a hash of its normalized content.
+    The in-memory tier is a bounded LRU with a TTL; an optional SQLite file adds a second tier that
+    survives restarts, written in batches on a worker thread. Concurrent lookups for the same content
+    share a single in-flight computation.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600, db_path: str = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict() # Map from content key to (stored_at, verdicts)
+        self.inflight = {} # Map from content key to the future of the running computation
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.db = None
+        self.pending_writes = [] # (key, stored_at, data) not yet written to disk
+        self.writer = None # Task writing pending_writes, while there are any
+        if db_path:
+            # Reads happen on the event loop and writes on a worker thread, so the lock keeps them apart
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.lock = threading.Lock()
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, stored_at REAL, data TEXT)"
+            )
+            self.db.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if now - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        if self.db is not None:
+            with self.lock:
+                row = self.db.execute("SELECT stored_at, data FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row and now - row[0] < self.ttl:
+                verdicts = _decode(row[1])
+                self._remember(key, row[0], verdicts)
+                self.disk_hits += 1
+                return verdicts
+
+        return None
+
+    def put(self, key: str, verdicts: dict):
+        now = time.time()
+        self._remember(key, now, verdicts)
+        if self.db is not None:
+            self.pending_writes.append((key, now, _encode(verdicts)))
+            if self.writer is None:
+                self.writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Whatever is put while a batch is being written goes in the next one
+        try:
+            while self.pending_writes:
+                batch, self.pending_writes = self.pending_writes, []
+                await asyncio.to_thread(self._write, batch)
+        finally:
+            self.writer = None
+
+    def _write(self, rows: list):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO verdicts (key, stored_at, data) VALUES (?, ?, ?)", rows)
+            self.db.execute("DELETE FROM verdicts WHERE stored_at < ?", (time.time() - self.ttl,))
+            self.db.commit()
+
+    def _remember(self, key: str, stored_at: float, verdicts: dict):
+        self.entries[key] = (stored_at, verdicts)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_compute(self, text: str, compute, cacheable=None):
+        """
+        Returns the cached verdicts for a message, or runs `compute()` (a coroutine function) to produce
+        them. If the same content is already being computed, waits on that computation instead.
+        :param cacheable: Optional predicate; verdicts for which it returns False are returned but not stored
+        """
+        key = content_key(text)
+        verdicts = self.get(key)
+        if verdicts is not None:
+            return verdicts
+
+        if key in self.inflight:
+            self.coalesced += 1
+            verdicts = await asyncio.shield(self.inflight[key])
+            if verdicts is RETRY:
+                return await self.get_or_compute(text, compute, cacheable)
+            return verdicts
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            verdicts = await compute()
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; the others waiting on it start over (one of them computes)
+            future.set_result(RETRY)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # Mark as retrieved in case nobody else was waiting
+            raise
+        finally:
+            self.inflight.pop(key, None)
+
+        if cacheable is None or cacheable(verdicts):
+            self.put(key, verdicts)
+        future.set_result(verdicts)
+        return verdicts
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.entries),
+        }
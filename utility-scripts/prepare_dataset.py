@@ -0,0 +1,207 @@
+# prepare_dataset.py
+
+"""
+Prepares a labelled CSV (id,text,label) for evaluation or fine-tuning, streaming it in chunks so
+datasets with millions of rows never have to fit in memory. Replaces filter-csv.py and
+csv-to-finetune-jsonl.py.
+
+Per row, in order:
+  - labels are normalized to 0 / 1 ("1", "1.0", "true", "yes", ...); rows with any other label are dropped
+  - duplicates (same text after folding case and whitespace) are dropped, keeping the first
+  - rows longer than --max-tokens tokens are dropped; texts are tokenized with tiktoken's batched
+    encode_batch, one chunk at a time, spread across a process pool
+  - rows are assigned to the train or eval split by a hash of their id, so the split is stable
+    between runs
+
+Output is either the id,text,label CSV that evaluation.py reads, or the chat-format JSONL used for
+fine-tuning, written to <out>.csv / <out>.jsonl (or <out>.train.* and <out>.eval.* with --eval-fraction).
+
+Examples (run from utility-scripts):
+  # What filter-csv.py did: keep rows with at most 30 tokens
+  python prepare_dataset.py ../assets/anti-lgbt-cyberbullying.csv --max-tokens 30 --out ../assets/anti-lgbt-cyberbullying-filtered
+  # What csv-to-finetune-jsonl.py did
+  python prepare_dataset.py ../assets/anti-lgbt-cyberbullying-filtered.csv --format jsonl --out ../assets/anti_lgbt_finetune
+
+Notes carried over from the old scripts:
+  - The 30-token filter exists to save money on training a GPT-3.5 fine-tuned classifier; as a
+    tradeoff it reduces accuracy on longer messages. On anti-lgbt-cyberbullying.csv it kept 2212 of
+    4299 rows.
+  - Fine-tuning on the JSONL output failed, with this message from OpenAI:
+      The job failed due to an invalid training file. This training file was blocked because too
+      many examples were flagged by our moderation API for containing content that violates OpenAI's
+      usage policies in the following categories: hate. Use the free OpenAI Moderation API to
+      identify these examples and remove them from your training data.
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import zlib
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+LABELS = {"1": 1, "1.0": 1, "true": 1, "yes": 1, "0": 0, "0.0": 0, "false": 0, "no": 0}
+WHITESPACE = re.compile(r'\s+')
+
+encoding = None # Set in each pool process by init_worker
+
+
+def init_worker(model: str):
+  global encoding
+  import tiktoken
+  encoding = tiktoken.encoding_for_model(model)
+
+
+def count_tokens(texts: list) -> list:
+  # Runs in a pool process; encode_batch tokenizes the whole chunk in one call
+  return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=1)]
+
+
+def normalize_label(value):
+  return LABELS.get(str(value).strip().lower())
+
+
+def dedup_key(text: str) -> bytes:
+  return hashlib.blake2b(WHITESPACE.sub(" ", text).strip().casefold().encode("utf-8"), digest_size=8).digest()
+
+
+def is_eval(row_id: str, eval_fraction: float) -> bool:
+  return zlib.crc32(row_id.encode("utf-8")) % 10000 < eval_fraction * 10000
+
+
+def read_chunks(path: str, args):
+  """
+  Yields lists of (id, text, label) rows, with labels normalized and unusable rows counted
+  """
+  with open(path, newline="", encoding="utf-8-sig") as f:
+    reader = csv.reader(f)
+    header = next(reader)
+    text_col = header.index(args.text_column)
+    label_col = header.index(args.label_column)
+    id_col = header.index(args.id_column) if args.id_column in header else None
+    # A pandas export adds an unnamed index column to every row but not to the header
+    offset = 0
+    chunk = []
+    for n, row in enumerate(reader):
+      if not row:
+        continue
+      offset = len(row) - len(header)
+      label = normalize_label(row[label_col + offset]) if label_col + offset < len(row) else None
+      if label is None:
+        args.stats["bad_label"] += 1
+        continue
+      row_id = row[id_col + offset] if id_col is not None else str(n)
+      chunk.append((row_id, row[text_col + offset].strip(), label))
+      if len(chunk) >= args.chunk_size:
+        yield chunk
+        chunk = []
+    if chunk:
+      yield chunk
+
+
+class Writers:
+  """
+  One output file per split, in the chosen format
+  """
+
+  def __init__(self, out: str, fmt: str, split: bool):
+    self.fmt = fmt
+    self.files = {}
+    self.writers = {}
+    for name in (("train", "eval") if split else ("all",)):
+      path = f"{out}.{fmt}" if name == "all" else f"{out}.{name}.{fmt}"
+      self.files[name] = open(path, "w", newline="", encoding="utf-8")
+      if fmt == "csv":
+        self.writers[name] = csv.writer(self.files[name])
+        self.writers[name].writerow(["id", "text", "label"])
+      print(f"Writing {path}")
+
+  def write(self, name: str, row_id: str, text: str, label: int):
+    if self.fmt == "csv":
+      self.writers[name].writerow([row_id, text, label])
+    else:
+      self.files[name].write(json.dumps({
+        "messages": [
+          {"role": "user", "content": text},
+          {"role": "assistant", "content": str(label)}
+        ]
+      }) + "\n")
+
+  def close(self):
+    for f in self.files.values():
+      f.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Filter, deduplicate and split a labelled CSV")
+  parser.add_argument("input", help="Labelled CSV with a header row")
+  parser.add_argument("--out", required=True, help="Output path without extension")
+  parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+  parser.add_argument("--text-column", default="text")
+  parser.add_argument("--label-column", default="anti_lgbt")
+  parser.add_argument("--id-column", default="id")
+  parser.add_argument("--max-tokens", type=int, default=0, help="Drop rows with more tokens than this (0 keeps all)")
+  parser.add_argument("--tokenizer-model", default="gpt-3.5-turbo")
+  parser.add_argument("--no-dedup", action="store_true")
+  parser.add_argument("--eval-fraction", type=float, default=0.0, help="Share of rows for the eval split (0 writes one file)")
+  parser.add_argument("--chunk-size", type=int, default=10000)
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  args = parser.parse_args()
+  args.stats = {"read": 0, "bad_label": 0, "duplicate": 0, "too_long": 0, "written": 0}
+
+  seen = set()
+  writers = Writers(args.out, args.format, args.eval_fraction > 0)
+  pool = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args.tokenizer_model,)) if args.max_tokens else None
+  started = time.perf_counter()
+
+  def process(chunk, counts):
+    for (row_id, text, label), tokens in zip(chunk, counts):
+      if tokens is not None and tokens > args.max_tokens:
+        args.stats["too_long"] += 1
+        continue
+      writers.write("eval" if args.eval_fraction and is_eval(row_id, args.eval_fraction) else
+                    "train" if args.eval_fraction else "all", row_id, text, label)
+      args.stats["written"] += 1
+
+  try:
+    # Keep a few chunks tokenizing in the pool while earlier ones are written out
+    in_flight = []
+    for chunk in read_chunks(args.input, args):
+      args.stats["read"] += len(chunk)
+      if not args.no_dedup:
+        unique = []
+        for row in chunk:
+          key = dedup_key(row[1])
+          if key in seen:
+            args.stats["duplicate"] += 1
+            continue
+          seen.add(key)
+          unique.append(row)
+        chunk = unique
+      if pool is None:
+        process(chunk, [None] * len(chunk))
+      else:
+        in_flight.append((chunk, pool.submit(count_tokens, [text for _, text, _ in chunk])))
+        if len(in_flight) > args.workers * 2:
+          chunk, future = in_flight.pop(0)
+          process(chunk, future.result())
+      rate = args.stats["read"] / (time.perf_counter() - started)
+      print(f"{args.stats['read']} rows read, {args.stats['written']} written ({rate:,.0f} rows/s)", file=sys.stderr)
+    for chunk, future in in_flight:
+      process(chunk, future.result())
+  finally:
+    writers.close()
+    if pool is not None:
+      pool.shutdown()
+
+  elapsed = time.perf_counter() - started
+  print(f"Read {args.stats['read']} rows and wrote {args.stats['written']} in {elapsed:.1f}s ({args.stats['read'] / max(elapsed, 1e-9):,.0f} rows/s)")
+  print(f"Dropped: {args.stats['bad_label']} unusable labels, {args.stats['duplicate']} duplicates, {args.stats['too_long']} over {args.max_tokens} tokens")
+
+
+if __name__ == "__main__":
+  main()